@@ -0,0 +1,321 @@
+import os
+import time
+import queue
+import sqlite3
+import threading
+from collections import deque
+from datetime import datetime
+
+from metrics import ALERT_WRITE_SECONDS
+
+
+# ================================
+#  SINGLE-WRITER ALERT PERSISTENCE
+# ================================
+# All alert inserts go through one long-lived writer thread. Producers
+# (camera engines, video jobs) only put a row on a queue, which never
+# blocks on SQLite. The writer drains whatever has accumulated every
+# flush interval and inserts it in a single transaction on its own
+# connection, so there is no per-alert thread, no per-alert connection
+# and no lock thrash between writers. The database runs in WAL mode so
+# the dashboard's reads don't block the writer either.
+
+ALERT_FLUSH_INTERVAL = float(os.environ.get('ALERT_FLUSH_INTERVAL', 0.5))
+ALERT_MAX_BATCH = int(os.environ.get('ALERT_MAX_BATCH', 500))
+
+
+def connect(db_path, timeout=5):
+    """Open a connection with the pragmas every alerts connection should use"""
+    conn = sqlite3.connect(db_path, timeout=timeout, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+# Columns the /api/alerts filters hit; SQLite appends the rowid to every
+# index, so "WHERE col = ? ORDER BY id DESC LIMIT n" walks one index
+ALERT_INDEXES = {
+    'idx_alerts_timestamp': 'timestamp',
+    'idx_alerts_alert_type': 'alert_type',
+    'idx_alerts_severity': 'severity',
+    'idx_alerts_camera_id': 'camera_id',
+}
+
+# Columns added after the original table, with their types
+ALERT_EXTRA_COLUMNS = {
+    'camera_id': 'TEXT',
+    'class_name': 'TEXT',
+    'confidence': 'REAL',
+    'end_timestamp': 'TEXT',
+    'duration': 'REAL',
+    'track_id': 'INTEGER',
+    'start_offset': 'REAL',  # seconds into the recording, for offline videos
+    'end_offset': 'REAL',
+}
+
+ALERT_COLUMNS = ('id, alert_type, severity, timestamp, imageurl, camera_id, '
+                 'class_name, confidence, end_timestamp, duration, track_id, '
+                 'start_offset, end_offset')
+
+
+def ensure_schema(conn):
+    """Create the alerts table, add columns newer code relies on, build indexes"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_type TEXT NOT NULL,
+            severity TEXT NOT NULL,
+            timestamp TEXT NOT NULL,
+            imageurl TEXT NOT NULL
+        )
+    ''')
+    columns = {row[1] for row in conn.execute('PRAGMA table_info(alerts)')}
+    for column, column_type in ALERT_EXTRA_COLUMNS.items():
+        if column not in columns:
+            conn.execute(f'ALTER TABLE alerts ADD COLUMN {column} {column_type}')
+    for name, column in ALERT_INDEXES.items():
+        conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON alerts ({column})')
+    # Deletions counted in the database itself, whoever makes them (see table_version)
+    conn.execute('CREATE TABLE IF NOT EXISTS alert_counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+    conn.execute("INSERT OR IGNORE INTO alert_counters (name, value) VALUES ('deletions', 0)")
+    conn.execute('''
+        CREATE TRIGGER IF NOT EXISTS alerts_count_deletions AFTER DELETE ON alerts
+        BEGIN
+            UPDATE alert_counters SET value = value + 1 WHERE name = 'deletions';
+        END
+    ''')
+    conn.commit()
+
+
+def table_version(conn):
+    """A string that changes whenever alerts are inserted or deleted.
+
+    Read from the table (newest id, row count, persisted deletion count)
+    rather than from in-process state, so it holds across restarts and
+    when other processes write to the database.
+    """
+    max_id, count = conn.execute('SELECT MAX(id), COUNT(*) FROM alerts').fetchone()
+    deletions = conn.execute("SELECT value FROM alert_counters WHERE name = 'deletions'").fetchone()
+    return f"{max_id or 0}-{count}-{deletions[0] if deletions else 0}"
+
+
+def query_alerts(conn, limit=100, cursor=None, since=None, alert_type=None,
+                 severity=None, camera_id=None, start=None, end=None):
+    """Newest-first page of alerts matching the filters.
+
+    cursor: only alerts older than this id (the previous page's nextCursor)
+    since:  only alerts newer than this id (for incremental refreshes)
+    start/end: inclusive timestamp bounds in the stored "%Y-%m-%d %H:%M:%S" form
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    """
+    clauses, params = [], []
+    if cursor is not None:
+        clauses.append('id < ?')
+        params.append(cursor)
+    if since is not None:
+        clauses.append('id > ?')
+        params.append(since)
+    for column, value in (('alert_type', alert_type), ('severity', severity), ('camera_id', camera_id)):
+        if value:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    if start:
+        clauses.append('timestamp >= ?')
+        params.append(start)
+    if end:
+        clauses.append('timestamp <= ?')
+        params.append(end)
+
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    # Fetch one extra row to learn whether another page exists
+    rows = conn.execute(
+        f'SELECT {ALERT_COLUMNS} FROM alerts {where} ORDER BY id DESC LIMIT ?',
+        params + [limit + 1]
+    ).fetchall()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = rows[-1][0]
+    return rows, next_cursor
+
+
+class AlertFeed:
+    """In-process fan-out of newly persisted alerts to push subscribers.
+
+    Keeps the most recent rows in a ring buffer so a subscriber that
+    reconnects (or briefly falls behind) can resume from its last id
+    without touching SQLite; older gaps are backfilled from the DB by the
+    caller.
+    """
+
+    def __init__(self, buffer_size=1000):
+        self._rows = deque(maxlen=buffer_size)
+        self._cond = threading.Condition()
+        self.latest_id = 0
+        self.deletions = 0
+        self._deleted = deque(maxlen=buffer_size)
+
+    def seed(self, latest_id):
+        with self._cond:
+            self.latest_id = max(self.latest_id, latest_id or 0)
+
+    def publish(self, rows):
+        """rows: tuples in ALERT_COLUMNS order, ascending id"""
+        with self._cond:
+            for row in rows:
+                self._rows.append(row)
+                self.latest_id = max(self.latest_id, row[0])
+            self._cond.notify_all()
+
+    def publish_delete(self, alert_id):
+        with self._cond:
+            self.deletions += 1
+            self._deleted.append((self.deletions, alert_id))
+            self._cond.notify_all()
+
+    def oldest_buffered_id(self):
+        with self._cond:
+            return self._rows[0][0] if self._rows else None
+
+    def wait(self, after_id, after_deletion, timeout=15.0):
+        """Block until rows newer than after_id or new deletions exist.
+
+        Returns (rows, deleted_ids, deletion_mark); both lists are empty on
+        timeout.
+        """
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self.latest_id > after_id or self.deletions > after_deletion,
+                timeout=timeout
+            )
+            rows = [row for row in self._rows if row[0] > after_id]
+            deleted = [alert_id for mark, alert_id in self._deleted if mark > after_deletion]
+            return rows, deleted, self.deletions
+
+
+class AlertWriter:
+    def __init__(self, db_path, flush_interval=ALERT_FLUSH_INTERVAL, max_batch=ALERT_MAX_BATCH, feed=None):
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.feed = feed
+
+        self._queue = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.written = 0
+        self.failed = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.last_batch_size = 0
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='alert-writer', daemon=True)
+            self._thread.start()
+
+    def submit(self, alert_type, severity, imageurl, camera_id=None, timestamp=None,
+               class_name=None, confidence=None, end_timestamp=None, duration=None, track_id=None,
+               start_offset=None, end_offset=None):
+        """Queue one alert row; returns immediately"""
+        if timestamp is None:
+            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self._queue.put((alert_type, severity, timestamp, imageurl, camera_id,
+                         class_name, confidence, end_timestamp, duration, track_id,
+                         start_offset, end_offset))
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def close(self, timeout=10):
+        """Stop the writer after flushing everything still queued"""
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+
+    def stats(self):
+        return {
+            'running': self.is_running(),
+            'queueDepth': self.queue_depth(),
+            'written': self.written,
+            'failed': self.failed,
+            'flushes': self.flushes,
+            'lastBatchSize': self.last_batch_size,
+            'lastFlushMs': round(self.last_flush_seconds * 1000, 2),
+            'maxFlushMs': round(self.max_flush_seconds * 1000, 2),
+        }
+
+    # ---------- writer thread ----------
+    def _drain(self):
+        rows = []
+        while len(rows) < self.max_batch:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return rows
+
+    def _run(self):
+        conn = connect(self.db_path)
+        try:
+            while True:
+                stopping = self._stop_event.wait(timeout=self.flush_interval)
+                while True:
+                    rows = self._drain()
+                    if not rows:
+                        break
+                    self._flush(conn, rows)
+                if stopping:
+                    break
+        finally:
+            conn.close()
+
+    def _flush(self, conn, rows, max_retries=5, retry_delay_seconds=0.1):
+        start = time.monotonic()
+        for attempt in range(max_retries):
+            try:
+                with conn:
+                    conn.executemany('''
+                        INSERT INTO alerts (alert_type, severity, timestamp, imageurl, camera_id,
+                                            class_name, confidence, end_timestamp, duration, track_id,
+                                            start_offset, end_offset)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ''', rows)
+                    # One writer, one transaction: the new ids are consecutive
+                    last_id = conn.execute('SELECT last_insert_rowid()').fetchone()[0]
+                break
+            except sqlite3.OperationalError as e:
+                # Another connection (e.g. a delete) briefly holds the lock
+                if ('locked' in str(e).lower() or 'busy' in str(e).lower()) and attempt < max_retries - 1:
+                    time.sleep(retry_delay_seconds)
+                    continue
+                print(f"❌ SQLite error saving {len(rows)} alerts: {str(e)}")
+                self.failed += len(rows)
+                return
+            except Exception as e:
+                print(f"❌ Error saving {len(rows)} alerts: {str(e)}")
+                self.failed += len(rows)
+                return
+
+        elapsed = time.monotonic() - start
+        if self.feed is not None:
+            first_id = last_id - len(rows) + 1
+            self.feed.publish([(first_id + i,) + tuple(row) for i, row in enumerate(rows)])
+        self.written += len(rows)
+        self.flushes += 1
+        self.last_batch_size = len(rows)
+        self.last_flush_seconds = elapsed
+        self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+        ALERT_WRITE_SECONDS.observe(elapsed)
+        print(f"✅ Saved {len(rows)} alert(s) in {elapsed * 1000:.1f} ms")
@@ -1,16 +1,39 @@
 import os
-import re
 import cv2
 import sqlite3
-from flask import Flask, request, jsonify, send_from_directory, Response, abort
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
-from ultralytics import YOLO
+from inference_backend import LazyModel
 from datetime import datetime
 from werkzeug.utils import secure_filename
-import base64
+from werkzeug.security import safe_join
+import threading
 import time
+import atexit
 import json
-import threading
+import hashlib
+import math
+import alert_store
+from alert_store import AlertWriter, AlertFeed
+from jobs import JobManager, JobCancelled, QueueFull, FINISHED_STATES
+from pipeline import run_pipeline
+from camera_engine import EngineRegistry, MJPEG_BOUNDARY, configure_webcam
+from scheduler import InferenceScheduler
+from serving import ProcessEngineRegistry
+from inference import (CLASS_NAMES, ALERT_CLASSES, INFERENCE_BATCH_SIZE, predict_batch, extract_detections,
+                       alert_detections)
+from events import EventAggregator, alert_hooks
+from tracking import TRACKING_ENABLED, TRACK_IOU_THRESHOLD, TRACK_MAX_AGE_SECONDS, IoUTracker, draw_tracks
+from motion import (MOTION_GATE_ENABLED, MOTION_THUMB_WIDTH, MOTION_PIXEL_THRESHOLD, MOTION_AREA_THRESHOLD,
+                    MOTION_REFRESH_SECONDS, MotionGate)
+from tiling import TileLayout, load_tiling_config
+from media import send_media
+from ingest import IngestManager, UploadError
+from result_cache import ResultCache, CacheEntry, cache_key, file_digest, weights_digest
+from detection_index import (DETECTION_INDEX_VERSION, DetectionIndexWriter, index_path_for, load_index,
+                             parse_classes, query as query_detections, incidents, rows_to_dicts)
+from video_output import HLS_PLAYLIST, hls_dir_for, open_video_output, resolve_format
+from metrics import REGISTRY, ACTIVE_STREAMS, VIDEO_FRAMES, Counter, Gauge, observe_stage
 
 
 # ================================
@@ -21,67 +44,55 @@ CORS(app, resources={r"/*": {"origins": "*"}})  # enable CORS for all routes
 
 # Use absolute paths anchored to this file's directory to avoid CWD issues
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-UPLOAD_FOLDER = os.path.join(BASE_DIR, 'uploads')
-PROCESSED_FOLDER = os.path.join(BASE_DIR, 'processed')
-DB_PATH = os.path.join(BASE_DIR, 'invigilation.db')
+# Uploads, processed media and the database live here (benchmarks point it
+# at a scratch directory)
+DATA_DIR = os.environ.get('DATA_DIR', BASE_DIR)
+UPLOAD_FOLDER = os.path.join(DATA_DIR, 'uploads')
+PROCESSED_FOLDER = os.path.join(DATA_DIR, 'processed')
+DB_PATH = os.path.join(DATA_DIR, 'invigilation.db')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
-# Load YOLO model
-model = YOLO('./best.pt')   # your trained model path
+# YOLO on the configured runtime (INFERENCE_BACKEND / INFERENCE_PRECISION).
+# Loaded on first use or by the startup warm-up, never at import
+model_provider = LazyModel()
+
+# production: warm the model up at startup and leave debug off
+APP_ENV = os.environ.get('APP_ENV', 'development')
+MODEL_WARMUP = os.environ.get('MODEL_WARMUP', '1' if APP_ENV == 'production' else '0') in ('1', 'true')
+STARTED_AT = time.time()
 
 ALLOWED_EXT = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
 
-# Class names mapping
-CLASS_NAMES = {
-    0: 'backwardMove',
-    1: 'correctPosture',
-    2: 'leftSideMove',
-    3: 'passingNotes',
-    4: 'rightSideMove'
-}
+# Offline processing runs on a bounded pool so throughput is limited by
+# cores rather than by HTTP request timeouts
+INFERENCE_WORKERS = int(os.environ.get('INFERENCE_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+MAX_PENDING_JOBS = int(os.environ.get('MAX_PENDING_JOBS', 32))
+job_manager = JobManager(max_workers=INFERENCE_WORKERS, max_pending=MAX_PENDING_JOBS)
 
-# Classes to alert on
-ALERT_CLASSES = [0, 2, 3, 4]  # backwardMove, leftSideMove, passingNotes, rightSideMove
+# Run the model on every Nth frame of uploaded videos; boxes on the frames
+# in between are extrapolated by the tracker (a stride > 1 turns tracking on)
+VIDEO_INFERENCE_STRIDE = max(1, int(os.environ.get('VIDEO_INFERENCE_STRIDE', 1)))
 
-# Lock for database operations
-db_lock = threading.Lock()
+# Camera label on the metrics of uploaded-video jobs (one series for all of them)
+VIDEO_METRICS_CAMERA = 'upload'
+
+# Finished results by (video, weights, settings); evicts least recently
+# used outputs once PROCESSED_FOLDER holds RESULT_CACHE_MAX_BYTES of them
+result_cache = ResultCache(PROCESSED_FOLDER)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXT
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect(DB_PATH, timeout=5, check_same_thread=False)
-    #conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS alerts (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            alert_type TEXT NOT NULL,
-            severity TEXT NOT NULL,
-            timestamp TEXT NOT NULL,
-            imageurl TEXT NOT NULL
-        )
-    ''')
-    conn.commit()
+    conn = alert_store.connect(DB_PATH)  # also switches the DB to WAL mode
+    alert_store.ensure_schema(conn)
+    # Push subscribers start from the newest existing alert
+    alert_feed.seed(conn.execute('SELECT MAX(id) FROM alerts').fetchone()[0])
     conn.close()
     print("✅ Database initialized successfully")
 
-# Check if any alert classes are detected in results
-def check_alerts(results):
-    """Check if any alert classes (0,2,3,4) are detected in YOLO results"""
-    try:
-        if results[0].boxes is not None and len(results[0].boxes) > 0:
-            classes = results[0].boxes.cls.cpu().numpy()
-            confidences = results[0].boxes.conf.cpu().numpy()
-            for cls, conf in zip(classes, confidences):
-                if int(cls) in ALERT_CLASSES:
-                    return True, int(cls), float(conf)
-        return False, None, 0.0
-    except:
-        return False, None, 0.0
-
 # Determine severity based on confidence
 def get_severity(confidence):
     if confidence >= 0.7:
@@ -91,63 +102,52 @@ def get_severity(confidence):
     else:
         return 'low'
 
+# Single writer thread that batches alert inserts into one transaction
+alert_feed = AlertFeed()
+alert_writer = AlertWriter(DB_PATH, feed=alert_feed)
+
 # Save alert to database
-def save_alert(alert_type, severity, image_filename, imageurl):
-    """Save alert to database with simple retries to avoid transient SQLite locks"""
-    max_retries = 5
-    retry_delay_seconds = 0.1
-    attempt = 0
-    while attempt < max_retries:
-        conn = None
-        try:
-            conn = sqlite3.connect(DB_PATH, timeout=5)
-            cursor = conn.cursor()
-            # Use current timestamp
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            cursor.execute('''
-                INSERT INTO alerts (alert_type, severity, timestamp, imageurl)
-                VALUES (?, ?, ?, ?)
-            ''', (alert_type, severity, timestamp, imageurl))
-            conn.commit()
-            print(f"✅ Alert saved: {alert_type}, {severity}, {imageurl}")
-            return
-        except sqlite3.OperationalError as e:
-            # Handle database locked or busy
-            if 'locked' in str(e).lower() or 'busy' in str(e).lower():
-                attempt += 1
-                if conn:
-                    try:
-                        conn.rollback()
-                    except:
-                        pass
-                    conn.close()
-                time.sleep(retry_delay_seconds)
-                continue
-            else:
-                print(f"❌ SQLite error saving alert: {str(e)}")
-                if conn:
-                    try:
-                        conn.rollback()
-                    except:
-                        pass
-                    conn.close()
-                break
-        except Exception as e:
-            print(f"❌ Error saving alert: {str(e)}")
-            if conn:
-                try:
-                    conn.rollback()
-                except:
-                    pass
-                conn.close()
-            break
-        finally:
-            if conn:
-                try:
-                    conn.close()
-                except:
-                    pass
-    print("⚠️ Gave up saving alert after retries")
+def save_alert(alert_type, severity, image_filename, imageurl, camera_id=None, **event_fields):
+    """Queue an alert for the background writer; never blocks on SQLite"""
+    alert_writer.submit(alert_type, severity, imageurl, camera_id, **event_fields)
+
+def make_event_saver(alert_type, image_prefix, camera_id, host_url, recording_started=None):
+    """on_event callback writing one snapshot + one DB row per aggregated event.
+
+    recording_started: None when event times are time.time() values (live
+    cameras); otherwise event times are offsets into a recording, stored as
+    start/end offsets, and timestamps count from this time.time() value.
+    """
+    def on_event(event):
+        severity = get_severity(event.peak_confidence)
+        class_name = CLASS_NAMES.get(event.class_id, 'unknown')
+        offsets = {}
+        origin = 0.0
+        if recording_started is not None:
+            offsets = {'start_offset': round(event.start, 3), 'end_offset': round(event.end, 3)}
+            origin = recording_started
+        started = datetime.fromtimestamp(origin + event.start)
+        ended = datetime.fromtimestamp(origin + event.end)
+
+        # Millisecond + class in the name so events never overwrite each other
+        stamp = started.strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        track = f"_t{event.track_id}" if event.track_id is not None else ''
+        image_filename = f"{image_prefix}_{camera_id}_{class_name}{track}_{stamp}.jpg"
+        image_path = os.path.join(PROCESSED_FOLDER, image_filename)
+        cv2.imwrite(image_path, event.snapshot())
+
+        imageurl = f"{host_url}/processed/{image_filename}"
+        save_alert(
+            alert_type, severity, image_filename, imageurl, camera_id,
+            timestamp=started.strftime("%Y-%m-%d %H:%M:%S"),
+            end_timestamp=ended.strftime("%Y-%m-%d %H:%M:%S"),
+            class_name=class_name,
+            confidence=round(event.peak_confidence, 3),
+            duration=round(event.duration, 2),
+            track_id=event.track_id,
+            **offsets
+        )
+    return on_event
 
 # Initialize database on startup
 # threading.Thread(
@@ -156,7 +156,38 @@ def save_alert(alert_type, severity, image_filename, imageurl):
 #                 daemon=False
 #                 ).start()
 #save_alert('web','high','webcam_2_20251103_123846.jpg', r'C:\Users\palab\OneDrive\Desktop\Major Project\Invigilation_buddy1\backend\processed\webcam_2_20251103_123846.jpg')
-init_db()
+_started = False
+_startup_lock = threading.Lock()
+
+def startup():
+    """One-time process setup: schema, alert writer and, if enabled, model warm-up.
+
+    Nothing here runs at import; it happens on the first request (see
+    ensure_started) or explicitly from __main__, so importing the app for
+    tests or tooling stays cheap.
+    """
+    global _started
+    if _started:
+        return
+    with _startup_lock:
+        if _started:
+            return
+        init_db()
+        alert_writer.start()
+        # Flush anything still queued so no alert is lost on shutdown
+        atexit.register(alert_writer.close)
+        if MODEL_WARMUP:
+            # Single frames for live cameras, full batches for video jobs
+            model_provider.warm_up_async(batch_sizes=(1, INFERENCE_BATCH_SIZE))
+            if SERVING_MODE == 'processes':
+                camera_engines.start_workers()
+        _started = True
+
+@app.before_request
+def ensure_started():
+    # Liveness must answer even when setup is failing
+    if request.endpoint != 'healthz':
+        startup()
 # ================================
 #  ROUTE: Upload + Process Video
 # ================================
@@ -166,6 +197,31 @@ init_db()
 def greet():
     return "Hello"
 
+# ================================
+#  ROUTES: Liveness / Readiness
+# ================================
+@app.route('/healthz')
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({'status': 'ok', 'uptimeSeconds': round(time.time() - STARTED_AT, 1)}), 200
+
+@app.route('/readyz')
+def readyz():
+    """Readiness: route traffic here only once the DB is set up and the model is warm"""
+    model_state = model_provider.stats()
+    if not model_state['warm']:
+        # Without startup warm-up (development) the first probe starts it
+        model_provider.warm_up_async(batch_sizes=(1, INFERENCE_BATCH_SIZE))
+    ready = _started and model_state['warm'] and alert_writer.is_running()
+    body = {'ready': ready, 'model': model_state, 'alertWriter': alert_writer.is_running()}
+    if SERVING_MODE == 'processes':
+        # Live cameras run on the workers' models
+        camera_engines.start_workers()
+        body['workers'] = camera_engines.ready()
+        ready = ready and body['workers']
+        body['ready'] = ready
+    return jsonify(body), 200 if ready else 503
+
 @app.route('/api/process-video', methods=['POST'])
 def process_video():
     if 'video' not in request.files:
@@ -177,230 +233,664 @@ def process_video():
     if video_file.filename == '' or not allowed_file(video_file.filename):
         return jsonify({'error': 'Invalid file'}), 400
 
+    # 'hls' makes the result playable while it is still being processed
+    try:
+        output_format = resolve_format(request.form.get('output'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
     # Save uploaded video
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename_safe = secure_filename(f"{camera_id}_{timestamp}.mp4")
     input_path = os.path.join(UPLOAD_FOLDER, filename_safe)
+    video_file.save(input_path)
+    host_url = request.host_url.rstrip('/')
+
+    # Hand the heavy lifting to the worker pool and return straight away;
+    # the client polls /api/jobs/<id> for progress. The job first checks the
+    # result cache (see run_saved_video_job)
+    try:
+        job = queue_video_job(run_saved_video_job, input_path, camera_id, host_url, output_format)
+    except QueueFull as e:
+        return jsonify({'error': f'Processing queue is full: {str(e)}'}), 503
+
+    return jsonify(job_links(job, host_url)), 202
+
+
+def video_cache_key(video_digest, output_format):
+    """Result cache key: everything that changes what run_video_job writes"""
+    tracking = TRACKING_ENABLED or VIDEO_INFERENCE_STRIDE > 1
+    settings = {
+        'backend': model_provider.backend,
+        'precision': model_provider.precision,
+        'imgsz': model_provider.imgsz,
+        'stride': VIDEO_INFERENCE_STRIDE,
+        'tracking': [TRACK_IOU_THRESHOLD, TRACK_MAX_AGE_SECONDS] if tracking else None,
+        'motionGate': ([MOTION_THUMB_WIDTH, MOTION_PIXEL_THRESHOLD, MOTION_AREA_THRESHOLD, MOTION_REFRESH_SECONDS]
+                       if MOTION_GATE_ENABLED else None),
+        'output': output_format,
+        'detectionIndex': DETECTION_INDEX_VERSION,
+    }
+    return cache_key(video_digest, weights_digest(model_provider.weights), settings)
+
+
+def queue_video_job(fn, source, camera_id, host_url, output_format, cache_key=None, **meta):
+    """Submit fn(job, source, output_path, camera_id, host_url, output_format) for a new output file.
+
+    cache_key, if known up front, is left in job.meta for fn to look up
+    (see reuse_cached_result).
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_basename = f"{camera_id}_{timestamp}_processed.mp4"
     output_path = os.path.join(PROCESSED_FOLDER, output_basename)
-    video_file.save(input_path)
+    playlist_url = None
+    if output_format == 'hls':
+        playlist_url = f"{host_url}/processed/{os.path.basename(hls_dir_for(output_path))}/{HLS_PLAYLIST}"
+    if cache_key is not None:
+        meta['cacheKey'] = cache_key
+    job = job_manager.submit(
+        'process-video', fn,
+        source, output_path, camera_id, host_url, output_format,
+        meta={'cameraId': camera_id, 'processedVideoUrl': f"{host_url}/processed/{output_basename}",
+              'playlistUrl': playlist_url, 'playlistReady': False, **meta}
+    )
+    return job
+
+
+def job_links(job, host_url):
+    return {
+        'jobId': job.id,
+        'status': job.status,
+        'statusUrl': f"{host_url}/api/jobs/{job.id}",
+        'processedVideoUrl': job.meta.get('processedVideoUrl'),
+        'playlistUrl': job.meta.get('playlistUrl')
+    }
+
+
+# Added to every response that reuses another run's output: that run wrote
+# the alerts and snapshots (under its own cameraId), this one writes none
+REUSED_RESULT_NOTE = {
+    'alertsSaved': False,
+    'note': 'This video was already processed with the same settings; its output is reused '
+            'and no new alerts or snapshots were saved'
+}
 
-    # ================================
-    #  PROCESS VIDEO USING YOLO
-    # ================================
+def cached_links(entry, host_url):
+    playlist = entry.result.get('playlist')
+    return {
+        'cached': True,
+        'processedVideoUrl': f"{host_url}/processed/{entry.video}",
+        'playlistUrl': f"{host_url}/processed/{playlist}" if playlist else None,
+        'detectionsUrl': f"{host_url}/api/detections/{entry.video}",
+        **REUSED_RESULT_NOTE
+    }
+
+
+def result_links(existing, host_url):
+    """job_links for a running job, or the same fields for a cached result"""
+    if not isinstance(existing, CacheEntry):
+        return job_links(existing, host_url)
+    return {
+        'jobId': None,
+        'status': 'completed',
+        'statusUrl': None,
+        **cached_links(existing, host_url),
+        'result': {name: value for name, value in existing.result.items() if name != 'playlist'}
+    }
+
+
+# How often a job waiting on another job processing the same video checks on it
+CACHE_FOLLOW_POLL_SECONDS = 0.5
+
+def reuse_cached_result(job, key, host_url):
+    """Result for key from the cache, waiting for the job producing it if needed.
+
+    Returns None once job itself has claimed key and has to process the video.
+    """
+    while True:
+        existing = result_cache.lookup_or_claim(key, job)
+        if existing is None:
+            return None
+        if isinstance(existing, CacheEntry):
+            links = cached_links(existing, host_url)
+            job.meta.update(processedVideoUrl=links['processedVideoUrl'], playlistUrl=links['playlistUrl'],
+                            playlistReady=links['playlistUrl'] is not None)
+            summary = {name: value for name, value in existing.result.items() if name != 'playlist'}
+            return {**summary, **links}
+        # Same content is being processed right now: wait for it, then look
+        # again (if it failed, the next lookup lets this job take over)
+        while existing.status not in FINISHED_STATES:
+            job.check_cancelled()
+            job.update(existing.frames_processed, existing.total_frames)
+            time.sleep(CACHE_FOLLOW_POLL_SECONDS)
+
+
+def run_saved_video_job(job, input_path, output_path, camera_id, host_url, output_format):
+    """run_video_job for an upload saved in one piece, answered from the cache when possible"""
+    if result_cache.enabled:
+        # Hashed here rather than in the request, so a big upload gets its jobId straight away
+        reused = reuse_cached_result(job, video_cache_key(file_digest(input_path), output_format), host_url)
+        if reused is not None:
+            os.remove(input_path)
+            return reused
+    return run_video_job(job, input_path, output_path, camera_id, host_url, output_format)
+
+
+def cache_video_result(key, job, output_path, result):
+    """Add a finished job's files to the result cache, handing over its claim on key"""
+    files = [os.path.basename(output_path), os.path.basename(index_path_for(output_path))]
+    playlist = None
+    if result.get('playlistUrl'):
+        hls_dir = os.path.basename(hls_dir_for(output_path))
+        files.append(hls_dir)
+        playlist = f"{hls_dir}/{HLS_PLAYLIST}"
+    summary = {name: value for name, value in result.items() if not name.endswith('Url')}
+    try:
+        result_cache.store(key, files, {**summary, 'playlist': playlist}, job)
+    except OSError as e:
+        result_cache.release(key, job)
+        print(f"⚠️ Could not cache result {files[0]}: {str(e)}")
+
+
+def run_video_job(job, input_path, output_path, camera_id, host_url, output_format='mp4'):
+    """Run YOLO over an uploaded video, writing the annotated copy to output_path"""
     cap = cv2.VideoCapture(input_path)
-    fourcc = cv2.VideoWriter_fourcc(*'avc1')
-    fps = int(cap.get(cv2.CAP_PROP_FPS)) or 30
+    # Timestamps use the exact rate (29.97 fps drifts 1s every ~17 min as 29);
+    # the writer and playlist cadence only need whole frames
+    source_fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    fps = int(source_fps) or 30
     width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-    out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)) or 0
+    # Plain MP4, or an HLS playlist that grows as frames are written plus the MP4
+    out = open_video_output(output_path, fps, width, height, output_format)
+    job.update(0, total_frames)
 
-    frame_count = 0
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    # Consecutive detections are merged into events on the video's own clock;
+    # rows keep those offsets and are timestamped from when the job started
+    aggregator = EventAggregator(make_event_saver('video', 'video', camera_id, host_url,
+                                                  recording_started=job.started_at or time.time()))
+    # Every detection, per frame, for search and seek (see detection_index.py)
+    detections = DetectionIndexWriter(index_path_for(output_path), source_fps)
 
-        results = model(frame, verbose=False)
-        annotated = results[0].plot()
+    # Optional stages in front of the model: a tracker (needed to run on a
+    # sparse stride) and a motion gate that skips near-identical frames
+    tracker = IoUTracker() if (TRACKING_ENABLED or VIDEO_INFERENCE_STRIDE > 1) else None
+    gate = MotionGate() if MOTION_GATE_ENABLED else None
+    stride = VIDEO_INFERENCE_STRIDE if tracker is not None else 1
+    frames_seen = [0]
+    last_result = [None]
+    indexed_result = [None]
+
+    def infer(frames):
+        # Run every stride-th frame, and of those only what the gate lets through
+        first = frames_seen[0]
+        frames_seen[0] += len(frames)
+        picked = []
+        for i, frame in enumerate(frames):
+            index = first + i
+            if index % stride:
+                continue
+            if gate is not None and not gate.check(frame, index / source_fps):
+                continue
+            picked.append(i)
+        batch_results = predict_batch(model_provider.get(), [frames[i] for i in picked])
+        results = [None] * len(frames)
+        for i, result in zip(picked, batch_results):
+            results[i] = result
+        if tracker is None:
+            # No tracker to extrapolate with: skipped frames reuse the latest detections
+            for i in range(len(frames)):
+                if results[i] is None:
+                    results[i] = last_result[0]
+                else:
+                    last_result[0] = results[i]
+        return results
+
+    def annotate(frame, result):
+        if tracker is not None:
+            return None  # drawn in on_frame once the tracker has run
+        # result may be reused from an earlier frame, so draw onto this one
+        return result.plot(img=frame)
+
+    if tracker is None and gate is None:
+        infer = annotate = None  # plain batched predict + plot
+
+    def timings(stage, seconds, frames):
+        # Batch stages are recorded as per-frame time, once per frame; the
+        # cameraId of an upload is client-supplied, so it is not a label
+        observe_stage('video', VIDEO_METRICS_CAMERA, stage, seconds / frames, frames)
+        if stage == 'encode':
+            VIDEO_FRAMES.inc(camera=VIDEO_METRICS_CAMERA)
+
+    def on_frame(frame_index, frame, result, annotated):
+        timestamp = frame_index / source_fps
+        if tracker is None:
+            aggregator.observe(timestamp, alert_detections([result]), snapshot=annotated)
+            # A gate-skipped frame carries the last result forward in the video
+            # and its events, but the index only records what the model saw
+            fresh = result is not indexed_result[0]
+            indexed_result[0] = result
+            detections.add_result(frame_index, result if fresh else None)
+        elif result is not None:
+            tracked = tracker.update(timestamp, extract_detections(result))
+            detections.add_detections(frame_index, tracked)
+            annotated = draw_tracks(frame, tracked)
+            aggregator.observe(timestamp, [(d['cls'], d['conf'], d['track']) for d in tracked
+                                           if d['cls'] in ALERT_CLASSES], snapshot=annotated)
+        else:
+            # Skipped frame: draw where the tracks are expected to be now and
+            # keep their events open
+            predicted = tracker.predict(timestamp)
+            detections.add_detections(frame_index, predicted)
+            annotated = draw_tracks(frame, predicted)
+            aggregator.observe(timestamp, [(d['cls'], d['conf'], d['track']) for d in predicted
+                                           if d['cls'] in ALERT_CLASSES], snapshot=annotated)
+        encode_start = time.perf_counter()
         out.write(annotated)
+        encode_seconds = time.perf_counter() - encode_start
+        job.update(frame_index + 1)
+        if out.playlist_path and not job.meta['playlistReady'] and frame_index % fps == 0:
+            job.meta['playlistReady'] = out.playlist_ready()
+        return encode_seconds
+
+    completed = False
+    try:
+        # Decode, batched inference and annotate+encode overlap in a
+        # three-stage pipeline with bounded queues
+        frame_count = run_pipeline(cap, model_provider.get(), on_frame, check_cancelled=job.check_cancelled,
+                                   infer=infer, annotate=annotate, timings=timings)
+        # A streamed upload that was abandoned or de-duplicated ends as EOF
+        job.check_cancelled()
+        aggregator.flush()
+        detections.save()
+        completed = True
+    except JobCancelled:
+        # Don't leave a truncated video (or playlist) behind for a cancelled job
+        out.discard()
+        raise
+    finally:
+        cap.release()
+        try:
+            out.release()
+        except RuntimeError as e:
+            # e.g. ffmpeg exiting non-zero; when the job is already failing
+            # (or cancelled) that error is the one to report, not this
+            if completed:
+                completed = False
+                raise
+            print(f"⚠️ Video writer for {os.path.basename(output_path)} also failed: {str(e)}")
+        finally:
+            # A completed job keeps its claim until store() replaces it with
+            # the entry (below); anything else gives it up here
+            if not completed and job.meta.get('cacheKey'):
+                result_cache.release(job.meta['cacheKey'], job)
+    if out.playlist_path:
+        job.meta['playlistReady'] = out.playlist_ready()
+
+    result = {'processedVideoUrl': f"{host_url}/processed/{os.path.basename(output_path)}",
+              'playlistUrl': job.meta.get('playlistUrl'),
+              'detectionsUrl': f"{host_url}/api/detections/{os.path.basename(output_path)}",
+              'frames': frame_count,
+              'motionGate': gate.stats() if gate else None}
+    if job.meta.get('cacheKey'):
+        cache_video_result(job.meta['cacheKey'], job, output_path, result)
+    return result
+
+
+# ================================
+#  ROUTES: Chunked / resumable upload
+# ================================
+# POST   /api/upload-video        {filename, size, cameraId, sha256?, output?}
+# PATCH  /api/upload-video/<id>   raw bytes; Upload-Offset header = where they go
+# GET    /api/upload-video/<id>   offset to resume from, status and job
+# Processing starts while the upload is still arriving (see ingest.py)
+def start_upload_job(session):
+    # The cache key is known here only if the upload already completed
+    key = None
+    if session.digest and result_cache.enabled:
+        key = video_cache_key(session.digest, session.output_format)
+    return queue_video_job(run_upload_job, session, session.camera_id, session.host_url,
+                           session.output_format, cache_key=key, uploadId=session.id)
+
+def find_upload_duplicate(digest, session):
+    if not result_cache.enabled:
+        return None
+    # A job started before the hash was known claims key in the same step,
+    # so from now on it is the one producing it
+    return result_cache.lookup_or_claim(video_cache_key(digest, session.output_format), session.job)
+
+def run_upload_job(job, session, output_path, camera_id, host_url, output_format):
+    key = job.meta.get('cacheKey')
+    if key is not None:
+        # Completed before the job was queued; another upload may have beaten it to the cache
+        reused = reuse_cached_result(job, key, host_url)
+        if reused is not None:
+            os.remove(session.path)
+            return reused
+    with upload_manager.source_for(session, job) as source:
+        return run_video_job(job, source, output_path, camera_id, host_url, output_format)
+
+upload_manager = IngestManager(UPLOAD_FOLDER, start_upload_job, find_upload_duplicate)
+
+def upload_status(session, host_url):
+    body = session.to_dict()
+    body['uploadUrl'] = f"{host_url}/api/upload-video/{session.id}"
+    existing = session.duplicate_of or session.job
+    if existing is not None:
+        body.update(result_links(existing, host_url))
+    if session.duplicate_of is not None:
+        body.update(REUSED_RESULT_NOTE)
+    return body
+
+@app.route('/api/upload-video', methods=['POST'])
+def create_upload():
+    try:
+        data = request.json or {}
+        filename = data.get('filename', '')
+        camera_id = data.get('cameraId', 'unknown')
+        if not allowed_file(filename):
+            return jsonify({'error': 'Invalid file'}), 400
+        try:
+            output_format = resolve_format(data.get('output'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        host_url = request.host_url.rstrip('/')
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        extension = filename.rsplit('.', 1)[1].lower()
+        # Keep the container's extension: it decides whether we can decode early
+        input_path = os.path.join(UPLOAD_FOLDER, secure_filename(f"{camera_id}_{timestamp}.{extension}"))
+        session, existing = upload_manager.create(filename, data.get('size'), camera_id, input_path, host_url,
+                                                  output_format, sha256=data.get('sha256'))
+        if existing is not None:
+            # Already processed (or processing): nothing to upload
+            return jsonify({'duplicate': True, **result_links(existing, host_url), **REUSED_RESULT_NOTE}), 200
+        return jsonify(upload_status(session, host_url)), 201
+    except UploadError as e:
+        return jsonify({'error': str(e)}), e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/upload-video/<upload_id>', methods=['GET', 'PATCH'])
+def upload_chunk(upload_id):
+    session = upload_manager.get(upload_id)
+    if session is None:
+        return jsonify({'error': 'Upload not found'}), 404
+    host_url = request.host_url.rstrip('/')
+    try:
+        if request.method == 'PATCH':
+            offset = request.headers.get('Upload-Offset', type=int)
+            if offset is None:
+                return jsonify({'error': 'Upload-Offset header is required'}), 400
+            upload_manager.append(session, offset, request.stream, request.content_length)
+        else:
+            upload_manager.resume_start(session)
+        resp = jsonify(upload_status(session, host_url))
+        resp.headers['Upload-Offset'] = str(session.offset)
+        return resp, 200
+    except UploadError as e:
+        resp = jsonify({'error': str(e), 'offset': e.offset})
+        resp.headers['Upload-Offset'] = str(session.offset)
+        return resp, e.status
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+# ================================
+#  ROUTE: Detection search
+# ================================
+# GET /api/detections/<processed video>?class=passingNotes&minConf=0.6&start=60&end=600
+# class takes names or ids (repeat it or comma-separate); start/end are
+# seconds into the video. Returns the matching detections and the same
+# hits grouped into incidents with a seekTo time for the player
+DETECTIONS_PAGE_SIZE = 500
+DETECTIONS_MAX_PAGE_SIZE = 5000
+
+def query_arg(name, cast, default=None):
+    """request.args[name] converted with cast; ValueError if it is not a finite number"""
+    value = request.args.get(name, '')
+    if value == '':
+        return default
+    try:
+        number = cast(value)
+    except ValueError:
+        number = None
+    if number is None or not math.isfinite(number):
+        raise ValueError(f"Invalid {name} '{value}'")
+    return number
+
+@app.route('/api/detections/<path:filename>', methods=['GET'])
+def search_detections(filename):
+    started = time.perf_counter()
+    video_path = safe_join(PROCESSED_FOLDER, filename)
+    if video_path is None or not os.path.isfile(index_path_for(video_path)):
+        return jsonify({'error': 'No detection index for this video'}), 404
+    try:
+        classes = parse_classes(request.args.getlist('class'))
+        start = query_arg('start', float)
+        end = query_arg('end', float)
+        min_conf = query_arg('minConf', float)
+        gap = query_arg('gap', float, 1.0)
+        limit = min(max(1, query_arg('limit', int, DETECTIONS_PAGE_SIZE)), DETECTIONS_MAX_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        index = load_index(index_path_for(video_path))
+        rows = query_detections(index, classes, start, end, min_conf)
+        found = incidents(index, rows, gap)
+        return jsonify({
+            'video': filename,
+            'fps': float(index['fps']),
+            'frames': int(index['frames']),
+            'total': int(len(rows)),
+            'detections': rows_to_dicts(index, rows[:limit]),
+            'incidents': found[:limit],
+            'totalIncidents': len(found),
+            'truncated': len(rows) > limit or len(found) > limit,
+            'queryMs': round((time.perf_counter() - started) * 1000, 2)
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 
-        # Periodically check for alerts and save annotated frames to DB
-        frame_count += 1
-        if frame_count % 5 == 0:  # check every 5th frame
-            has_alert, class_id, confidence = check_alerts(results)
-            if has_alert:
-                severity = get_severity(confidence)
-                timestamp_img = datetime.now().strftime("%Y%m%d_%H%M%S")
-                image_filename = f"video_{camera_id}_{timestamp_img}.jpg"
-                image_path = os.path.join(PROCESSED_FOLDER, image_filename)
-                try:
-                    cv2.imwrite(image_path, annotated)
-                    imageurl = f"{request.host_url.rstrip('/')}/processed/{image_filename}"
-                    threading.Thread(
-                        target=save_alert,
-                        args=('video', severity, image_filename, imageurl),
-                        daemon=True
-                    ).start()
-                except Exception as e:
-                    print(f"❌ Failed saving video alert frame: {str(e)}")
-
-    cap.release()
-    out.release()
-
-    # Return a playable URL that the frontend can set as <video src="...">
-    processed_url = f"{request.host_url.rstrip('/')}/processed/{output_basename}"
-    return jsonify({"processedVideoUrl": processed_url})
-
-
-# Serve uploaded files (images and videos)
+# ================================
+#  ROUTE: Job status / cancellation
+# ================================
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict()), 200
+
+
+# Serve uploaded and processed media straight off disk: ranges (so <video>
+# can seek), conditional requests and bounded memory per connection
 @app.route('/uploads/<path:filename>', methods=['GET'])
 def serve_uploaded(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
+    return send_media(UPLOAD_FOLDER, filename)
 
-# Serve processed files with Range support so <video> can play progressively
 @app.route('/processed/<path:filename>', methods=['GET'])
 def serve_processed(filename):
-    full_path = os.path.join(PROCESSED_FOLDER, filename)
-    if not os.path.exists(full_path):
-        abort(404)
-
-    range_header = request.headers.get('Range', None)
-    if not range_header:
-        # simple full-response; send_from_directory sets Content-Type
-        return send_from_directory(PROCESSED_FOLDER, filename, as_attachment=False)
-
-    # Parse range header "bytes=start-end"
-    size = os.path.getsize(full_path)
-    m = re.search(r'bytes=(\d+)-(\d*)', range_header)
-    if not m:
-        return send_from_directory(PROCESSED_FOLDER, filename, as_attachment=False)
-
-    start = int(m.group(1))
-    end = int(m.group(2)) if m.group(2) else size - 1
-    if end >= size:
-        end = size - 1
-    length = end - start + 1
-
-    with open(full_path, 'rb') as f:
-        f.seek(start)
-        data = f.read(length)
-
-    resp = Response(data, 206, mimetype='video/mp4', direct_passthrough=True)
-    resp.headers.add('Content-Range', f'bytes {start}-{end}/{size}')
-    resp.headers.add('Accept-Ranges', 'bytes')
-    resp.headers.add('Content-Length', str(length))
-    return resp
+    return send_media(PROCESSED_FOLDER, filename)
 
 # Required Flask endpoints
 
+# ================================
+#  LIVE CAMERAS: shared per-camera engines
+# ================================
+# Each camera gets exactly one capture + inference loop no matter how many
+# dashboard tabs watch it; stream endpoints just subscribe to the latest
+# annotated frame. start/stop calls are reference counted.
+# 'batched' runs every live camera through one central scheduler that
+# batches their newest frames together; 'per-camera' gives each engine its
+# own inference thread.
+# SERVING_MODE='processes' moves capture and inference for live cameras
+# into worker processes (see serving.py); this process then only streams
+# their frames out of shared memory and saves their alerts
+LIVE_INFERENCE_MODE = os.environ.get('LIVE_INFERENCE_MODE', 'batched')
+SERVING_MODE = os.environ.get('SERVING_MODE', 'threads')
+
+# Engines only run the model; plot() and JPEG encoding happen lazily, the
+# first time an image viewer (or an alert snapshot) actually needs them
+def infer_frame(frame):
+    return model_provider.get()(frame, verbose=False)
+
+def infer_frames(frames):
+    return [[result] for result in predict_batch(model_provider.get(), frames)]
+
+inference_scheduler = None
+if SERVING_MODE == 'processes':
+    camera_engines = ProcessEngineRegistry()
+    atexit.register(camera_engines.stop_all)
+else:
+    if LIVE_INFERENCE_MODE == 'batched':
+        inference_scheduler = InferenceScheduler(infer_frames)
+    camera_engines = EngineRegistry(scheduler=inference_scheduler, tracking=TRACKING_ENABLED,
+                                    motion_gating=MOTION_GATE_ENABLED)
+
+def make_alert_hooks(alert_type, image_prefix, camera_id, host_url):
+    """Per-engine (on_result, on_stop) pair that aggregates detections into alert events"""
+    return alert_hooks(make_event_saver(alert_type, image_prefix, camera_id, host_url))
+
+def start_engine(kind, camera_id, source, image_prefix, host_url, configure=None, tiler=None):
+    """Acquire the camera's engine in whichever serving mode is active; None if it can't open"""
+    if SERVING_MODE == 'processes':
+        # Aggregation runs in the worker; finished events come back to this saver
+        return camera_engines.acquire(kind, camera_id, source,
+                                      make_event_saver(kind, image_prefix, camera_id, host_url),
+                                      configure=configure, tiler=tiler)
+    on_result, on_stop = make_alert_hooks(kind, image_prefix, camera_id, host_url)
+    return camera_engines.acquire(kind, camera_id, source, infer_frame, on_result=on_result,
+                                  on_stop=on_stop, configure=configure, tiler=tiler)
+
+def metered(kind, camera_id, fmt, chunks):
+    """Pass a stream's chunks through, counting it as active and timing each send.
+
+    The WSGI server writes a chunk to the socket before asking for the
+    next one, so the time spent suspended at yield is the send time.
+    """
+    ACTIVE_STREAMS.inc(kind=kind, format=fmt)
+    try:
+        for chunk in chunks:
+            start = time.perf_counter()
+            yield chunk
+            observe_stage(kind, camera_id, 'send', time.perf_counter() - start)
+    finally:
+        chunks.close()
+        ACTIVE_STREAMS.dec(kind=kind, format=fmt)
+
+def stream_engine(kind, camera_id, detections_only=False):
+    """SSE response that relays every result the camera's engine publishes.
+
+    By default each event carries the annotated JPEG; with detections_only
+    it carries just the compact detection record so the client can draw
+    its own overlay on top of a separate video feed.
+    """
+    def generate_frames():
+        engine = camera_engines.get(kind, camera_id)
+        if not engine:
+            return
+        for packet in engine.subscribe(want=None if detections_only else 'annotated'):
+            event = packet.detections_event() if detections_only else packet.sse_event()
+            if event is None:
+                continue
+            try:
+                yield event
+            except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
+                # client disconnected; stop streaming gracefully
+                break
+
+    return Response(
+        metered(kind, camera_id, 'detections' if detections_only else 'sse', generate_frames()),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+# Binary MJPEG output: defaults for quality (1-100) and max width (0 = native)
+MJPEG_QUALITY = int(os.environ.get('MJPEG_QUALITY', 80))
+MJPEG_MAX_WIDTH = int(os.environ.get('MJPEG_MAX_WIDTH', 0))
+
+def mjpeg_engine(kind, camera_id):
+    """multipart/x-mixed-replace response writing the JPEG buffers as-is.
+
+    Skips the base64 + JSON wrapping of the SSE stream, so it can be used
+    directly as an <img src>. ?quality= and ?width= override the defaults;
+    ?raw=1 sends the frames without server-side boxes (pair it with the
+    detections stream and draw the overlay client-side).
+    """
+    quality = min(100, max(1, request.args.get('quality', MJPEG_QUALITY, type=int)))
+    width = request.args.get('width', MJPEG_MAX_WIDTH, type=int) or None
+    raw = request.args.get('raw', '0') in ('1', 'true')
+
+    def generate_frames():
+        engine = camera_engines.get(kind, camera_id)
+        if not engine:
+            return
+        for packet in engine.subscribe(want='raw' if raw else 'annotated'):
+            part = packet.mjpeg_part(quality, width, raw)
+            if part is None:
+                continue
+            try:
+                yield part
+            except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
+                break
+
+    return Response(
+        metered(kind, camera_id, 'mjpeg', generate_frames()),
+        mimetype=f'multipart/x-mixed-replace; boundary={MJPEG_BOUNDARY}',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 @app.route('/api/start-webcam', methods=['POST'])
 def start_webcam():
     try:
         camera_id = request.json.get('camera_id')
-        
-        # Release existing camera if any
-        existing_cap = app.config.get(f'camera_{camera_id}')
-        if existing_cap:
-            existing_cap.release()
-            
-        # Initialize OpenCV capture
-        cap = cv2.VideoCapture(0)
-        
-        # Verify camera opened successfully
-        if not cap.isOpened():
+        host_url = request.host_url.rstrip('/')
+
+        # Reuses the running engine if another viewer already started it
+        engine = start_engine('web', camera_id, 0, 'webcam', host_url, configure=configure_webcam)
+        if engine is None:
             return jsonify({'error': 'Failed to open camera'}), 500
-            
-        # Set camera properties
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        cap.set(cv2.CAP_PROP_FPS, 30)
-        
-        # Store capture object in app context
-        app.config[f'camera_{camera_id}'] = cap
-        
-        return jsonify({'status': 'started'})
-        
+
+        return jsonify({'status': 'started', 'viewers': engine.refs, 'engineId': engine.id})
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/webcam-stream/<camera_id>')
 def webcam_stream(camera_id):
-    def generate_frames():
-        cap = app.config.get(f'camera_{camera_id}')
-        if not cap:
-            return
-        
-        frame_count = 0  # Counter to avoid processing every single frame
-        last_annotated_frame = None  # cache last annotated frame to reduce load
-            
-        while True:
-            success, frame = cap.read()
-            if not success:
-                break
-            
-            frame_count += 1
-            process_this_frame = (frame_count % 5 == 0)  # Process every 5th frame for alerts
-                
-            try:
-                # Run inference only on selected frames to reduce load
-                if process_this_frame or last_annotated_frame is None:
-                    results = model(frame, verbose=False)
-                    processed_frame = results[0].plot()  # Get the annotated frame
-                    last_annotated_frame = processed_frame
-                else:
-                    processed_frame = last_annotated_frame
-                
-                # Check for alerts and save if detected
-                if process_this_frame:
-                    # Ensure results exists when checking alerts (only when we ran inference)
-                    has_alert, class_id, confidence = check_alerts(results)
-                    if has_alert:
-                        severity = get_severity(confidence)
-                        class_name = CLASS_NAMES.get(class_id, 'unknown')
-                        
-                        # Save annotated frame to processed folder
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        image_filename = f"webcam_{camera_id}_{timestamp}.jpg"
-                        image_path = os.path.join(PROCESSED_FOLDER, image_filename)
-                        cv2.imwrite(image_path, processed_frame)
-                        
-                        # Create image URL
-                        imageurl = f"{request.host_url.rstrip('/')}/processed/{image_filename}"
-                        
-                        # Save alert to database in background (no lock needed per-connection)
-                        threading.Thread(
-                            target=save_alert,
-                            args=('web', severity, image_filename, imageurl),
-                            daemon=False
-                        ).start()
-                
-                # Encode frame to base64
-                ok, buffer = cv2.imencode('.jpg', processed_frame)
-                if not ok:
-                    continue
-                frame_bytes = base64.b64encode(buffer).decode('utf-8')
-                
-                # Send the frame data
-                try:
-                    yield f"data: {json.dumps({'image': frame_bytes})}\n\n"
-                except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
-                    # client disconnected; stop streaming gracefully
-                    break
-                
-                time.sleep(1/30)  # Cap at 30 FPS
-                
-            except Exception as e:
-                print(f"Error processing frame: {str(e)}")
-                break
-        
-        # Cleanup if loop breaks
-        if cap:
-            cap.release()
-            try:
-                del app.config[f'camera_{camera_id}']
-            except:
-                pass
-    
-    return Response(generate_frames(), 
-                   mimetype='text/event-stream',
-                   headers={
-                       'Cache-Control': 'no-cache',
-                       'Connection': 'keep-alive',
-                       'X-Accel-Buffering': 'no'
-                   })
+    return stream_engine('web', camera_id)
+
+@app.route('/api/webcam-detections/<camera_id>')
+def webcam_detections(camera_id):
+    return stream_engine('web', camera_id, detections_only=True)
+
+@app.route('/api/webcam-mjpeg/<camera_id>')
+def webcam_mjpeg(camera_id):
+    return mjpeg_engine('web', camera_id)
 
 @app.route('/api/stop-webcam', methods=['POST'])
 def stop_webcam():
     camera_id = request.json.get('camera_id')
-    cap = app.config.get(f'camera_{camera_id}')
-    if cap:
-        cap.release()
-        del app.config[f'camera_{camera_id}']
-    return jsonify({'status': 'stopped'})
-
-# Store CCTV captures in app context
-app.config['cctv_captures'] = {}
+    remaining = camera_engines.release('web', camera_id, engine_id=request.json.get('engine_id'))
+    return jsonify({'status': 'stopped', 'viewers': remaining})
 
 @app.route('/api/start-cctv', methods=['POST'])
 def start_cctv():
@@ -408,147 +898,284 @@ def start_cctv():
         data = request.json
         camera_id = data.get('camera_id')
         rtsp_url = data.get('rtsp_url')
+        host_url = request.host_url.rstrip('/')
 
-        # Initialize capture for this camera
-        cap = cv2.VideoCapture(rtsp_url)
-        if not cap.isOpened():
+        # Optional ROI tiling for high-resolution cameras: from the request,
+        # else from the per-camera config file
+        tiling = data.get('tiling') or load_tiling_config().get(str(camera_id))
+        try:
+            tiler = TileLayout.from_config(tiling)
+        except (AttributeError, TypeError, ValueError, IndexError) as e:
+            return jsonify({'error': f'Invalid tiling config: {str(e)}'}), 400
+
+        engine = start_engine('cctv', camera_id, rtsp_url, 'cctv', host_url, tiler=tiler)
+        if engine is None:
             return jsonify({'error': 'Failed to open RTSP stream'}), 500
 
-        # Store capture in app context
-        app.config['cctv_captures'][camera_id] = cap
-        
-        return jsonify({'status': 'started'})
+        return jsonify({'status': 'started', 'viewers': engine.refs, 'engineId': engine.id})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/cctv-stream/<camera_id>')
 def cctv_stream(camera_id):
-    def generate_frames():
-        cap = app.config['cctv_captures'].get(camera_id)
-        if not cap:
-            return
-        
-        frame_count = 0  # Counter to avoid processing every single frame
-            
-        while True:
-            success, frame = cap.read()
-            if not success:
-                break
-            
-            frame_count += 1
-            process_this_frame = (frame_count % 5 == 0)  # Process every 5th frame for alerts
-                
-            try:
-                # Process frame with ML model
-                results = model(frame, verbose=False)
-                processed_frame = results[0].plot()  # Get annotated frame
-                
-                # Check for alerts and save if detected
-                if process_this_frame:
-                    has_alert, class_id, confidence = check_alerts(results)
-                    if has_alert:
-                        severity = get_severity(confidence)
-                        class_name = CLASS_NAMES.get(class_id, 'unknown')
-                        
-                        # Save annotated frame to processed folder
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        image_filename = f"cctv_{camera_id}_{timestamp}.jpg"
-                        image_path = os.path.join(PROCESSED_FOLDER, image_filename)
-                        cv2.imwrite(image_path, processed_frame)
-                        
-                        # Create image URL
-                        imageurl = f"{request.host_url.rstrip('/')}/processed/{image_filename}"
-                        
-                        # Save alert to database in background
-                        threading.Thread(
-                            target=save_alert,
-                            args=('cctv', severity, image_filename, imageurl),
-                            daemon=True
-                        ).start()
-                
-                # Encode frame to base64
-                ok, buffer = cv2.imencode('.jpg', processed_frame)
-                if not ok:
-                    continue
-                frame_bytes = base64.b64encode(buffer).decode('utf-8')
-                
-                # Send frame data
-                try:
-                    yield f"data: {json.dumps({'image': frame_bytes})}\n\n"
-                except (BrokenPipeError, ConnectionAbortedError, ConnectionResetError):
-                    break
-                
-                time.sleep(1/30)  # Cap at 30 FPS
-                
-            except Exception as e:
-                print(f"Error processing CCTV frame: {str(e)}")
-                break
-        
-        # Cleanup if loop breaks
-        if cap:
-            cap.release()
-            try:
-                del app.config['cctv_captures'][camera_id]
-            except:
-                pass
-    
-    return Response(
-        generate_frames(),
-        mimetype='text/event-stream',
-        headers={
-            'Cache-Control': 'no-cache',
-            'Connection': 'keep-alive',
-            'X-Accel-Buffering': 'no'
-        }
-    )
+    return stream_engine('cctv', camera_id)
+
+@app.route('/api/cctv-detections/<camera_id>')
+def cctv_detections(camera_id):
+    return stream_engine('cctv', camera_id, detections_only=True)
+
+@app.route('/api/cctv-mjpeg/<camera_id>')
+def cctv_mjpeg(camera_id):
+    return mjpeg_engine('cctv', camera_id)
 
 @app.route('/api/stop-cctv', methods=['POST'])
 def stop_cctv():
     try:
         camera_id = request.json.get('camera_id')
-        cap = app.config['cctv_captures'].get(camera_id)
-        if cap:
-            cap.release()
-            del app.config['cctv_captures'][camera_id]
-        return jsonify({'status': 'stopped'})
+        remaining = camera_engines.release('cctv', camera_id, engine_id=request.json.get('engine_id'))
+        return jsonify({'status': 'stopped', 'viewers': remaining})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Get all alerts from database
+# Per-camera engine status: viewers, adaptive stride, latency, drops
+@app.route('/api/streams', methods=['GET'])
+def list_streams():
+    body = {'streams': [engine.stats() for engine in camera_engines.all()]}
+    if SERVING_MODE == 'processes':
+        body['workers'] = camera_engines.stats()
+    return jsonify(body), 200
+
+# Inspect / tune the live inference scheduler
+@app.route('/api/scheduler', methods=['GET', 'POST'])
+def scheduler_status():
+    if inference_scheduler is None:
+        return jsonify({'mode': LIVE_INFERENCE_MODE}), 200
+    try:
+        if request.method == 'POST':
+            target_fps = (request.json or {}).get('target_fps')
+            if target_fps is not None:
+                inference_scheduler.set_target_fps(target_fps)
+        return jsonify({'mode': LIVE_INFERENCE_MODE, **inference_scheduler.stats()}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+# Alert writer health: queue depth and flush latency
+@app.route('/api/alert-writer', methods=['GET'])
+def alert_writer_status():
+    return jsonify(alert_writer.stats()), 200
+
+# Result cache: entries, bytes against the budget, hit rate
+@app.route('/api/result-cache', methods=['GET'])
+def result_cache_status():
+    return jsonify(result_cache.stats()), 200
+
+# ================================
+#  ROUTE: Prometheus metrics
+# ================================
+# Stage latencies, active streams and SQLite write time are recorded as
+# they happen (see metrics.py); everything below is read from the stats
+# the engines, scheduler, writer and job pool already keep, at scrape time
+CAMERA_LABELS = ('kind', 'camera')
+CAMERA_SOURCE_FPS = Gauge('invigilation_camera_source_fps', 'Frames per second delivered by the source', CAMERA_LABELS)
+CAMERA_PUBLISHED_FPS = Gauge('invigilation_camera_published_fps', 'Results per second published to viewers',
+                             CAMERA_LABELS)
+CAMERA_STRIDE = Gauge('invigilation_camera_stride', 'Source frames per decoded frame (adaptive stride)',
+                      CAMERA_LABELS)
+CAMERA_LATENCY = Gauge('invigilation_camera_latency_seconds', 'Smoothed capture-to-publish latency', CAMERA_LABELS)
+CAMERA_VIEWERS = Gauge('invigilation_camera_subscribers', 'Stream subscribers per camera', CAMERA_LABELS)
+CAMERA_FRAMES_READ = Counter('invigilation_camera_frames_read_total', 'Frames grabbed from the source',
+                             CAMERA_LABELS)
+CAMERA_FRAMES_DROPPED = Counter('invigilation_camera_frames_dropped_total',
+                                'Frames grabbed but skipped without decoding', CAMERA_LABELS)
+ALERT_QUEUE_DEPTH = Gauge('invigilation_alert_queue_depth', 'Alerts waiting for the SQLite writer')
+ALERTS_WRITTEN = Counter('invigilation_alerts_written_total', 'Alerts inserted into SQLite')
+ALERTS_FAILED = Counter('invigilation_alerts_failed_total', 'Alerts the writer failed to insert')
+SCHEDULER_ACHIEVED_FPS = Gauge('invigilation_scheduler_achieved_fps', 'Batched inference passes per second')
+SCHEDULER_BATCH_SIZE = Gauge('invigilation_scheduler_batch_size', 'Images in the last batched inference pass')
+JOBS = Gauge('invigilation_jobs', 'Video processing jobs by status', ('status',))
+MODEL_WARM = Gauge('invigilation_model_warm', '1 once the model is loaded and warmed up')
+RESULT_CACHE_BYTES = Gauge('invigilation_result_cache_bytes', 'Bytes of processed output held by the result cache')
+RESULT_CACHE_LOOKUPS = Counter('invigilation_result_cache_lookups_total', 'Result cache lookups by outcome',
+                               ('result',))
+
+def collect_metrics():
+    cameras = {metric: {} for metric in (CAMERA_SOURCE_FPS, CAMERA_PUBLISHED_FPS, CAMERA_STRIDE, CAMERA_LATENCY,
+                                         CAMERA_VIEWERS, CAMERA_FRAMES_READ, CAMERA_FRAMES_DROPPED)}
+    for stats in (engine.stats() for engine in camera_engines.all()):
+        labels = (('kind', stats['kind']), ('camera', stats['cameraId']))
+        # Remote engines only know these once their worker has reported
+        for metric, key, scale in ((CAMERA_SOURCE_FPS, 'sourceFps', 1), (CAMERA_PUBLISHED_FPS, 'publishedFps', 1),
+                                   (CAMERA_STRIDE, 'stride', 1), (CAMERA_LATENCY, 'latencyMs', 0.001),
+                                   (CAMERA_VIEWERS, 'subscribers', 1), (CAMERA_FRAMES_READ, 'framesRead', 1),
+                                   (CAMERA_FRAMES_DROPPED, 'framesDropped', 1)):
+            if stats.get(key) is not None:
+                cameras[metric][labels] = round(stats[key] * scale, 6)
+    yield from cameras.items()
+
+    writer = alert_writer.stats()
+    yield ALERT_QUEUE_DEPTH, {(): writer['queueDepth']}
+    yield ALERTS_WRITTEN, {(): writer['written']}
+    yield ALERTS_FAILED, {(): writer['failed']}
+    if inference_scheduler is not None:
+        scheduler = inference_scheduler.stats()
+        yield SCHEDULER_ACHIEVED_FPS, {(): scheduler['achievedFps']}
+        yield SCHEDULER_BATCH_SIZE, {(): scheduler['lastBatchSize']}
+    yield JOBS, {(('status', status),): count for status, count in job_manager.stats()['jobs'].items()}
+    yield MODEL_WARM, {(): 1 if model_provider.warm else 0}
+    cache = result_cache.stats()
+    yield RESULT_CACHE_BYTES, {(): cache['bytes']}
+    yield RESULT_CACHE_LOOKUPS, {(('result', 'hit'),): cache['hits'], (('result', 'miss'),): cache['misses']}
+
+REGISTRY.add_collector(collect_metrics)
+
+@app.route('/metrics')
+def metrics():
+    # Worker processes ship their own histograms (decode, inference, plot)
+    external = camera_engines.metric_snapshots() if SERVING_MODE == 'processes' else ()
+    return Response(REGISTRY.render(external), mimetype='text/plain; version=0.0.4')
+
+# Get alerts from database, newest first, one page at a time
+ALERTS_PAGE_SIZE = 100
+ALERTS_MAX_PAGE_SIZE = 500
+
+def alert_to_dict(row, host_url):
+    raw_url = row[4]
+    # Normalize to HTTP URL in case legacy rows stored local filesystem paths
+    if isinstance(raw_url, str) and not raw_url.lower().startswith('http'):
+        filename = os.path.basename(raw_url)
+        normalized_url = f"{host_url}/processed/{filename}"
+    else:
+        normalized_url = raw_url
+    return {
+        'id': row[0],
+        'alert_type': row[1],
+        'severity': row[2],
+        'timestamp': row[3],
+        'imageurl': normalized_url,
+        'camera_id': row[5],
+        'class_name': row[6],
+        'confidence': row[7],
+        'end_timestamp': row[8],
+        'duration': row[9],
+        'track_id': row[10],
+        'start_offset': row[11],
+        'end_offset': row[12]
+    }
+
 @app.route('/api/alerts', methods=['GET'])
 def get_alerts():
+    """
+    Query params (all optional):
+      limit       page size (default 100, max 500)
+      cursor      id from the previous page's nextCursor
+      since       only alerts with id greater than this
+      alert_type, severity, camera_id   exact-match filters
+      start, end  timestamp bounds, "YYYY-MM-DD HH:MM:SS"
+    """
     try:
+        args = request.args
+        limit = min(ALERTS_MAX_PAGE_SIZE, max(1, args.get('limit', ALERTS_PAGE_SIZE, type=int)))
         conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        cursor.execute('''
-            SELECT id, alert_type, severity, timestamp, imageurl 
-            FROM alerts 
-            ORDER BY timestamp DESC
-        ''')
-        rows = cursor.fetchall()
-        conn.close()
-        
-        alerts = []
-        for row in rows:
-            raw_url = row[4]
-            # Normalize to HTTP URL in case legacy rows stored local filesystem paths
-            if isinstance(raw_url, str) and not raw_url.lower().startswith('http'): 
-                filename = os.path.basename(raw_url)
-                normalized_url = f"{request.host_url.rstrip('/')}/processed/{filename}"
-            else:
-                normalized_url = raw_url
-            alerts.append({
-                'id': row[0],
-                'alert_type': row[1],
-                'severity': row[2],
-                'timestamp': row[3],
-                'imageurl': normalized_url
-            })
-        
-        return jsonify({'alerts': alerts}), 200
+        try:
+            # The ETag comes from the table itself (newest id, row count,
+            # deletion counter), so a client whose ETag still matches gets a
+            # 304 without the page being read, and it stays valid across
+            # restarts and writes from other processes
+            version = alert_store.table_version(conn)
+            etag = hashlib.md5(f"{version}|{request.query_string.decode()}".encode()).hexdigest()
+            if etag in request.if_none_match:
+                resp = Response(status=304)
+                resp.set_etag(etag)
+                return resp
+
+            rows, next_cursor = alert_store.query_alerts(
+                conn,
+                limit=limit,
+                cursor=args.get('cursor', type=int),
+                since=args.get('since', type=int),
+                alert_type=args.get('alert_type'),
+                severity=args.get('severity'),
+                camera_id=args.get('camera_id'),
+                start=args.get('start'),
+                end=args.get('end')
+            )
+        finally:
+            conn.close()
+
+        host_url = request.host_url.rstrip('/')
+        alerts = [alert_to_dict(row, host_url) for row in rows]
+        resp = jsonify({'alerts': alerts, 'nextCursor': next_cursor})
+        resp.set_etag(etag)
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp, 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Push newly persisted alerts as they are written (replaces polling)
+ALERT_STREAM_KEEPALIVE = 15  # seconds between SSE comments on an idle feed
+
+def alert_event(row, host_url):
+    return f"id: {row[0]}\nevent: alert\ndata: {json.dumps(alert_to_dict(row, host_url))}\n\n"
+
+@app.route('/api/alerts/stream')
+def alerts_stream():
+    """
+    SSE feed of new alerts ('alert' events, id = alert id) and deletions
+    ('deleted' events). Reconnecting clients resume after the Last-Event-ID
+    header the browser sends automatically, or ?since=<id>.
+    """
+    host_url = request.host_url.rstrip('/')
+    last_id = request.headers.get('Last-Event-ID', type=int)
+    if last_id is None:
+        last_id = request.args.get('since', type=int)
+    if last_id is None:
+        last_id = alert_feed.latest_id  # fresh client: only new alerts
+
+    def backfill(after_id):
+        # Rows older than the in-memory buffer come from SQLite, oldest first
+        conn = sqlite3.connect(DB_PATH)
+        try:
+            rows = conn.execute(
+                f'SELECT {alert_store.ALERT_COLUMNS} FROM alerts WHERE id > ? ORDER BY id ASC LIMIT ?',
+                (after_id, ALERTS_MAX_PAGE_SIZE)
+            ).fetchall()
+        finally:
+            conn.close()
+        return rows
+
+    def generate():
+        after_id = last_id
+        deletion_mark = alert_feed.deletions
+        yield "retry: 3000\n\n"
+        while True:
+            rows, deleted, deletion_mark = alert_feed.wait(after_id, deletion_mark, ALERT_STREAM_KEEPALIVE)
+            if alert_feed.latest_id > after_id and (not rows or rows[0][0] > after_id + 1):
+                # Gap between after_id and the in-memory buffer (reconnect or
+                # a slow client): fill it from SQLite first
+                db_rows = backfill(after_id)
+                if db_rows:
+                    rows = db_rows
+                elif not rows:
+                    after_id = alert_feed.latest_id  # the missing rows were deleted
+            if not rows and not deleted:
+                yield ": keepalive\n\n"
+                continue
+            for row in rows:
+                yield alert_event(row, host_url)
+                after_id = row[0]
+            for alert_id in deleted:
+                yield f"event: deleted\ndata: {json.dumps({'id': alert_id})}\n\n"
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
 # Delete an alert by ID
 @app.route('/api/alerts/<int:alert_id>', methods=['DELETE'])
 def delete_alert(alert_id):
@@ -575,6 +1202,7 @@ def delete_alert(alert_id):
         cursor.execute('DELETE FROM alerts WHERE id = ?', (alert_id,))
         conn.commit()
         conn.close()
+        alert_feed.publish_delete(alert_id)
         
         # Delete image file if it exists
         if os.path.exists(image_path):
@@ -589,4 +1217,8 @@ def delete_alert(alert_id):
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    debug = APP_ENV != 'production'
+    # Under the debug reloader only the child process serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        startup()
+    app.run(host='0.0.0.0', port=5000, debug=debug)
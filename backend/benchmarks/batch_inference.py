@@ -0,0 +1,88 @@
+"""Compare offline YOLO throughput for different inference batch sizes.
+
+Usage (from the backend directory):
+
+    python benchmarks/batch_inference.py --video sample.mp4
+    python benchmarks/batch_inference.py --video sample.mp4 --batch-sizes 1 4 8 16 --max-frames 300
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+import cv2
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from inference import read_batches, predict_batch  # noqa: E402
+
+
+def run(model, video_path, batch_size, max_frames, plot):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open {video_path}")
+
+    frames_done = 0
+    infer_seconds = 0.0
+    start = time.perf_counter()
+    try:
+        for frames in read_batches(cap, batch_size):
+            if max_frames and frames_done + len(frames) > max_frames:
+                frames = frames[:max_frames - frames_done]
+            t0 = time.perf_counter()
+            results = predict_batch(model, frames)
+            infer_seconds += time.perf_counter() - t0
+            if plot:
+                for result in results:
+                    result.plot()
+            frames_done += len(frames)
+            if max_frames and frames_done >= max_frames:
+                break
+    finally:
+        cap.release()
+    wall = time.perf_counter() - start
+
+    return {
+        'batch_size': batch_size,
+        'frames': frames_done,
+        'wall_seconds': round(wall, 3),
+        'inference_seconds': round(infer_seconds, 3),
+        'fps': round(frames_done / wall, 2) if wall > 0 else 0.0,
+        'inference_fps': round(frames_done / infer_seconds, 2) if infer_seconds > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video', required=True, help='sample clip to process')
+    parser.add_argument('--weights', default=os.path.join(BACKEND_DIR, 'best.pt'))
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--max-frames', type=int, default=240,
+                        help='frames per run (0 = whole clip)')
+    parser.add_argument('--no-plot', action='store_true',
+                        help='skip results.plot() to time inference only')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    from ultralytics import YOLO
+    model = YOLO(args.weights)
+
+    # Warm up once so the first measured run doesn't pay for lazy setup
+    run(model, args.video, 1, 4, plot=False)
+
+    rows = []
+    for batch_size in args.batch_sizes:
+        row = run(model, args.video, batch_size, args.max_frames, plot=not args.no_plot)
+        rows.append(row)
+        print(f"batch={row['batch_size']:>3}  frames={row['frames']:>5}  "
+              f"fps={row['fps']:>7.2f}  inference_fps={row['inference_fps']:>7.2f}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'video': args.video, 'weights': args.weights, 'runs': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Compare accuracy and latency of inference backends against the PyTorch model.
+
+Every variant runs over the same fixed clip. Its detections are matched
+to the PyTorch fp32 detections (same class, IoU >= --iou), so precision
+and recall here mean agreement with the reference, not ground truth.
+
+Usage (from the backend directory):
+
+    python benchmarks/compare_backends.py --video sample.mp4
+    python benchmarks/compare_backends.py --video sample.mp4 \\
+        --variants pytorch:fp32 onnx:fp32 onnx:int8 openvino:fp32 openvino:fp16 --batch-size 4
+"""
+import os
+import sys
+import time
+import json
+import argparse
+
+import cv2
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from inference import predict_batch, extract_detections  # noqa: E402
+from inference_backend import load_model  # noqa: E402
+from tracking import iou  # noqa: E402
+
+
+def read_clip(video_path, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise SystemExit(f"Could not open {video_path}")
+    frames = []
+    try:
+        while not max_frames or len(frames) < max_frames:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+    finally:
+        cap.release()
+    return frames
+
+
+def run(model, frames, batch_size):
+    """Detections per frame and per-frame latencies (seconds)"""
+    detections, latencies = [], []
+    for i in range(0, len(frames), batch_size):
+        batch = frames[i:i + batch_size]
+        t0 = time.perf_counter()
+        results = predict_batch(model, batch)
+        per_frame = (time.perf_counter() - t0) / len(batch)
+        latencies.extend([per_frame] * len(batch))
+        detections.extend(extract_detections(result) for result in results)
+    return detections, latencies
+
+
+def agreement(reference, candidate, iou_threshold):
+    """Greedy same-class IoU matching of candidate boxes to reference boxes"""
+    matched = ref_total = cand_total = 0
+    ious, conf_deltas = [], []
+    for ref_frame, cand_frame in zip(reference, candidate):
+        ref_total += len(ref_frame)
+        cand_total += len(cand_frame)
+        used = set()
+        for cand in sorted(cand_frame, key=lambda d: -d['conf']):
+            best, best_iou = None, iou_threshold
+            for j, ref in enumerate(ref_frame):
+                if j in used or ref['cls'] != cand['cls']:
+                    continue
+                score = iou(ref['box'], cand['box'])
+                if score >= best_iou:
+                    best, best_iou = j, score
+            if best is not None:
+                used.add(best)
+                matched += 1
+                ious.append(best_iou)
+                conf_deltas.append(abs(ref_frame[best]['conf'] - cand['conf']))
+    return {
+        'precision': round(matched / cand_total, 4) if cand_total else 1.0,
+        'recall': round(matched / ref_total, 4) if ref_total else 1.0,
+        'mean_iou': round(sum(ious) / len(ious), 4) if ious else None,
+        'mean_conf_delta': round(sum(conf_deltas) / len(conf_deltas), 4) if conf_deltas else None,
+        'reference_boxes': ref_total,
+        'boxes': cand_total,
+    }
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--video', required=True, help='fixed clip every variant is run on')
+    parser.add_argument('--weights', default=os.path.join(BACKEND_DIR, 'best.pt'))
+    parser.add_argument('--variants', nargs='+',
+                        default=['pytorch:fp32', 'onnx:fp32', 'onnx:int8', 'openvino:fp32', 'openvino:fp16'],
+                        help='backend:precision pairs; pytorch:fp32 is always run as the reference')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--max-frames', type=int, default=120, help='frames of the clip to use (0 = all)')
+    parser.add_argument('--iou', type=float, default=0.5, help='IoU for a box to count as matching')
+    parser.add_argument('--calibration-data', help='dataset YAML for openvino:int8')
+    parser.add_argument('--json', help='also write results to this file')
+    args = parser.parse_args()
+
+    frames = read_clip(args.video, args.max_frames)
+    if not frames:
+        raise SystemExit('No frames decoded')
+
+    variants = ['pytorch:fp32'] + [v for v in args.variants if v != 'pytorch:fp32']
+    reference = None
+    rows = []
+    for variant in variants:
+        backend, _, precision = variant.partition(':')
+        try:
+            model = load_model(args.weights, backend, precision or 'fp32',
+                               calibration_data=args.calibration_data)
+        except Exception as e:
+            if reference is None:
+                raise SystemExit(f"Could not load the PyTorch reference: {e}")
+            print(f"{variant:<16} skipped: {e}")
+            rows.append({'variant': variant, 'error': str(e)})
+            continue
+
+        # Warm up so lazy runtime setup isn't counted
+        predict_batch(model, frames[:args.batch_size])
+        detections, latencies = run(model, frames, args.batch_size)
+        if reference is None:
+            reference = detections
+
+        row = {
+            'variant': variant,
+            'frames': len(frames),
+            'mean_ms': round(1000 * sum(latencies) / len(latencies), 2),
+            'p95_ms': round(1000 * percentile(latencies, 0.95), 2),
+            'fps': round(len(latencies) / sum(latencies), 2),
+            **agreement(reference, detections, args.iou),
+        }
+        rows.append(row)
+        print(f"{variant:<16} mean={row['mean_ms']:>8.2f}ms  p95={row['p95_ms']:>8.2f}ms  "
+              f"fps={row['fps']:>7.2f}  precision={row['precision']:.3f}  recall={row['recall']:.3f}  "
+              f"iou={row['mean_iou'] if row['mean_iou'] is not None else '-'}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'video': args.video, 'weights': args.weights, 'batch_size': args.batch_size,
+                       'runs': rows}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,563 @@
+"""Reproducible end-to-end benchmarks for the video, streaming and alert paths.
+
+Runs against the real Flask app (test client, no network) with its data
+directory pointed at a scratch folder, so the real database and media
+are never touched:
+
+  process_video  POST /api/process-video and poll the job: wall fps
+  streams        a camera on a paced local MJPEG source (or --source),
+                 N concurrent SSE / detections / MJPEG subscribers:
+                 delivered fps, publish->client latency, engine stats
+  alerts_write   the production alert path from many threads (event
+                 aggregator -> snapshot + event saver -> alert writer):
+                 emit rate and time until every row is in SQLite
+  alerts_query   /api/alerts on a table of --alert-rows rows: first
+                 page, deep cursor pages, filters and ETag revalidation
+
+The clip is synthetic (moving boxes on noise) unless --video is given.
+--model stub swaps YOLO for a fixed-cost stand-in so everything around
+the model can be compared across machines without weights; the default
+uses the configured backend (INFERENCE_BACKEND / MODEL_WEIGHTS).
+
+Results are written as JSON; --compare prints the change against an
+earlier run. Usage (from the backend directory):
+
+    python benchmarks/suite.py --json baseline.json
+    python benchmarks/suite.py --json after.json --compare baseline.json
+    python benchmarks/suite.py --model stub --benchmarks streams alerts_write --subscribers 1 8 32
+"""
+import os
+import sys
+import time
+import json
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import cv2
+import numpy as np
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+BENCHMARKS = ('process_video', 'streams', 'alerts_write', 'alerts_query')
+
+
+# ---------- inputs ----------
+def make_sample_video(path, frames=300, width=640, height=480, fps=30, seed=0):
+    """Deterministic clip: a few boxes moving over a noisy background"""
+    rng = np.random.default_rng(seed)
+    background = rng.integers(0, 60, (height, width, 3), dtype=np.uint8)
+    boxes = [(rng.integers(0, width - 80), rng.integers(0, height - 80),
+              int(rng.choice([-4, -2, 2, 4])), int(rng.choice([-3, 3]))) for _ in range(4)]
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    try:
+        for i in range(frames):
+            frame = background.copy()
+            for n, (x, y, dx, dy) in enumerate(boxes):
+                x = int(abs((x + dx * i) % (2 * (width - 80)) - (width - 80)))
+                y = int(abs((y + dy * i) % (2 * (height - 80)) - (height - 80)))
+                cv2.rectangle(frame, (x, y), (x + 80, y + 80), (60 * n + 40, 200, 255 - 50 * n), -1)
+            writer.write(frame)
+    finally:
+        writer.release()
+    return path
+
+
+class PacedMjpegSource:
+    """Local stand-in for an IP camera: the clip as MJPEG over HTTP, looped at fps"""
+
+    def __init__(self, video_path, fps):
+        cap = cv2.VideoCapture(video_path)
+        self._jpegs = []
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            self._jpegs.append(cv2.imencode('.jpg', frame)[1].tobytes())
+        cap.release()
+        if not self._jpegs:
+            raise SystemExit(f"Could not decode {video_path}")
+        source = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Type', 'multipart/x-mixed-replace; boundary=frame')
+                self.end_headers()
+                interval = 1.0 / fps
+                next_at = time.monotonic()
+                i = 0
+                try:
+                    while not source.closed:
+                        data = source._jpegs[i % len(source._jpegs)]
+                        self.wfile.write(b'--frame\r\nContent-Type: image/jpeg\r\n'
+                                         b'Content-Length: %d\r\n\r\n' % len(data) + data + b'\r\n')
+                        i += 1
+                        next_at += interval
+                        time.sleep(max(0.0, next_at - time.monotonic()))
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.closed = False
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name='paced-source', daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/stream.mjpg"
+
+    def close(self):
+        self.closed = True
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ---------- stub model ----------
+class _Column:
+    def __init__(self, values):
+        self._values = np.asarray(values, dtype=np.float32)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._values
+
+
+class _StubBoxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = _Column(xyxy)
+        self.cls = _Column(cls)
+        self.conf = _Column(conf)
+
+    def __len__(self):
+        return len(self.cls.numpy())
+
+
+class StubResult:
+    """Two fixed detections, one of them an alert class, drawn like Results.plot()"""
+
+    def __init__(self, frame):
+        height, width = frame.shape[:2]
+        self.orig_img = frame
+        self.boxes = _StubBoxes([[width * 0.1, height * 0.1, width * 0.4, height * 0.5],
+                                 [width * 0.5, height * 0.2, width * 0.8, height * 0.7]],
+                                [1, 3], [0.9, 0.7])
+
+    def plot(self, img=None):
+        image = (self.orig_img if img is None else img).copy()
+        for box in self.boxes.xyxy.numpy().astype(int):
+            cv2.rectangle(image, tuple(box[:2]), tuple(box[2:]), (0, 0, 255), 2)
+        return image
+
+
+class StubModel:
+    """Fixed cost per call plus per image, like a batched detector"""
+
+    def __init__(self, call_ms, image_ms):
+        self.call_seconds = call_ms / 1000.0
+        self.image_seconds = image_ms / 1000.0
+
+    def __call__(self, source, **kwargs):
+        frames = source if isinstance(source, list) else [source]
+        time.sleep(self.call_seconds + self.image_seconds * len(frames))
+        return [StubResult(frame) for frame in frames]
+
+
+class StubProvider:
+    """Drop-in for app.model_provider"""
+
+    def __init__(self, model):
+        self._model = model
+        self.warm = True
+        self.loaded = True
+        # Read by the app for result cache keys
+        self.weights = 'stub'
+        self.backend = 'stub'
+        self.precision = 'fp32'
+        self.imgsz = 640
+
+    def get(self):
+        return self._model
+
+    def warm_up(self, batch_sizes=(1,)):
+        pass
+
+    def warm_up_async(self, batch_sizes=(1,)):
+        pass
+
+    def stats(self):
+        return {'backend': 'stub', 'precision': None, 'loaded': True, 'warm': True,
+                'loadSeconds': None, 'warmupMs': None, 'error': None}
+
+
+# ---------- helpers ----------
+def summarize(seconds):
+    """Latency distribution in milliseconds"""
+    if not seconds:
+        return None
+    ordered = sorted(seconds)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))] * 1000, 3)
+
+    return {'n': len(ordered), 'mean_ms': round(sum(ordered) / len(ordered) * 1000, 3),
+            'p50_ms': pick(0.5), 'p95_ms': pick(0.95), 'p99_ms': pick(0.99), 'max_ms': pick(1.0)}
+
+
+def wait_until(predicate, timeout, interval=0.05):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(interval)
+    return predicate()
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+# ---------- benchmarks ----------
+def bench_process_video(A, client, video_path, repeats, timeout):
+    runs = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        with open(video_path, 'rb') as f:
+            resp = client.post('/api/process-video', data={'video': (f, 'bench.avi'), 'cameraId': 'bench'},
+                               content_type='multipart/form-data')
+        if resp.status_code != 202:
+            raise RuntimeError(f"process-video returned {resp.status_code}: {resp.get_json()}")
+        job_id = resp.get_json()['jobId']
+        accepted = time.perf_counter() - start
+
+        status = {}
+        wait_until(lambda: status.update(client.get(f'/api/jobs/{job_id}').get_json()) or
+                   status.get('status') not in ('queued', 'running'), timeout)
+        wall = time.perf_counter() - start
+        frames = (status.get('result') or {}).get('frames') or status.get('framesProcessed') or 0
+        runs.append({'status': status.get('status'), 'frames': frames, 'accepted_ms': round(accepted * 1000, 2),
+                     'wall_seconds': round(wall, 3), 'fps': round(frames / wall, 2) if wall > 0 else 0.0})
+    fps = [run['fps'] for run in runs if run['status'] == 'completed']
+    return {'runs': runs, 'best_fps': max(fps) if fps else None,
+            'mean_fps': round(sum(fps) / len(fps), 2) if fps else None}
+
+
+def _consume(client, url, kind, duration, out):
+    # One subscriber: count events and, for detections, publish->receive latency
+    resp = client.get(url)
+    events, nbytes, latencies = 0, 0, []
+    start = None
+    try:
+        for chunk in resp.response:
+            received = time.time()
+            if start is None:
+                # The first event is the packet already published; rate counts from it
+                start = time.perf_counter()
+            else:
+                events += 1
+            nbytes += len(chunk)
+            if kind == 'detections':
+                text = chunk.decode() if isinstance(chunk, bytes) else chunk
+                latencies.append(received - json.loads(text[len('data: '):])['timestamp'])
+            if time.perf_counter() - start >= duration:
+                break
+    finally:
+        resp.close()
+    elapsed = time.perf_counter() - start if start is not None else 0.0
+    out.append({'events': events, 'bytes': nbytes, 'seconds': elapsed, 'latencies': latencies})
+
+
+def bench_streams(A, client, source, subscriber_counts, duration, settle):
+    urls = {'sse': '/api/cctv-stream/{}', 'detections': '/api/cctv-detections/{}', 'mjpeg': '/api/cctv-mjpeg/{}'}
+    rows = []
+    for kind, url in urls.items():
+        for count in subscriber_counts:
+            camera_id = f'bench-{kind}-{count}'
+            resp = client.post('/api/start-cctv', json={'camera_id': camera_id, 'rtsp_url': source})
+            if resp.status_code != 200:
+                raise RuntimeError(f"start-cctv returned {resp.status_code}: {resp.get_json()}")
+            try:
+                time.sleep(settle)  # let the adaptive stride settle
+                out = []
+                threads = [threading.Thread(target=_consume, args=(client, url.format(camera_id), kind, duration, out))
+                           for _ in range(count)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join(duration + 30)
+                engine = A.camera_engines.get('cctv', camera_id)
+                engine_stats = engine.stats() if engine else {}
+            finally:
+                client.post('/api/stop-cctv', json={'camera_id': camera_id})
+
+            fps = [sub['events'] / sub['seconds'] for sub in out if sub['seconds'] > 0]
+            rows.append({
+                'format': kind,
+                'subscribers': count,
+                'fps_per_subscriber': round(sum(fps) / len(fps), 2) if fps else 0.0,
+                'min_fps_per_subscriber': round(min(fps), 2) if fps else 0.0,
+                'mbytes_per_second': round(sum(s['bytes'] for s in out) / duration / 1e6, 3),
+                'delivery_latency': summarize([lat for sub in out for lat in sub['latencies']]),
+                'engine': {key: engine_stats.get(key) for key in
+                           ('sourceFps', 'publishedFps', 'stride', 'inferenceMs', 'latencyMs',
+                            'framesRead', 'framesDropped')},
+            })
+    return {'source': source, 'duration_seconds': duration, 'runs': rows}
+
+
+def bench_alerts_write(A, threads, per_thread, timeout):
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    results = [StubResult(frame)]
+    writer = A.alert_writer
+    written_before = writer.written
+    submit_latencies = [[] for _ in range(threads)]
+
+    def produce(index):
+        # One camera per thread, as engines do: every detection opens an
+        # event and the next (empty) observation past the cooldown closes
+        # it, so each iteration emits exactly one event (snapshot + row)
+        saver = A.make_event_saver('bench', 'bench', f'bench-{index}', 'http://bench')
+        aggregator = A.EventAggregator(saver, cooldown=1.0, min_duration=0.0)
+        base = time.time()
+        latencies = submit_latencies[index]
+        for i in range(per_thread):
+            timestamp = base + i * 10
+            start = time.perf_counter()
+            aggregator.observe(timestamp, A.alert_detections(results), snapshot=frame)
+            aggregator.observe(timestamp + 5, [])
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=produce, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    submitted = time.perf_counter() - start
+    total = threads * per_thread
+    drained = wait_until(lambda: writer.written - written_before >= total, timeout, interval=0.01)
+    persisted = time.perf_counter() - start
+
+    stats = writer.stats()
+    return {
+        'threads': threads,
+        'alerts': total,
+        'submit_per_second': round(total / submitted, 1) if submitted > 0 else None,
+        'submit_latency': summarize([lat for per in submit_latencies for lat in per]),
+        'persisted': drained,
+        'persisted_per_second': round(total / persisted, 1) if drained else None,
+        'seconds_to_persist': round(persisted, 3),
+        'writer': {key: stats[key] for key in ('flushes', 'failed', 'maxFlushMs', 'lastBatchSize')},
+    }
+
+
+def seed_alerts(A, rows, seed=0):
+    """Bulk-insert synthetic alerts straight into the scratch database"""
+    rng = np.random.default_rng(seed)
+    types = ['web', 'cctv', 'video']
+    severities = ['low', 'medium', 'high']
+    base = time.mktime(time.strptime('2025-01-01 00:00:00', '%Y-%m-%d %H:%M:%S'))
+    conn = A.alert_store.connect(A.DB_PATH)
+    try:
+        A.alert_store.ensure_schema(conn)
+        chunk = 50000
+        for offset in range(0, rows, chunk):
+            n = min(chunk, rows - offset)
+            batch = []
+            for i in range(n):
+                stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(base + (offset + i) * 7))
+                cls = int(rng.choice([0, 2, 3, 4]))
+                batch.append((types[i % 3], severities[int(rng.integers(0, 3))], stamp,
+                              f'http://bench/processed/seed_{offset + i}.jpg', f'cam-{int(rng.integers(0, 50))}',
+                              A.CLASS_NAMES[cls], round(float(rng.uniform(0.3, 0.99)), 3), None, None, None,
+                              None, None))
+            with conn:
+                conn.executemany('''
+                    INSERT INTO alerts (alert_type, severity, timestamp, imageurl, camera_id,
+                                        class_name, confidence, end_timestamp, duration, track_id,
+                                        start_offset, end_offset)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', batch)
+    finally:
+        conn.close()
+
+
+def bench_alerts_query(A, client, repeats, deep_pages):
+    def timed(url, headers=None):
+        latencies, status, body = [], None, None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            resp = client.get(url, headers=headers or {})
+            latencies.append(time.perf_counter() - start)
+            status, body = resp.status_code, resp
+        return latencies, status, body
+
+    queries = {
+        'first_page': '/api/alerts',
+        'first_page_500': '/api/alerts?limit=500',
+        'filter_type': '/api/alerts?alert_type=cctv',
+        'filter_camera_range': '/api/alerts?camera_id=cam-7&start=2025-01-02%2000:00:00&end=2025-01-09%2000:00:00',
+        'filter_severity': '/api/alerts?severity=high&limit=500',
+    }
+    out = {}
+    for name, url in queries.items():
+        latencies, status, _ = timed(url)
+        out[name] = {'status': status, **(summarize(latencies) or {})}
+
+    # Walk the cursor deep into the table; each page should cost the same
+    latencies = []
+    cursor = None
+    for _ in range(deep_pages):
+        url = '/api/alerts?limit=500' + (f'&cursor={cursor}' if cursor else '')
+        start = time.perf_counter()
+        resp = client.get(url)
+        latencies.append(time.perf_counter() - start)
+        cursor = resp.get_json().get('nextCursor')
+        if not cursor:
+            break
+    out['cursor_walk_500'] = {'pages': len(latencies), **(summarize(latencies) or {})}
+
+    # Revalidation of an unchanged page should not touch the table
+    resp = client.get('/api/alerts')
+    latencies, status, _ = timed('/api/alerts', {'If-None-Match': resp.headers.get('ETag', '')})
+    out['etag_revalidate'] = {'status': status, **(summarize(latencies) or {})}
+    return out
+
+
+# ---------- comparison ----------
+def flatten(value, prefix=''):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from flatten(item, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            label = item.get('format', '') + str(item.get('subscribers', '')) if isinstance(item, dict) else ''
+            yield from flatten(item, f'{prefix}[{label or i}]')
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        yield prefix, value
+
+
+def compare(baseline, current):
+    old = dict(flatten(baseline.get('results', {})))
+    for key, value in flatten(current.get('results', {})):
+        if key not in old:
+            continue
+        before = old[key]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else 'n/a'
+        print(f"{key:<70} {before:>12} -> {value:<12} {change}")
+
+
+# ---------- main ----------
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--benchmarks', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--video', help='clip to use (default: a generated synthetic clip)')
+    parser.add_argument('--frames', type=int, default=300, help='length of the synthetic clip')
+    parser.add_argument('--model', choices=('configured', 'stub'), default='configured')
+    parser.add_argument('--stub-call-ms', type=float, default=20.0, help='stub cost per model call')
+    parser.add_argument('--stub-image-ms', type=float, default=15.0, help='stub cost per image')
+    parser.add_argument('--video-repeats', type=int, default=2)
+    parser.add_argument('--source', help='camera URL for the stream benchmark (default: paced local MJPEG)')
+    parser.add_argument('--source-fps', type=float, default=25.0, help='frame rate of the local source')
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--stream-seconds', type=float, default=5.0)
+    parser.add_argument('--settle-seconds', type=float, default=2.0)
+    parser.add_argument('--alert-threads', type=int, default=16)
+    parser.add_argument('--alerts-per-thread', type=int, default=500)
+    parser.add_argument('--alert-rows', type=int, default=200000, help='table size for alerts_query')
+    parser.add_argument('--query-repeats', type=int, default=30)
+    parser.add_argument('--deep-pages', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=600.0, help='per job / drain timeout')
+    parser.add_argument('--keep-data', action='store_true', help='leave the scratch directory behind')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--compare', help='earlier --json output to compare against')
+    args = parser.parse_args()
+
+    data_dir = tempfile.mkdtemp(prefix='invigilation-bench-')
+    # The app reads these at import
+    os.environ['DATA_DIR'] = data_dir
+    os.environ['MODEL_WARMUP'] = '0'
+    # Repeats of the same video must be processed, not answered from the cache
+    os.environ['RESULT_CACHE_MAX_BYTES'] = '0'
+    import app as A
+
+    source = None
+    try:
+        video_path = args.video or make_sample_video(os.path.join(data_dir, 'sample.avi'), args.frames)
+        if args.model == 'stub':
+            A.model_provider = StubProvider(StubModel(args.stub_call_ms, args.stub_image_ms))
+        else:
+            A.model_provider.warm_up(batch_sizes=(1, A.INFERENCE_BATCH_SIZE))
+        if 'alerts_query' in args.benchmarks:
+            # Seeded before startup so the feed and ETags start from the full table
+            seed_alerts(A, args.alert_rows)
+        A.startup()
+        client = A.app.test_client()
+
+        results = {}
+        if 'alerts_query' in args.benchmarks:
+            print(f"⏳ alerts_query ({args.alert_rows} rows)...")
+            results['alerts_query'] = bench_alerts_query(A, client, args.query_repeats, args.deep_pages)
+        if 'alerts_write' in args.benchmarks:
+            print("⏳ alerts_write...")
+            results['alerts_write'] = bench_alerts_write(A, args.alert_threads, args.alerts_per_thread,
+                                                         args.timeout)
+        if 'process_video' in args.benchmarks:
+            print("⏳ process_video...")
+            results['process_video'] = bench_process_video(A, client, video_path, args.video_repeats,
+                                                           args.timeout)
+        if 'streams' in args.benchmarks:
+            print("⏳ streams...")
+            if args.source:
+                stream_source = args.source
+            else:
+                source = PacedMjpegSource(video_path, args.source_fps)
+                stream_source = source.url
+            results['streams'] = bench_streams(A, client, stream_source, args.subscribers,
+                                               args.stream_seconds, args.settle_seconds)
+    finally:
+        A.camera_engines.stop_all()
+        if source is not None:
+            source.close()
+        A.alert_writer.close()
+        if not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'model': 'stub' if args.model == 'stub' else A.model_provider.stats(),
+            'config': {key: value for key, value in vars(args).items() if key not in ('json', 'compare')},
+            'env': {key: os.environ.get(key) for key in
+                    ('INFERENCE_BACKEND', 'INFERENCE_PRECISION', 'INFERENCE_BATCH_SIZE', 'LIVE_INFERENCE_MODE',
+                     'SERVING_MODE', 'SCHEDULER_TARGET_FPS', 'MOTION_GATE_ENABLED', 'TRACKING_ENABLED')},
+        },
+        'results': results,
+    }
+    print(json.dumps(results, indent=2))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,681 @@
+import os
+import math
+import time
+import uuid
+import base64
+import json
+import threading
+
+import cv2
+
+from inference import annotate, extract_detections
+from metrics import observe_stage
+from tracking import IoUTracker
+from motion import MotionGate
+
+
+# ================================
+#  SHARED PER-CAMERA ENGINE
+# ================================
+# One engine per camera owns the cv2.VideoCapture, a reader thread that
+# always keeps only the newest frame, and an inference thread that runs
+# the model on that frame and publishes the result. Any number of stream
+# subscribers read the latest published packet, so extra viewers cost an
+# SSE write, not another capture or another YOLO call. Annotation and
+# JPEG encoding are done lazily and at most once per packet.
+#
+# Engines are reference counted: every /api/start-* call acquires one and
+# every /api/stop-* call releases one; the capture is only closed when the
+# last holder lets go.
+
+# End-to-end bound (capture -> published result) the adaptive stride aims for
+STREAM_MAX_LATENCY_MS = float(os.environ.get('STREAM_MAX_LATENCY_MS', 1000))
+STREAM_MAX_STRIDE = int(os.environ.get('STREAM_MAX_STRIDE', 30))
+
+MJPEG_BOUNDARY = 'frame'
+
+
+def _ema(current, sample, alpha=0.2):
+    return sample if current == 0.0 else (1 - alpha) * current + alpha * sample
+
+
+class AdaptiveStride:
+    """Pick how many source frames to skip between inferences.
+
+    The floor is the number of frames the source delivers between two
+    frames the consumer actually takes: one inference on a per-camera
+    thread, or one scheduler pass in batched mode (decoding the frames in
+    between would only be thrown away). On top of
+    that, if measured capture-to-publish latency exceeds the bound the
+    stride doubles; once latency is comfortably below it the stride
+    steps back down towards the floor.
+    """
+
+    def __init__(self, max_latency_ms=STREAM_MAX_LATENCY_MS, max_stride=STREAM_MAX_STRIDE):
+        self.max_latency = max_latency_ms / 1000.0
+        self.max_stride = max(1, max_stride)
+        self.stride = 1
+        self.source_fps = 0.0
+        self.infer_seconds = 0.0
+        self.consume_seconds = 0.0
+        self.latency_seconds = 0.0
+
+    def observe_source(self, frame_interval):
+        if frame_interval > 0:
+            self.source_fps = _ema(self.source_fps, 1.0 / frame_interval)
+
+    def observe_result(self, infer_seconds, latency_seconds, consume_seconds=None):
+        """consume_seconds: time between frames taken by a batching scheduler, if any"""
+        if infer_seconds is not None:
+            self.infer_seconds = _ema(self.infer_seconds, infer_seconds)
+        if consume_seconds is not None:
+            self.consume_seconds = _ema(self.consume_seconds, consume_seconds)
+        self.latency_seconds = _ema(self.latency_seconds, latency_seconds)
+
+        floor = 1
+        interval = max(self.infer_seconds, self.consume_seconds)
+        if self.source_fps > 0 and interval > 0:
+            floor = max(1, math.ceil(interval * self.source_fps - 1e-6))
+
+        if self.latency_seconds > self.max_latency:
+            stride = max(floor, self.stride * 2)
+        elif self.latency_seconds < 0.5 * self.max_latency:
+            stride = max(floor, self.stride - 1)
+        else:
+            stride = max(floor, self.stride)
+        self.stride = min(self.max_stride, stride)
+        return self.stride
+
+
+class FramePacket:
+    """One published inference result; encodings are computed once and shared"""
+
+    def __init__(self, seq, camera_id, frame, results, timestamp=None, tracks=None, preview_width=None,
+                 kind=None):
+        self.seq = seq
+        self.camera_id = camera_id
+        # Source kind (webcam/cctv), only used to label stage metrics
+        self.kind = kind
+        self.frame = frame
+        self.results = results
+        self.timestamp = timestamp or time.time()
+        # Detections with track ids, when the engine tracks
+        self.tracks = tracks
+        # Images sent to viewers are capped at this width (tiled cameras)
+        self.preview_width = preview_width
+        self._annotated = None
+        self._jpegs = {}
+        self._event = None
+        self._detections_event = None
+
+    def repeat(self, seq, timestamp=None):
+        """A new packet re-announcing these results (motion gate skipped the frame).
+
+        Shares the rendered image and JPEG caches, so a repeat costs no
+        plot() or imencode for image viewers either.
+        """
+        packet = FramePacket(seq, self.camera_id, self.frame, self.results, timestamp, self.tracks,
+                             self.preview_width, self.kind)
+        packet._annotated = self._annotated
+        packet._jpegs = self._jpegs
+        packet._event = self._event
+        return packet
+
+    @property
+    def annotated(self):
+        # plot() only runs if somebody wants pixels; metadata-only viewers
+        # never pay for it
+        if self._annotated is None:
+            start = time.perf_counter()
+            self._annotated = annotate(self.results)
+            observe_stage(self.kind, self.camera_id, 'plot', time.perf_counter() - start)
+        return self._annotated
+
+    def detections(self):
+        """Compact per-frame record: timestamp, camera, boxes, classes, confidences"""
+        height, width = self.frame.shape[:2]
+        return {
+            'cameraId': self.camera_id,
+            'seq': self.seq,
+            'timestamp': round(self.timestamp, 3),
+            'width': width,
+            'height': height,
+            'detections': self.tracks if self.tracks is not None else extract_detections(self.results[0]),
+        }
+
+    def detections_event(self):
+        if self._detections_event is None:
+            payload = json.dumps(self.detections(), separators=(',', ':'))
+            self._detections_event = f"data: {payload}\n\n"
+        return self._detections_event
+
+    def jpeg(self, quality=None, width=None, raw=False):
+        """JPEG bytes of the annotated (or raw) frame, optionally re-scaled to width.
+
+        Each (quality, width, raw) variant is encoded at most once per packet
+        no matter how many viewers ask for it.
+        """
+        width = width or self.preview_width
+        key = (quality, width, raw)
+        data = self._jpegs.get(key)
+        if data is None:
+            image = self.frame if raw else self.annotated
+            start = time.perf_counter()
+            if width and width < image.shape[1]:
+                height = int(round(image.shape[0] * width / image.shape[1]))
+                image = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+            params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)] if quality else []
+            ok, buffer = cv2.imencode('.jpg', image, params)
+            if not ok:
+                return None
+            data = buffer.tobytes()
+            observe_stage(self.kind, self.camera_id, 'encode', time.perf_counter() - start)
+            self._jpegs[key] = data
+        return data
+
+    def sse_event(self):
+        # Same payload shape the dashboard has always consumed
+        if self._event is None:
+            data = self.jpeg()
+            if data is None:
+                return None
+            frame_bytes = base64.b64encode(data).decode('utf-8')
+            self._event = f"data: {json.dumps({'image': frame_bytes})}\n\n"
+        return self._event
+
+    def mjpeg_part(self, quality=None, width=None, raw=False):
+        """One multipart/x-mixed-replace part carrying the JPEG bytes as-is"""
+        data = self.jpeg(quality, width, raw)
+        if data is None:
+            return None
+        header = (f"--{MJPEG_BOUNDARY}\r\n"
+                  f"Content-Type: image/jpeg\r\n"
+                  f"Content-Length: {len(data)}\r\n\r\n").encode('ascii')
+        return header + data + b"\r\n"
+
+
+def configure_webcam(cap):
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+    cap.set(cv2.CAP_PROP_FPS, 30)
+
+
+class PacketSubscriptions:
+    """Latest-packet fan-out shared by local and remote engines.
+
+    Expects _packet, _raw_packet, _packet_cond, _lock, subscribers and
+    running on the instance. _packet is the latest inference result;
+    _raw_packet the latest plain frame from the reader, published at the
+    source rate while anyone watches raw video, independently of inference.
+    """
+
+    def latest(self):
+        return self._packet
+
+    def _current(self, want):
+        return self._raw_packet if want == 'raw' else self._packet
+
+    def wait_for_packet(self, after_seq, timeout=1.0, want=None):
+        """Block until a packet newer than after_seq exists; None on timeout/stop"""
+        with self._packet_cond:
+            deadline = time.monotonic() + timeout
+            while (self._current(want) is None or self._current(want).seq <= after_seq) and self.running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                self._packet_cond.wait(timeout=remaining)
+            packet = self._current(want)
+            if packet is None or packet.seq <= after_seq:
+                return None
+            return packet
+
+    def subscribe(self, want='annotated'):
+        """Yield each new packet as it is published until the engine stops.
+
+        Slow subscribers simply skip to the newest packet instead of
+        queueing stale frames. want ('annotated', 'raw' or None) says which
+        image the subscriber will read; see _watch. 'raw' subscribers get
+        the reader's frame packets (no results) instead of inference results.
+        """
+        with self._lock:
+            self.subscribers += 1
+        self._watch(want, 1)
+        try:
+            last_seq = 0
+            while self.running:
+                packet = self.wait_for_packet(last_seq, want=want)
+                if packet is None:
+                    continue
+                last_seq = packet.seq
+                yield packet
+        finally:
+            self._watch(want, -1)
+            with self._lock:
+                self.subscribers -= 1
+
+    def _watch(self, want, delta):
+        # Counts who reads which image: local engines only publish raw
+        # frames while somebody watches them, remote engines tell the
+        # worker which images to ship
+        pass
+
+
+class CameraEngine(PacketSubscriptions):
+    def __init__(self, camera_id, kind, source, infer, on_result=None, scheduler=None, on_stop=None,
+                 tracking=False, motion_gating=False, tiler=None, on_raw=None, raw_wanted=None):
+        """
+        source:    device index or URL passed to cv2.VideoCapture
+        infer:     infer(frame) -> results; with a tiler it is also called
+                   with a list of tile images and must return one result
+                   per tile (as the Ultralytics model does)
+        on_result: optional on_result(engine, packet) hook run on the
+                   inference thread after each publish (alert checks etc.)
+        scheduler: optional InferenceScheduler; when given, the engine has
+                   no inference thread of its own and the scheduler batches
+                   its frames together with every other camera's
+        on_stop:   optional on_stop(engine) run once when the engine stops
+        tracking:  attach IoU track ids to every published packet
+        motion_gating: skip inference on frames that barely differ from the
+                   last inferred one and re-publish the previous results
+        tiler:     optional TileLayout; the model then sees the ROI tiles
+                   instead of the whole frame and viewers get a preview
+        on_raw:    optional on_raw(engine, packet) hook run on the reader
+                   thread for every raw frame packet
+        raw_wanted: optional callable, True while viewers outside this
+                   process (see serving.py) watch the raw frames
+        """
+        self.id = uuid.uuid4().hex  # lets a holder release this engine and not its replacement
+        self.camera_id = camera_id
+        self.kind = kind
+        self.source = source
+        self._infer = infer
+        self._on_result = on_result
+        self._scheduler = scheduler
+        self._on_stop = on_stop
+        self._on_raw = on_raw
+        self._raw_wanted = raw_wanted
+        self._stop_hook_done = False
+        self.tracker = IoUTracker() if tracking else None
+        self.motion_gate = MotionGate() if motion_gating else None
+        self.tiler = tiler
+
+        self.cap = None
+        self.refs = 0
+        self.subscribers = 0
+        self.running = False
+
+        self._latest_frame = None
+        self._latest_frame_seq = 0
+        self._latest_frame_at = 0.0
+        self._frame_cond = threading.Condition()
+
+        self.adaptive = AdaptiveStride()
+        self.frames_read = 0
+        self.frames_dropped = 0
+        # Rate at which results (inferred or motion-gate repeats) are published
+        self.published_fps = 0.0
+        self._last_publish_at = None
+
+        self._packet = None
+        self._raw_packet = None
+        self.raw_viewers = 0
+        self._packet_cond = threading.Condition()
+
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    # ---------- lifecycle ----------
+    def open(self, configure=None):
+        """Open the capture; returns False if the source could not be opened"""
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        # Keep the driver-side queue as short as possible; stale buffered
+        # frames are what makes RTSP latency creep up
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if configure is not None:
+            configure(cap)
+        self.cap = cap
+        return True
+
+    def start(self):
+        self.running = True
+        self._threads = [
+            threading.Thread(target=self._read_loop, name=f'{self.kind}-{self.camera_id}-read', daemon=True),
+        ]
+        if self._scheduler is None:
+            self._threads.append(
+                threading.Thread(target=self._infer_loop, name=f'{self.kind}-{self.camera_id}-infer', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        if self._scheduler is not None:
+            self._scheduler.register(self)
+
+    def stop(self):
+        if self._scheduler is not None:
+            self._scheduler.unregister(self)
+        self._stop_event.set()
+        self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        with self._packet_cond:
+            self._packet_cond.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=2)
+        self._run_stop_hook()
+
+    def raw_watched(self):
+        return self.raw_viewers > 0 or (self._raw_wanted is not None and self._raw_wanted())
+
+    def _watch(self, want, delta):
+        if want == 'raw':
+            with self._lock:
+                self.raw_viewers += delta
+
+    def _run_stop_hook(self):
+        with self._lock:
+            if self._stop_hook_done or self._on_stop is None:
+                return
+            self._stop_hook_done = True
+        try:
+            self._on_stop(self)
+        except Exception as e:
+            print(f"❌ Stop hook failed for camera {self.camera_id}: {str(e)}")
+
+    # ---------- worker threads ----------
+    def _read_loop(self):
+        # The reader owns the capture and is the only thread that releases it.
+        # Every frame is grab()bed so the source never backs up, but only
+        # every stride-th one is decoded with retrieve(); the rest are dropped.
+        # While anyone watches the raw video every frame is decoded and
+        # published as a raw packet, whatever inference keeps up with.
+        try:
+            last_grab = None
+            since_retrieve = 0
+            while not self._stop_event.is_set():
+                if not self.cap.grab():
+                    print(f"⚠️ Capture ended for {self.kind} camera {self.camera_id}")
+                    break
+                now = time.monotonic()
+                if last_grab is not None:
+                    self.adaptive.observe_source(now - last_grab)
+                last_grab = now
+                self.frames_read += 1
+
+                since_retrieve += 1
+                raw_watched = self.raw_watched()
+                if since_retrieve < self.adaptive.stride and not raw_watched:
+                    self.frames_dropped += 1
+                    continue
+                since_retrieve = 0
+
+                decode_start = time.perf_counter()
+                success, frame = self.cap.retrieve()
+                if not success:
+                    continue
+                observe_stage(self.kind, self.camera_id, 'decode', time.perf_counter() - decode_start)
+                with self._frame_cond:
+                    self._latest_frame = frame
+                    self._latest_frame_seq += 1
+                    self._latest_frame_at = now
+                    self._frame_cond.notify_all()
+                if raw_watched:
+                    self._publish_raw(frame)
+        finally:
+            self.cap.release()
+            self._shutdown_from_worker()
+            # The source may have ended on its own with nobody calling stop()
+            self._run_stop_hook()
+
+    def _infer_loop(self):
+        last_seq = 0
+        while not self._stop_event.is_set():
+            with self._frame_cond:
+                while self._latest_frame_seq == last_seq and not self._stop_event.is_set():
+                    self._frame_cond.wait(timeout=0.5)
+                if self._stop_event.is_set():
+                    break
+                frame = self._latest_frame
+                captured_at = self._latest_frame_at
+                last_seq = self._latest_frame_seq
+
+            if not self.gate_frame(frame):
+                continue
+            try:
+                start = time.monotonic()
+                if self.tiler is not None:
+                    results = self.combine(frame, [[r] for r in self._infer(self.model_inputs(frame))])
+                else:
+                    results = self._infer(frame)
+                infer_seconds = time.monotonic() - start
+            except Exception as e:
+                print(f"Error processing {self.kind} frame for camera {self.camera_id}: {str(e)}")
+                continue
+            self.handle_result(frame, results, captured_at, infer_seconds)
+        self._shutdown_from_worker()
+
+    def take_frame(self, after_seq):
+        """Non-blocking: (frame, seq, captured_at) if a frame newer than after_seq exists"""
+        with self._frame_cond:
+            if self._latest_frame is None or self._latest_frame_seq <= after_seq:
+                return None
+            return self._latest_frame, self._latest_frame_seq, self._latest_frame_at
+
+    def model_inputs(self, frame):
+        """Images the model should see for this frame: its ROI tiles, or the frame"""
+        return self.tiler.crop(frame) if self.tiler is not None else [frame]
+
+    def combine(self, frame, outputs):
+        """One results list per model_inputs() image -> results for the frame"""
+        if self.tiler is None:
+            return outputs[0]
+        return self.tiler.merge(frame, [results[0] if results else None for results in outputs])
+
+    def gate_frame(self, frame):
+        """False if the motion gate skipped this frame (previous results re-published)"""
+        if self.motion_gate is None or self._packet is None:
+            return True
+        if self.motion_gate.check(frame, time.monotonic()):
+            return True
+        with self._packet_cond:
+            packet = self._packet.repeat(self._packet.seq + 1)
+            self._packet = packet
+            self._count_publish()
+            self._packet_cond.notify_all()
+        self._run_result_hook(packet)
+        return False
+
+    def handle_result(self, frame, results, captured_at=None, infer_seconds=None):
+        """Publish an inference result to subscribers and run the result hook"""
+        packet = self._publish(frame, results)
+        if infer_seconds is not None:
+            observe_stage(self.kind, self.camera_id, 'inference', infer_seconds)
+        if captured_at:
+            self.adaptive.observe_result(infer_seconds, time.monotonic() - captured_at, self._consume_interval())
+        self._run_result_hook(packet)
+        return packet
+
+    def _consume_interval(self):
+        # Batched mode takes one frame per scheduler pass, however fast the
+        # model is: the target interval, or the achieved one when it falls behind
+        if self._scheduler is None:
+            return None
+        interval = 1.0 / self._scheduler.target_fps
+        if self.published_fps > 0:
+            interval = max(interval, 1.0 / self.published_fps)
+        return interval
+
+    def _run_result_hook(self, packet):
+        if self._on_result is not None:
+            try:
+                self._on_result(self, packet)
+            except Exception as e:
+                print(f"❌ Result hook failed for camera {self.camera_id}: {str(e)}")
+
+    def stats(self):
+        adaptive = self.adaptive
+        return {
+            'cameraId': self.camera_id,
+            'kind': self.kind,
+            'running': self.running,
+            'viewers': self.refs,
+            'subscribers': self.subscribers,
+            'stride': adaptive.stride,
+            'sourceFps': round(adaptive.source_fps, 2),
+            'inferenceMs': round(adaptive.infer_seconds * 1000, 1),
+            'latencyMs': round(adaptive.latency_seconds * 1000, 1),
+            'publishedFps': round(self.published_fps, 2),
+            'framesRead': self.frames_read,
+            'framesDropped': self.frames_dropped,
+            'motionGate': self.motion_gate.stats() if self.motion_gate else None,
+            'tiling': self.tiler.stats() if self.tiler else None,
+        }
+
+    def _shutdown_from_worker(self):
+        # Wake subscribers so they notice the engine is gone
+        if self._scheduler is not None:
+            self._scheduler.unregister(self)
+        self._stop_event.set()
+        self.running = False
+        with self._frame_cond:
+            self._frame_cond.notify_all()
+        with self._packet_cond:
+            self._packet_cond.notify_all()
+
+    def _publish(self, frame, results):
+        timestamp = time.time()
+        tracks = None
+        if self.tracker is not None:
+            # Only one thread infers for a given engine, so updates stay ordered
+            tracks = self.tracker.update(timestamp, extract_detections(results[0]))
+        with self._packet_cond:
+            seq = self._packet.seq + 1 if self._packet is not None else 1
+            packet = FramePacket(seq, self.camera_id, frame, results, timestamp, tracks,
+                                 self.tiler.preview_width if self.tiler else None, self.kind)
+            self._packet = packet
+            self._count_publish()
+            self._packet_cond.notify_all()
+        return packet
+
+    def _publish_raw(self, frame):
+        with self._packet_cond:
+            seq = self._raw_packet.seq + 1 if self._raw_packet is not None else 1
+            packet = FramePacket(seq, self.camera_id, frame, None, time.time(),
+                                 preview_width=self.tiler.preview_width if self.tiler else None, kind=self.kind)
+            self._raw_packet = packet
+            self._packet_cond.notify_all()
+        if self._on_raw is not None:
+            try:
+                self._on_raw(self, packet)
+            except Exception as e:
+                print(f"❌ Raw frame hook failed for camera {self.camera_id}: {str(e)}")
+        return packet
+
+    def _count_publish(self):
+        # Caller holds _packet_cond
+        now = time.monotonic()
+        if self._last_publish_at is not None and now > self._last_publish_at:
+            self.published_fps = _ema(self.published_fps, 1.0 / (now - self._last_publish_at))
+        self._last_publish_at = now
+
+
+
+class EngineRegistry:
+    """Reference-counted registry of running CameraEngines keyed by (kind, camera_id)"""
+
+    def __init__(self, scheduler=None, tracking=False, motion_gating=False):
+        self.scheduler = scheduler
+        self.tracking = tracking
+        self.motion_gating = motion_gating
+        self._engines = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, kind, camera_id, source, infer, on_result=None, configure=None, on_stop=None,
+                tiler=None):
+        """Return a running engine for the camera, starting one if needed.
+
+        If an engine already runs for this camera with a different source
+        it is replaced, but only once the new source has opened. Returns
+        None if the source cannot be opened.
+        """
+        key = (kind, camera_id)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is not None and engine.running and engine.source == source:
+                engine.refs += 1
+                return engine
+            old = engine
+
+        # Opening can take seconds (RTSP timeouts), so other cameras aren't
+        # kept waiting on the registry lock meanwhile
+        engine = CameraEngine(camera_id, kind, source, infer, on_result, self.scheduler, on_stop,
+                              self.tracking, self.motion_gating, tiler)
+        opened = engine.open(configure)
+        if not opened and old is not None:
+            # The old capture may still hold the device: stop it and retry once
+            self._discard(key, old)
+            opened = engine.open(configure)
+        if not opened:
+            return None
+
+        with self._lock:
+            current = self._engines.get(key)
+            if current is not None and current is not old and current.running and current.source == source:
+                # Someone else started the same source meanwhile; share theirs
+                current.refs += 1
+                engine.cap.release()
+                return current
+            engine.refs = 1
+            engine.start()
+            self._engines[key] = engine
+
+        if current is not None:
+            current.stop()
+        return engine
+
+    def _discard(self, key, engine):
+        with self._lock:
+            if self._engines.get(key) is engine:
+                del self._engines[key]
+        engine.stop()
+
+    def release(self, kind, camera_id, force=False, engine_id=None):
+        """Drop one reference; the engine stops when none remain. Returns refs left.
+
+        With engine_id, only that engine is released: if it has since been
+        replaced, its references went with it and this is a no-op.
+        """
+        key = (kind, camera_id)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None or (engine_id is not None and engine.id != engine_id):
+                return 0
+            engine.refs = 0 if force else max(0, engine.refs - 1)
+            if engine.refs > 0 and engine.running:
+                return engine.refs
+            del self._engines[key]
+        engine.stop()
+        return 0
+
+    def get(self, kind, camera_id):
+        with self._lock:
+            engine = self._engines.get((kind, camera_id))
+        if engine is not None and not engine.running:
+            # Source went away on its own; forget it
+            self.release(kind, camera_id, force=True, engine_id=engine.id)
+            return None
+        return engine
+
+    def all(self):
+        with self._lock:
+            return list(self._engines.values())
+
+    def stop_all(self):
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+        for engine in engines:
+            engine.stop()
@@ -0,0 +1,188 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from inference import CLASS_NAMES
+
+
+# ================================
+#  PER-FRAME DETECTION INDEX
+# ================================
+# Every processed video gets a columnar record of what the model saw in
+# each frame, next to the annotated output:
+#
+#   processed/<name>.mp4
+#   processed/<name>.detections.npz   one row per detection:
+#       frame      int32    frame number in the video
+#       time       float32  seconds from the start (frame / fps)
+#       cls        int16    class id (see CLASS_NAMES)
+#       conf       float32  confidence
+#       box        float32  (N, 4) x1, y1, x2, y2 in pixels
+#       track      int32    tracker id, -1 without tracking
+#   plus fps, frames (total) and version scalars. Frames the motion gate
+#   skipped without a tracker have no rows of their own: the boxes drawn
+#   on them are the previous frame's.
+#
+# Finding "every passingNotes above 0.6 in the second half hour" is then a
+# couple of vectorised comparisons over arrays already in memory instead
+# of re-running inference or scrubbing the video. Loaded indexes are kept
+# in a small LRU (DETECTION_INDEX_CACHE) keyed by path and mtime.
+
+DETECTION_INDEX_VERSION = 1
+DETECTION_INDEX_SUFFIX = '.detections.npz'
+DETECTION_INDEX_CACHE = int(os.environ.get('DETECTION_INDEX_CACHE', 16))
+
+CLASS_IDS = {name.lower(): cls for cls, name in CLASS_NAMES.items()}
+COLUMN_DTYPES = {'frame': np.int32, 'cls': np.int16, 'conf': np.float32, 'box': np.float32, 'track': np.int32}
+
+
+def index_path_for(output_path):
+    """Where the detection index for output_path lives"""
+    return os.path.splitext(output_path)[0] + DETECTION_INDEX_SUFFIX
+
+
+class DetectionIndexWriter:
+    """Collects detections frame by frame and writes them as one .npz"""
+
+    def __init__(self, path, fps):
+        self.path = path
+        self.fps = fps
+        self.frames = 0
+        self._columns = {name: [] for name in COLUMN_DTYPES}
+
+    def add_result(self, frame_index, result):
+        """Record an Ultralytics result for frame_index (None: nothing detected)"""
+        self.frames = max(self.frames, frame_index + 1)
+        boxes = None if result is None else result.boxes
+        if boxes is None or len(boxes) == 0:
+            return
+        self._append(frame_index, boxes.xyxy.cpu().numpy(), boxes.cls.cpu().numpy(),
+                     boxes.conf.cpu().numpy(), None)
+
+    def add_detections(self, frame_index, detections):
+        """Record detection dicts (box, cls, conf and optionally track) for frame_index"""
+        self.frames = max(self.frames, frame_index + 1)
+        if not detections:
+            return
+        self._append(frame_index, [d['box'] for d in detections], [d['cls'] for d in detections],
+                     [d['conf'] for d in detections], [d.get('track', -1) for d in detections])
+
+    def _append(self, frame_index, boxes, classes, confidences, tracks):
+        count = len(classes)
+        columns = self._columns
+        columns['frame'].append(np.full(count, frame_index, dtype=COLUMN_DTYPES['frame']))
+        columns['cls'].append(np.asarray(classes, dtype=COLUMN_DTYPES['cls']))
+        columns['conf'].append(np.asarray(confidences, dtype=COLUMN_DTYPES['conf']))
+        columns['box'].append(np.asarray(boxes, dtype=COLUMN_DTYPES['box']).reshape(count, 4))
+        columns['track'].append(np.full(count, -1, dtype=COLUMN_DTYPES['track']) if tracks is None
+                                else np.asarray(tracks, dtype=COLUMN_DTYPES['track']))
+
+    def save(self):
+        columns = {name: np.concatenate(chunks) if chunks else
+                   np.zeros((0, 4) if name == 'box' else 0, dtype=COLUMN_DTYPES[name])
+                   for name, chunks in self._columns.items()}
+        columns['time'] = (columns['frame'] / float(self.fps)).astype(np.float32)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, fps=np.float32(self.fps), frames=np.int64(self.frames),
+                     version=np.int32(DETECTION_INDEX_VERSION), **columns)
+        os.replace(tmp_path, self.path)
+        return len(columns['frame'])
+
+
+_loaded = OrderedDict()
+_loaded_lock = threading.Lock()
+
+
+def load_index(path):
+    """{column: array} for the index at path, from the LRU when unchanged"""
+    stamp = (path, os.stat(path).st_mtime_ns)
+    with _loaded_lock:
+        index = _loaded.get(stamp)
+        if index is not None:
+            _loaded.move_to_end(stamp)
+            return index
+    with np.load(path) as data:
+        index = {name: data[name] for name in data.files}
+    with _loaded_lock:
+        _loaded[stamp] = index
+        while len(_loaded) > DETECTION_INDEX_CACHE:
+            _loaded.popitem(last=False)
+    return index
+
+
+def parse_classes(values):
+    """Class ids from names or ids (repeated and/or comma-separated); ValueError if unknown"""
+    classes = []
+    for value in values:
+        for part in str(value).split(','):
+            part = part.strip()
+            if not part:
+                continue
+            if part.isdigit() and int(part) in CLASS_NAMES:
+                classes.append(int(part))
+            elif part.lower() in CLASS_IDS:
+                classes.append(CLASS_IDS[part.lower()])
+            else:
+                raise ValueError(f"Unknown class '{part}'")
+    return classes
+
+
+def query(index, classes=None, start=None, end=None, min_conf=None):
+    """Row numbers matching every given filter, in frame order"""
+    mask = np.ones(len(index['frame']), dtype=bool)
+    if classes:
+        mask &= np.isin(index['cls'], classes)
+    if start is not None:
+        mask &= index['time'] >= start
+    if end is not None:
+        mask &= index['time'] <= end
+    if min_conf is not None:
+        mask &= index['conf'] >= min_conf
+    return np.flatnonzero(mask)
+
+
+def incidents(index, rows, gap=1.0):
+    """Group matching rows into per-class runs with no more than gap seconds between detections.
+
+    Each incident's seekTo is where a player should jump to (its start).
+    """
+    if len(rows) == 0:
+        return []
+    classes = index['cls'][rows]
+    times = index['time'][rows]
+    order = np.lexsort((times, classes))
+    classes, times = classes[order], times[order]
+    confidences = index['conf'][rows][order]
+    frames = index['frame'][rows][order]
+    breaks = np.flatnonzero((np.diff(classes) != 0) | (np.diff(times) > gap)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(order)])) - 1
+    peaks = np.maximum.reduceat(confidences, starts)
+    found = [{
+        'class': CLASS_NAMES.get(int(classes[first]), 'unknown'),
+        'classId': int(classes[first]),
+        'start': round(float(times[first]), 3),
+        'end': round(float(times[last]), 3),
+        'seekTo': round(float(times[first]), 3),
+        'startFrame': int(frames[first]),
+        'endFrame': int(frames[last]),
+        'detections': int(last - first + 1),
+        'peakConfidence': round(float(peak), 3),
+    } for first, last, peak in zip(starts, ends, peaks)]
+    found.sort(key=lambda incident: (incident['start'], incident['classId']))
+    return found
+
+
+def rows_to_dicts(index, rows):
+    return [{
+        'frame': int(index['frame'][row]),
+        'time': round(float(index['time'][row]), 3),
+        'class': CLASS_NAMES.get(int(index['cls'][row]), 'unknown'),
+        'classId': int(index['cls'][row]),
+        'confidence': round(float(index['conf'][row]), 3),
+        'box': [round(float(v), 1) for v in index['box'][row]],
+        'track': int(index['track'][row]) if index['track'][row] >= 0 else None,
+    } for row in rows]
@@ -0,0 +1,154 @@
+import os
+import threading
+
+from inference import ALERT_CLASSES, alert_detections
+
+
+# ================================
+#  TEMPORAL ALERT AGGREGATION
+# ================================
+# A student leaning sideways for ten seconds is one incident, not fifty.
+# The aggregator merges consecutive detections of the same class into an
+# open event and only emits it once the class has been absent for the
+# cooldown (or the event hits its maximum length). Each emitted event
+# carries start/end time, peak confidence and the single snapshot taken
+# at that peak, so it costs one JPEG and one DB row. Events shorter than
+# the minimum duration are treated as flicker and dropped.
+
+ALERT_COOLDOWN_SECONDS = float(os.environ.get('ALERT_COOLDOWN_SECONDS', 2.0))
+ALERT_MIN_DURATION_SECONDS = float(os.environ.get('ALERT_MIN_DURATION_SECONDS', 0.5))
+ALERT_MAX_EVENT_SECONDS = float(os.environ.get('ALERT_MAX_EVENT_SECONDS', 60.0))
+
+
+class AlertEvent:
+    def __init__(self, key, class_id, start, confidence, snapshot, track_id=None):
+        self.key = key
+        self.class_id = class_id
+        self.track_id = track_id
+        self.start = start
+        self.end = start
+        self.peak_confidence = confidence
+        self.peak_time = start
+        self.frames = 1
+        # Whatever the caller handed in at the peak: an image, or a callable
+        # producing one, so the expensive render happens only on emit
+        self._snapshot = snapshot
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def update(self, timestamp, confidence, snapshot):
+        self.end = timestamp
+        self.frames += 1
+        if confidence > self.peak_confidence:
+            self.peak_confidence = confidence
+            self.peak_time = timestamp
+            self._snapshot = snapshot
+
+    def snapshot(self):
+        return self._snapshot() if callable(self._snapshot) else self._snapshot
+
+    def detach(self):
+        """Render the snapshot now, so the event can be pickled to another process"""
+        self._snapshot = self.snapshot()
+        return self
+
+
+class EventAggregator:
+    def __init__(self, on_event, cooldown=ALERT_COOLDOWN_SECONDS,
+                 min_duration=ALERT_MIN_DURATION_SECONDS, max_duration=ALERT_MAX_EVENT_SECONDS):
+        """
+        on_event:     on_event(event) called for every event that is kept
+        cooldown:     seconds a class may be absent before its event closes
+        min_duration: events shorter than this are discarded
+        max_duration: long-running events are emitted (and restarted) at this length
+        """
+        self.on_event = on_event
+        self.cooldown = cooldown
+        self.min_duration = min_duration
+        self.max_duration = max_duration
+        self._open = {}
+        self._lock = threading.Lock()
+        self.emitted = 0
+        self.discarded = 0
+
+    def observe(self, timestamp, detections, snapshot=None):
+        """Feed one inference result.
+
+        timestamp:  seconds on any monotonic clock (wall time, video time)
+        detections: iterable of (class_id, confidence) or, with tracking,
+                    (class_id, confidence, track_id) for alert classes;
+                    tracked detections get one event per student and class
+        snapshot:   image or zero-argument callable for this frame
+        """
+        seen = {}
+        for detection in detections:
+            class_id, confidence = detection[0], detection[1]
+            track_id = detection[2] if len(detection) > 2 else None
+            key = (track_id, class_id) if track_id is not None else class_id
+            if key not in seen or confidence > seen[key][1]:
+                seen[key] = (class_id, confidence, track_id)
+
+        closed = []
+        with self._lock:
+            for key, (class_id, confidence, track_id) in seen.items():
+                event = self._open.get(key)
+                if event is None:
+                    self._open[key] = AlertEvent(key, class_id, timestamp, confidence, snapshot, track_id)
+                else:
+                    event.update(timestamp, confidence, snapshot)
+                    if event.duration >= self.max_duration:
+                        closed.append(self._close(key))
+
+            for key, event in list(self._open.items()):
+                if key not in seen and timestamp - event.end > self.cooldown:
+                    closed.append(self._close(key))
+        # Outside the lock: on_event writes a JPEG and must not stall other observers
+        self._emit(closed)
+
+    def flush(self):
+        """Close every open event (end of video, camera stopped)"""
+        with self._lock:
+            closed = [self._close(key) for key in list(self._open)]
+        self._emit(closed)
+
+    def open_events(self):
+        return len(self._open)
+
+    def _close(self, key):
+        """Remove the open event for key; the event if it is kept, else None (caller holds the lock)"""
+        event = self._open.pop(key)
+        if event.duration < self.min_duration:
+            self.discarded += 1
+            return None
+        self.emitted += 1
+        return event
+
+    def _emit(self, events):
+        for event in events:
+            if event is None:
+                continue
+            try:
+                self.on_event(event)
+            except Exception as e:
+                print(f"❌ Failed emitting alert event: {str(e)}")
+
+
+def alert_hooks(on_event):
+    """(on_result, on_stop) pair for a camera engine that aggregates its packets into events"""
+    aggregator = EventAggregator(on_event)
+
+    def on_result(engine, packet):
+        if packet.tracks is not None:
+            detections = [(d['cls'], d['conf'], d['track']) for d in packet.tracks
+                          if d['cls'] in ALERT_CLASSES]
+        else:
+            detections = alert_detections(packet.results)
+        # Snapshot is rendered lazily, only for the peak frame of a kept event
+        aggregator.observe(packet.timestamp, detections, snapshot=lambda: packet.annotated)
+
+    def on_stop(engine):
+        aggregator.flush()
+
+    return on_result, on_stop
@@ -0,0 +1,208 @@
+import os
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+# ================================
+#  SHARED-MEMORY FRAME RING
+# ================================
+# Hands published frames from a camera worker process to the web process
+# without pickling them. The ring is one shared-memory segment:
+#
+#   header       int64[8]        latest seq, what readers want, geometry
+#   slot headers int64[slots, 8] seq, meta length, image sizes per slot
+#   slot data    uint8[slots, meta_bytes + 2 * frame_bytes]
+#                                detections JSON | annotated image | raw image
+#
+# Inference results and, while anyone watches raw video, the reader's raw
+# frames take turns in the slots (a raw slot carries only the raw image).
+#
+# There is exactly one writer (the worker). Packet seq n goes to slot
+# n % slots. The slot's seq is set to -1 while it is being rewritten and
+# to n once the copy is done, so a reader that sees the seq it expected
+# both before and after using a slot knows the bytes were not torn.
+# Readers get NumPy views straight onto the segment and encode JPEGs from
+# them without copying the frame first.
+#
+# Readers tell the writer which images anyone is looking at (want
+# counters in the header), so a camera watched only through the
+# detections stream never copies pixels at all.
+#
+# A ring takes RING_SLOTS * 2 * width * height * 3 bytes of /dev/shm, so
+# the worker sizes it to the camera's own resolution (capped at
+# RING_MAX_WIDTH x RING_MAX_HEIGHT): about 7 MB for 640x480, 50 MB for
+# 1080p. Docker gives containers 64 MB of /dev/shm by default; run with
+# --shm-size large enough for every camera served at once.
+
+RING_SLOTS = int(os.environ.get('RING_SLOTS', 4))
+RING_MAX_WIDTH = int(os.environ.get('RING_MAX_WIDTH', 1920))
+RING_MAX_HEIGHT = int(os.environ.get('RING_MAX_HEIGHT', 1080))
+RING_META_BYTES = int(os.environ.get('RING_META_BYTES', 64 * 1024))
+
+# Header fields
+_LATEST, _WANT_ANNOTATED, _WANT_RAW, _SLOTS, _MAX_HEIGHT, _MAX_WIDTH, _META_BYTES = range(7)
+# Slot header fields
+_SEQ, _META_LEN, _ANNOTATED_H, _ANNOTATED_W, _RAW_H, _RAW_W = range(6)
+_FIELDS = 8
+_WRITING = -1
+
+
+class SlotView:
+    """One published slot, read in place; check valid() after using its images"""
+
+    def __init__(self, ring, index, seq, meta, sizes):
+        self._ring = ring
+        self.index = index
+        self.seq = seq
+        self.meta = meta
+        self._sizes = sizes
+
+    def image(self, which):
+        """Zero-copy HxWx3 view of the 'annotated' or 'raw' image, or None if not shipped"""
+        return self._ring._image(self.index, which, self._sizes[which])
+
+    def valid(self):
+        """False once the writer has started reusing this slot"""
+        return self._ring._slot_seq(self.index) == self.seq
+
+
+class FrameRing:
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self.owner = owner
+        self.name = shm.name
+
+        self._header = np.ndarray((_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        self.slots = int(self._header[_SLOTS])
+        self.max_height = int(self._header[_MAX_HEIGHT])
+        self.max_width = int(self._header[_MAX_WIDTH])
+        self.meta_bytes = int(self._header[_META_BYTES])
+        self.frame_bytes = self.max_height * self.max_width * 3
+
+        offset = _FIELDS * 8
+        self._slot_headers = np.ndarray((self.slots, _FIELDS), dtype=np.int64, buffer=shm.buf, offset=offset)
+        offset += self.slots * _FIELDS * 8
+        self._data = np.ndarray((self.slots, self.meta_bytes + 2 * self.frame_bytes),
+                                dtype=np.uint8, buffer=shm.buf, offset=offset)
+
+    @classmethod
+    def create(cls, slots=RING_SLOTS, max_width=RING_MAX_WIDTH, max_height=RING_MAX_HEIGHT,
+               meta_bytes=RING_META_BYTES):
+        """Allocate a new ring; the creating process owns (and later unlinks) it"""
+        frame_bytes = max_width * max_height * 3
+        size = _FIELDS * 8 + slots * _FIELDS * 8 + slots * (meta_bytes + 2 * frame_bytes)
+        shm = shared_memory.SharedMemory(create=True, size=size)
+        header = np.ndarray((_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[_SLOTS] = slots
+        header[_MAX_HEIGHT] = max_height
+        header[_MAX_WIDTH] = max_width
+        header[_META_BYTES] = meta_bytes
+        del header
+        ring = cls(shm, owner=True)
+        ring._slot_headers[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name):
+        """Open a ring created by another process"""
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    # ---------- writer side ----------
+    def fit(self, image):
+        """image scaled down (keeping aspect) so it fits in a slot"""
+        height, width = image.shape[:2]
+        scale = min(1.0, self.max_width / float(width), self.max_height / float(height))
+        if scale < 1.0:
+            size = (max(1, int(width * scale)), max(1, int(height * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return image
+
+    def write(self, seq, meta, annotated=None, raw=None):
+        """Publish packet seq (must increase) with its meta bytes and optional images.
+
+        Images must already fit (see fit()); only one process may write.
+        """
+        if len(meta) > self.meta_bytes:
+            raise ValueError(f'meta is {len(meta)} bytes, the ring allows {self.meta_bytes}')
+        index = seq % self.slots
+        slot = self._slot_headers[index]
+        data = self._data[index]
+
+        slot[_SEQ] = _WRITING
+        data[:len(meta)] = np.frombuffer(meta, dtype=np.uint8)
+        slot[_META_LEN] = len(meta)
+        offset = self.meta_bytes
+        for image, h_field, w_field in ((annotated, _ANNOTATED_H, _ANNOTATED_W), (raw, _RAW_H, _RAW_W)):
+            if image is None:
+                slot[h_field] = slot[w_field] = 0
+            else:
+                height, width = image.shape[:2]
+                data[offset:offset + height * width * 3].reshape(height, width, 3)[...] = image
+                slot[h_field], slot[w_field] = height, width
+            offset += self.frame_bytes
+        slot[_SEQ] = seq
+        self._header[_LATEST] = seq
+
+    def wants(self):
+        """(annotated, raw): whether any reader currently looks at each image"""
+        return self._header[_WANT_ANNOTATED] > 0, self._header[_WANT_RAW] > 0
+
+    # ---------- reader side ----------
+    def latest_seq(self):
+        return int(self._header[_LATEST])
+
+    def read(self, seq):
+        """SlotView of packet seq, or None if it is being written or already replaced"""
+        index = seq % self.slots
+        slot = self._slot_headers[index]
+        if slot[_SEQ] != seq:
+            return None
+        meta = bytes(self._data[index, :slot[_META_LEN]])
+        sizes = {
+            'annotated': (int(slot[_ANNOTATED_H]), int(slot[_ANNOTATED_W])),
+            'raw': (int(slot[_RAW_H]), int(slot[_RAW_W])),
+        }
+        view = SlotView(self, index, seq, meta, sizes)
+        return view if view.valid() else None
+
+    def set_wants(self, annotated, raw):
+        """Reader-side counters of subscribers per image kind (one reader process)"""
+        header = self._header
+        if header is None:
+            return  # closed: the camera stopped under a subscriber
+        header[_WANT_ANNOTATED] = annotated
+        header[_WANT_RAW] = raw
+
+    def _slot_seq(self, index):
+        if self._slot_headers is None:
+            return _WRITING  # closed
+        return int(self._slot_headers[index, _SEQ])
+
+    def _image(self, index, which, size):
+        height, width = size
+        if not height or not width or self._data is None:
+            return None
+        offset = self.meta_bytes + (self.frame_bytes if which == 'raw' else 0)
+        return self._data[index, offset:offset + height * width * 3].reshape(height, width, 3)
+
+    # ---------- teardown ----------
+    @property
+    def closed(self):
+        return self._header is None
+
+    def close(self):
+        """Detach from the segment; the owner also unlinks it"""
+        if self.owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+        self._header = self._slot_headers = self._data = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # A packet still holds a view; the mapping goes when it is collected
+            pass
@@ -0,0 +1,88 @@
+import os
+
+
+# ================================
+#  BATCHED INFERENCE HELPERS
+# ================================
+# The Ultralytics predictor has a fair amount of fixed per-call overhead
+# (pre/post-processing setup, tensor allocation), which dominates on CPU
+# when frames are fed one at a time. Accumulating a handful of frames and
+# running them in a single call amortises that cost.
+
+INFERENCE_BATCH_SIZE = int(os.environ.get('INFERENCE_BATCH_SIZE', 4))
+
+# Class names mapping
+CLASS_NAMES = {
+    0: 'backwardMove',
+    1: 'correctPosture',
+    2: 'leftSideMove',
+    3: 'passingNotes',
+    4: 'rightSideMove'
+}
+
+# Classes to alert on
+ALERT_CLASSES = [0, 2, 3, 4]  # backwardMove, leftSideMove, passingNotes, rightSideMove
+
+
+def read_batches(cap, batch_size=INFERENCE_BATCH_SIZE):
+    """Yield lists of up to batch_size decoded frames from a cv2.VideoCapture"""
+    batch_size = max(1, int(batch_size))
+    batch = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        batch.append(frame)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def predict_batch(model, frames, **kwargs):
+    """Run the model over a list of frames in one call; results keep frame order"""
+    if not frames:
+        return []
+    kwargs.setdefault('verbose', False)
+    if len(frames) == 1:
+        return list(model(frames[0], **kwargs))
+    return list(model(frames, **kwargs))
+
+
+def annotate(results):
+    """Draw the detections onto the frame (the expensive part of streaming)"""
+    return results[0].plot()
+
+
+def extract_detections(result):
+    """Compact, JSON-ready boxes/classes/confidences for one result"""
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return []
+    xyxy = boxes.xyxy.cpu().numpy()
+    classes = boxes.cls.cpu().numpy()
+    confidences = boxes.conf.cpu().numpy()
+    detections = []
+    for box, cls, conf in zip(xyxy, classes, confidences):
+        cls = int(cls)
+        detections.append({
+            'box': [int(round(float(v))) for v in box],
+            'cls': cls,
+            'label': CLASS_NAMES.get(cls, 'unknown'),
+            'conf': round(float(conf), 3),
+        })
+    return detections
+
+
+def alert_detections(results):
+    """Every alert-class detection in a result as (class_id, confidence)"""
+    try:
+        if results[0].boxes is None or len(results[0].boxes) == 0:
+            return []
+        classes = results[0].boxes.cls.cpu().numpy()
+        confidences = results[0].boxes.conf.cpu().numpy()
+        return [(int(cls), float(conf)) for cls, conf in zip(classes, confidences)
+                if int(cls) in ALERT_CLASSES]
+    except Exception:
+        return []
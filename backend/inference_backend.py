@@ -0,0 +1,215 @@
+import os
+import time
+import shutil
+import threading
+
+import numpy as np
+
+from inference import predict_batch
+
+
+# ================================
+#  PLUGGABLE INFERENCE BACKEND
+# ================================
+# The servers have no GPU, and PyTorch eager is the slowest way to run
+# YOLO on a CPU. This module picks the runtime from config and, the first
+# time a variant is requested, exports best.pt to it next to the weights:
+#
+#   pytorch   best.pt as-is (the reference)
+#   onnx      ONNX Runtime; fp32, or int8 via dynamic weight quantization
+#   openvino  OpenVINO IR; fp32, fp16 (compressed weights) or int8
+#             (post-training quantization, calibrated on
+#             INT8_CALIBRATION_DATA)
+#
+# Exports are reused until best.pt changes. Every variant is loaded back
+# through ultralytics.YOLO, so results, plot() and batching behave the
+# same whichever runtime sits underneath. Use
+# benchmarks/compare_backends.py to check a variant's accuracy and
+# latency against PyTorch before switching production to it.
+
+INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'pytorch')
+INFERENCE_PRECISION = os.environ.get('INFERENCE_PRECISION', 'fp32')
+MODEL_WEIGHTS = os.environ.get('MODEL_WEIGHTS', './best.pt')
+INFERENCE_IMGSZ = int(os.environ.get('INFERENCE_IMGSZ', 640))
+# Dataset YAML used to calibrate OpenVINO INT8 (Ultralytics format)
+INT8_CALIBRATION_DATA = os.environ.get('INT8_CALIBRATION_DATA')
+
+BACKENDS = ('pytorch', 'onnx', 'openvino')
+PRECISIONS = ('fp32', 'fp16', 'int8')
+
+_export_lock = threading.Lock()
+
+
+def exported_path(weights, backend, precision):
+    """Where the exported variant of weights lives (file for ONNX, dir for OpenVINO)"""
+    stem = os.path.splitext(weights)[0]
+    if backend == 'onnx':
+        return f"{stem}.{precision}.onnx"
+    if backend == 'openvino':
+        # Ultralytics recognises OpenVINO models by the _openvino_model suffix
+        return f"{stem}_{precision}_openvino_model"
+    return weights
+
+
+def _is_stale(path, weights):
+    return not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(weights)
+
+
+def _export_onnx(weights, precision, imgsz):
+    from ultralytics import YOLO
+
+    if precision == 'fp16':
+        # Ultralytics only exports half-precision ONNX on a GPU, and ORT's CPU
+        # kernels would upcast FP16 anyway
+        raise ValueError('fp16 ONNX needs a GPU; use onnx/int8 or openvino/fp16 on CPU')
+
+    target = exported_path(weights, 'onnx', precision)
+    fp32_path = exported_path(weights, 'onnx', 'fp32')
+    if _is_stale(fp32_path, weights):
+        # dynamic=True keeps the batch axis free for predict_batch/tiling
+        exported = YOLO(weights).export(format='onnx', imgsz=imgsz, dynamic=True, simplify=True)
+        shutil.move(exported, fp32_path)
+    if precision == 'int8':
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(fp32_path, target, weight_type=QuantType.QUInt8)
+    return target
+
+
+def _export_openvino(weights, precision, imgsz, calibration_data):
+    from ultralytics import YOLO
+
+    if precision == 'int8' and not calibration_data:
+        raise ValueError('openvino/int8 needs INT8_CALIBRATION_DATA (a dataset YAML) to calibrate on')
+
+    target = exported_path(weights, 'openvino', precision)
+    exported = YOLO(weights).export(
+        format='openvino', imgsz=imgsz, dynamic=True,
+        half=precision == 'fp16', int8=precision == 'int8', data=calibration_data
+    )
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    shutil.move(exported, target)
+    return target
+
+
+def export_model(weights=MODEL_WEIGHTS, backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION,
+                 imgsz=INFERENCE_IMGSZ, calibration_data=INT8_CALIBRATION_DATA):
+    """Path to the weights for this backend/precision, exporting them if missing or stale"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}' (expected one of {', '.join(BACKENDS)})")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}' (expected one of {', '.join(PRECISIONS)})")
+    if backend == 'pytorch':
+        if precision != 'fp32':
+            raise ValueError('The PyTorch backend runs fp32 on CPU; export to onnx/openvino for fp16/int8')
+        return weights
+
+    target = exported_path(weights, backend, precision)
+    with _export_lock:
+        if not _is_stale(target, weights):
+            return target
+        print(f"⏳ Exporting {weights} to {backend}/{precision}...")
+        if backend == 'onnx':
+            target = _export_onnx(weights, precision, imgsz)
+        else:
+            target = _export_openvino(weights, precision, imgsz, calibration_data)
+        print(f"✅ Exported {target}")
+        return target
+
+
+def load_model(weights=MODEL_WEIGHTS, backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION,
+               imgsz=INFERENCE_IMGSZ, calibration_data=INT8_CALIBRATION_DATA):
+    """A YOLO model running on the configured backend"""
+    from ultralytics import YOLO
+
+    path = export_model(weights, backend, precision, imgsz, calibration_data)
+    if backend == 'pytorch':
+        return YOLO(path)
+    # Exported formats don't carry the task reliably; this is a detector
+    return YOLO(path, task='detect')
+
+
+class LazyModel:
+    """The shared model, loaded on first use exactly once.
+
+    Importing the app no longer pays for torch/ultralytics and the weights;
+    the first inference (or an explicit warm-up) does. warm_up() also runs
+    dummy frames through it so runtime-side lazy setup (graph compilation,
+    allocator growth) happens before real traffic arrives.
+    """
+
+    def __init__(self, weights=MODEL_WEIGHTS, backend=INFERENCE_BACKEND, precision=INFERENCE_PRECISION,
+                 imgsz=INFERENCE_IMGSZ):
+        self.weights = weights
+        self.backend = backend
+        self.precision = precision
+        self.imgsz = imgsz
+        self._model = None
+        self._lock = threading.Lock()
+        self._warmup_lock = threading.Lock()
+        self._warmup_thread = None
+        self.warm = False
+        self.error = None
+        self.load_seconds = None
+        self.warmup_seconds = None
+
+    @property
+    def loaded(self):
+        return self._model is not None
+
+    def get(self):
+        model = self._model
+        if model is not None:
+            return model
+        with self._lock:
+            if self._model is None:
+                start = time.monotonic()
+                try:
+                    self._model = load_model(self.weights, self.backend, self.precision, self.imgsz)
+                except Exception as e:
+                    self.error = str(e)
+                    raise
+                self.error = None
+                self.load_seconds = time.monotonic() - start
+                print(f"✅ Model loaded ({self.backend}/{self.precision}) in {self.load_seconds:.1f}s")
+            return self._model
+
+    def warm_up(self, batch_sizes=(1,)):
+        """Load the model and push dummy frames through it at each batch size"""
+        model = self.get()
+        if self.warm:
+            return
+        start = time.monotonic()
+        frame = np.zeros((self.imgsz, self.imgsz, 3), dtype=np.uint8)
+        for batch_size in batch_sizes:
+            predict_batch(model, [frame] * batch_size)
+        self.warmup_seconds = time.monotonic() - start
+        self.warm = True
+        print(f"✅ Model warmed up in {self.warmup_seconds * 1000:.0f} ms")
+
+    def warm_up_async(self, batch_sizes=(1,)):
+        """Start warm_up() on a background thread unless it is done or running"""
+        with self._warmup_lock:
+            if self.warm or (self._warmup_thread is not None and self._warmup_thread.is_alive()):
+                return
+            self._warmup_thread = threading.Thread(
+                target=self._warm_up_logged, args=(batch_sizes,), name='model-warmup', daemon=True)
+            self._warmup_thread.start()
+
+    def _warm_up_logged(self, batch_sizes):
+        try:
+            self.warm_up(batch_sizes)
+        except Exception as e:
+            self.error = str(e)
+            print(f"❌ Model warm-up failed: {str(e)}")
+
+    def stats(self):
+        return {
+            'backend': self.backend,
+            'precision': self.precision,
+            'loaded': self.loaded,
+            'warm': self.warm,
+            'loadSeconds': round(self.load_seconds, 2) if self.load_seconds is not None else None,
+            'warmupMs': round(self.warmup_seconds * 1000, 1) if self.warmup_seconds is not None else None,
+            'error': self.error,
+        }
@@ -0,0 +1,352 @@
+import os
+import time
+import uuid
+import struct
+import hashlib
+import threading
+from contextlib import contextmanager
+from jobs import JOB_FAILED, JOB_CANCELLED
+
+
+# ================================
+#  CHUNKED / RESUMABLE VIDEO UPLOADS
+# ================================
+# /api/upload-video takes a recording in chunks, each appended straight
+# to the one file it will be processed from (no second copy). A dropped
+# connection resumes from the offset the server reports.
+#
+# Processing does not wait for the last chunk: once INGEST_START_BYTES
+# have arrived the job starts and decodes through a FIFO that a feeder
+# thread fills from the spool file as chunks land, so upload and
+# inference overlap. That needs a container that can be read front to
+# back: MP4/MOV whose index (moov) is at the end, and platforms without
+# os.mkfifo, start when the upload completes instead.
+#
+# The upload is hashed (SHA-256) as it arrives. Content whose results
+# already exist (find_duplicate, backed by the result cache) is not
+# processed again: up front if the client sends the hash, otherwise when
+# the upload completes (any early-started job is then cancelled and the
+# duplicate file deleted).
+
+INGEST_START_BYTES = int(os.environ.get('INGEST_START_BYTES', 4 * 1024 * 1024))
+INGEST_CHUNK_BYTES = int(os.environ.get('INGEST_CHUNK_BYTES', 1024 * 1024))
+# Unfinished uploads idle for longer than this are dropped
+INGEST_SESSION_TTL = float(os.environ.get('INGEST_SESSION_TTL', 3600))
+
+UPLOADING = 'uploading'
+COMPLETE = 'complete'
+DUPLICATE = 'duplicate'
+EXPIRED = 'expired'
+
+
+class UploadError(Exception):
+    """Bad upload request; status is the HTTP status to answer with"""
+
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def sniff_streamable(path, filename, available):
+    """True if the file can be decoded front to back, False if not, None if undecided yet.
+
+    Only MP4/MOV can be a problem: walk the top-level boxes and see
+    whether moov (the index) comes before mdat (the samples).
+    """
+    if filename.rsplit('.', 1)[-1].lower() not in ('mp4', 'mov', 'm4v'):
+        return True
+    offset = 0
+    with open(path, 'rb') as f:
+        while offset + 8 <= available:
+            f.seek(offset)
+            header = f.read(16)
+            size, kind = struct.unpack('>I4s', header[:8])
+            if kind == b'moov':
+                return True
+            if kind == b'mdat':
+                return False
+            if size == 1:
+                if len(header) < 16:
+                    return None
+                size = struct.unpack('>Q', header[8:16])[0]
+            if size < 8:
+                return False  # runs to EOF, or malformed
+            offset += size
+    return None
+
+
+class UploadSession:
+    def __init__(self, filename, size, camera_id, path, host_url, output_format):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.size = size
+        self.camera_id = camera_id
+        self.path = path
+        self.host_url = host_url
+        self.output_format = output_format
+        self.offset = 0
+        self.status = UPLOADING
+        self.digest = None
+        self.streamable = None
+        self.streaming = False  # job decodes through the FIFO
+        self.job = None
+        self.duplicate_of = None  # whatever find_duplicate matched (earlier job or cached result)
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.cond = threading.Condition()
+        self.append_lock = threading.Lock()
+        self._hash = hashlib.sha256()
+
+    @property
+    def complete(self):
+        return self.status == COMPLETE
+
+    def to_dict(self):
+        return {
+            'uploadId': self.id,
+            'filename': self.filename,
+            'size': self.size,
+            'offset': self.offset,
+            'status': self.status,
+            'sha256': self.digest,
+            'streaming': self.streaming,
+            'jobId': self.job.id if self.job else None,
+            'duplicate': self.duplicate_of is not None,
+            'error': self.error,
+        }
+
+
+class IngestManager:
+    def __init__(self, upload_folder, start_job, find_duplicate=None, start_bytes=INGEST_START_BYTES,
+                 chunk_bytes=INGEST_CHUNK_BYTES, ttl=INGEST_SESSION_TTL):
+        """
+        start_job:      start_job(session) -> Job; queues processing of the
+                        session (see source_for); may raise to retry later
+        find_duplicate: find_duplicate(sha256, session) -> existing result
+                        for that content, or None. Called before the upload
+                        counts as complete, so it can tag session.job
+        """
+        self.upload_folder = upload_folder
+        self._start_job = start_job
+        self._find_duplicate = find_duplicate
+        self.start_bytes = start_bytes
+        self.chunk_bytes = chunk_bytes
+        self.ttl = ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # ---------- API ----------
+    def create(self, filename, size, camera_id, path, host_url, output_format, sha256=None):
+        """New session, or (None, existing) if content with this sha256 was already processed"""
+        if isinstance(size, bool) or not isinstance(size, int) or size <= 0:
+            raise UploadError('size (total bytes) must be a positive integer', 400)
+        session = UploadSession(filename, size, camera_id, path, host_url, output_format)
+        if sha256 and self._find_duplicate is not None:
+            existing = self._find_duplicate(sha256.lower(), session)
+            if existing is not None:
+                return None, existing
+        with self._lock:
+            self._prune()
+            self._sessions[session.id] = session
+        # Reserve the file so a resumed upload always has somewhere to append
+        open(path, 'wb').close()
+        return session, None
+
+    def get(self, upload_id):
+        with self._lock:
+            self._prune()
+            return self._sessions.get(upload_id)
+
+    def append(self, session, offset, stream, length):
+        """Write length bytes from stream at offset; returns the new offset"""
+        # One chunk at a time per upload; a second concurrent PATCH is a conflict
+        if not session.append_lock.acquire(blocking=False):
+            raise UploadError('another chunk is being written', 409, session.offset)
+        try:
+            with session.cond:
+                if session.status != UPLOADING or session.offset == session.size:
+                    raise UploadError(f'upload is {session.status}', 409, session.offset)
+                if offset != session.offset:
+                    raise UploadError(f'expected offset {session.offset}', 409, session.offset)
+                if length is None or offset + length > session.size:
+                    raise UploadError('chunk needs a Content-Length within the declared size', 400,
+                                      session.offset)
+
+            # The network read happens outside cond so the feeder can pass
+            # each block on to the decoder while the rest of the chunk arrives
+            with open(session.path, 'r+b') as f:
+                f.seek(offset)
+                remaining = length
+                while remaining > 0:
+                    data = stream.read(min(self.chunk_bytes, remaining))
+                    if not data:
+                        break  # client went away; keep what arrived
+                    f.write(data)
+                    f.flush()
+                    session._hash.update(data)
+                    remaining -= len(data)
+                    with session.cond:
+                        session.offset += len(data)
+                        session.updated_at = time.time()
+                        session.cond.notify_all()
+
+            with session.cond:
+                done = session.offset == session.size
+                if done:
+                    session.digest = session._hash.hexdigest()
+        finally:
+            session.append_lock.release()
+
+        if done:
+            self._on_complete(session)
+        elif session.job is None:
+            self._maybe_start_early(session)
+        return session.offset
+
+    def resume_start(self, session):
+        """Retry queueing a completed upload whose job could not be started"""
+        if session.complete and self._needs_job(session):
+            self._start(session)
+
+    @contextmanager
+    def source_for(self, session, job):
+        """Path the job should decode: the spool file, or a FIFO fed from it"""
+        try:
+            if not session.streaming:
+                yield session.path
+                return
+            fifo = f"{session.path}.{job.id}.fifo"
+            os.mkfifo(fifo)
+            stop = threading.Event()
+            feeder = threading.Thread(target=self._feed, args=(session, fifo, job, stop),
+                                      name=f'ingest-{session.id[:8]}', daemon=True)
+            feeder.start()
+            try:
+                yield fifo
+            finally:
+                stop.set()
+                feeder.join(timeout=5)
+                os.remove(fifo)
+        finally:
+            # A duplicate or abandoned upload isn't kept once its job is done
+            if session.status in (DUPLICATE, EXPIRED) and os.path.exists(session.path):
+                os.remove(session.path)
+
+    # ---------- internals ----------
+    def _maybe_start_early(self, session):
+        if session.offset < self.start_bytes or not hasattr(os, 'mkfifo'):
+            return
+        if session.streamable is None:
+            session.streamable = sniff_streamable(session.path, session.filename, session.offset)
+        if session.streamable:
+            session.streaming = True
+            self._start(session)
+
+    def _needs_job(self, session):
+        """True if session has no job, dropping one that failed or was cancelled.
+
+        The retry reads the finished spool file, not the FIFO.
+        """
+        if session.job is not None and session.job.status in (JOB_FAILED, JOB_CANCELLED):
+            session.job = None
+            session.streaming = False
+        return session.job is None
+
+    def _on_complete(self, session):
+        # The status only changes here, after find_duplicate, so an early
+        # job can't read to EOF before it has been looked at
+        self._needs_job(session)
+        existing = None
+        if self._find_duplicate is not None:
+            existing = self._find_duplicate(session.digest, session)
+        if existing is not None and existing is not session.job:
+            # Same recording as an earlier upload: reuse it, drop this copy
+            with session.cond:
+                session.status = DUPLICATE
+                session.duplicate_of = existing
+                session.cond.notify_all()
+            if session.job is not None:
+                session.job.cancel()
+            else:
+                os.remove(session.path)
+            return
+        if session.job is None:
+            self._start(session)
+        with session.cond:
+            session.status = COMPLETE
+            session.cond.notify_all()
+
+    def _start(self, session):
+        try:
+            session.job = self._start_job(session)
+            session.error = None
+        except Exception as e:
+            # Retried by the next chunk, or reported if this was the last one
+            session.streaming = False
+            session.error = str(e)
+            print(f"❌ Could not start processing upload {session.id}: {str(e)}")
+
+    def _prune(self):
+        # Caller holds self._lock
+        now = time.time()
+        for upload_id, session in list(self._sessions.items()):
+            if now - session.updated_at < self.ttl:
+                continue
+            del self._sessions[upload_id]
+            if session.status == UPLOADING:
+                with session.cond:
+                    session.status = EXPIRED
+                    session.cond.notify_all()
+                if session.job is not None:
+                    session.job.cancel()
+                elif os.path.exists(session.path):
+                    os.remove(session.path)
+
+    def _open_fifo(self, fifo, job, stop):
+        # Non-blocking open fails until the decoder opens its end; poll so a
+        # job that never opens it can't strand this thread
+        while not stop.is_set() and not job.is_cancelled():
+            try:
+                fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            except OSError:
+                time.sleep(0.05)
+                continue
+            os.set_blocking(fd, True)
+            return fd
+        return None
+
+    def _feed(self, session, fifo, job, stop):
+        fd = self._open_fifo(fifo, job, stop)
+        if fd is None:
+            return
+        sent = 0
+        try:
+            with open(session.path, 'rb') as src:
+                while True:
+                    with session.cond:
+                        session.cond.wait_for(
+                            lambda: session.offset > sent or session.status != UPLOADING
+                            or stop.is_set() or job.is_cancelled(),
+                            timeout=0.5
+                        )
+                        available = session.offset
+                        status = session.status
+                        if time.time() - session.updated_at > self.ttl and status == UPLOADING:
+                            job.cancel()  # abandoned mid-upload
+                    if stop.is_set() or job.is_cancelled() or status in (EXPIRED, DUPLICATE):
+                        break
+                    if sent < available:
+                        data = src.read(min(self.chunk_bytes, available - sent))
+                        view = memoryview(data)
+                        while view:
+                            view = view[os.write(fd, view):]
+                        sent += len(data)
+                    elif status == COMPLETE:
+                        break
+        except (BrokenPipeError, OSError):
+            pass  # the decoder stopped reading
+        finally:
+            # EOF for the decoder
+            os.close(fd)
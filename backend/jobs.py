@@ -0,0 +1,192 @@
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+# ================================
+#  BACKGROUND JOB QUEUE
+# ================================
+# Offline video processing runs here instead of inside the HTTP request
+# thread. A bounded pool of workers pulls jobs off the queue; each job
+# reports its own progress so the API can expose frames processed, fps
+# and an ETA while it runs.
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_CANCELLED = 'cancelled'
+
+FINISHED_STATES = {JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED}
+
+# Job.meta keys the status API shows; everything else (e.g. the result
+# cache key) is server-side bookkeeping
+PUBLIC_META_FIELDS = ('cameraId', 'uploadId', 'processedVideoUrl', 'playlistUrl', 'playlistReady')
+
+
+class JobCancelled(Exception):
+    """Raised from inside a job function when cancellation was requested"""
+
+
+class QueueFull(Exception):
+    """Raised by JobManager.submit when too many jobs are already waiting"""
+
+
+class Job:
+    def __init__(self, kind, meta=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.meta = meta or {}
+        self.status = JOB_QUEUED
+        self.frames_processed = 0
+        self.total_frames = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    # Called by the worker as frames complete
+    def update(self, frames_processed, total_frames=None):
+        with self._lock:
+            self.frames_processed = frames_processed
+            if total_frames is not None:
+                self.total_frames = total_frames
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def to_dict(self):
+        with self._lock:
+            frames = self.frames_processed
+            total = self.total_frames
+            status = self.status
+            started = self.started_at
+            finished = self.finished_at
+
+        elapsed = 0.0
+        if started is not None:
+            elapsed = (finished or time.time()) - started
+        fps = frames / elapsed if elapsed > 0 else 0.0
+
+        eta = None
+        if status == JOB_RUNNING and fps > 0 and total > frames:
+            eta = (total - frames) / fps
+        elif status == JOB_COMPLETED:
+            eta = 0.0
+
+        progress = None
+        if total > 0:
+            progress = min(1.0, frames / total)
+
+        return {
+            'jobId': self.id,
+            'kind': self.kind,
+            'status': status,
+            'framesProcessed': frames,
+            'totalFrames': total,
+            'progress': progress,
+            'fps': round(fps, 2),
+            'etaSeconds': round(eta, 1) if eta is not None else None,
+            'elapsedSeconds': round(elapsed, 2),
+            'result': self.result,
+            'error': self.error,
+            **{name: self.meta[name] for name in PUBLIC_META_FIELDS if name in self.meta},
+        }
+
+
+class JobManager:
+    """Bounded worker pool plus a registry of jobs for status polling"""
+
+    def __init__(self, max_workers, max_pending=32, retention_seconds=3600):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.retention_seconds = retention_seconds
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix='job-worker')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, *args, meta=None, **kwargs):
+        """Queue fn(job, *args, **kwargs) and return the Job immediately"""
+        job = Job(kind, meta)
+        with self._lock:
+            self._prune()
+            pending = sum(1 for j in self._jobs.values() if j.status == JOB_QUEUED)
+            if pending >= self.max_pending:
+                raise QueueFull(f'{pending} jobs already queued')
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel()
+        with job._lock:
+            # Queued jobs never start; running ones notice at the next frame
+            if job.status == JOB_QUEUED:
+                job.status = JOB_CANCELLED
+                job.finished_at = time.time()
+        return job
+
+    def stats(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {'workers': self.max_workers, 'jobs': counts}
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.status not in FINISHED_STATES:
+                job.cancel()
+        self._executor.shutdown(wait=wait)
+
+    def _run(self, job, fn, args, kwargs):
+        with job._lock:
+            if job.status == JOB_CANCELLED or job.is_cancelled():
+                job.status = JOB_CANCELLED
+                job.finished_at = job.finished_at or time.time()
+                return
+            job.status = JOB_RUNNING
+            job.started_at = time.time()
+        try:
+            result = fn(job, *args, **kwargs)
+            status, error = JOB_COMPLETED, None
+        except JobCancelled:
+            result, status, error = None, JOB_CANCELLED, None
+        except Exception as e:
+            print(f"❌ Job {job.id} failed: {str(e)}")
+            result, status, error = None, JOB_FAILED, str(e)
+        with job._lock:
+            job.result = result
+            job.status = status
+            job.error = error
+            job.finished_at = time.time()
+
+    def _prune(self):
+        # Forget finished jobs after the retention window (caller holds the lock)
+        cutoff = time.time() - self.retention_seconds
+        stale = [job_id for job_id, job in self._jobs.items()
+                 if job.status in FINISHED_STATES and (job.finished_at or 0) < cutoff]
+        for job_id in stale:
+            del self._jobs[job_id]
@@ -1,11 +1,12 @@
 import os
-import re
 import cv2
-from flask import Flask, request, jsonify, send_from_directory, Response, abort
+from flask import Flask, request, jsonify
 from flask_cors import CORS
-from ultralytics import YOLO
+from inference_backend import LazyModel
 from datetime import datetime
 from werkzeug.utils import secure_filename
+from pipeline import run_pipeline
+from media import send_media
 
 # ================================
 #  SETUP
@@ -18,7 +19,7 @@ PROCESSED_FOLDER = 'processed'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(PROCESSED_FOLDER, exist_ok=True)
 
-model = YOLO('./best.pt')  # Load your model
+model = LazyModel()  # best.pt on the configured INFERENCE_BACKEND, loaded on first use
 ALLOWED_EXT = {'mp4', 'mov', 'avi', 'mkv', 'webm'}
 
 def allowed_file(filename):
@@ -64,13 +65,9 @@ def upload_and_process_video():
     height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
     out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        results = model(frame, verbose=False)
-        annotated = results[0].plot()
-        out.write(annotated)
+    # Decode, batched YOLO and annotate+encode run as overlapping stages;
+    # annotated frames are written back in order
+    run_pipeline(cap, model.get(), lambda i, frame, result, annotated: out.write(annotated))
 
     cap.release()
     out.release()  # 🔥 Important: finalize MP4 container
@@ -91,41 +88,12 @@ def upload_and_process_video():
 # =====================================================
 @app.route('/uploads/<path:filename>', methods=['GET'])
 def serve_uploaded(filename):
-    return send_from_directory(UPLOAD_FOLDER, filename, as_attachment=False)
+    return send_media(UPLOAD_FOLDER, filename)
 
 
 @app.route('/processed/<path:filename>', methods=['GET'])
 def serve_processed(filename):
-    full_path = os.path.join(PROCESSED_FOLDER, filename)
-    if not os.path.exists(full_path):
-        abort(404)
-
-    file_size = os.path.getsize(full_path)
-    range_header = request.headers.get('Range', None)
-
-    if range_header:
-        match = re.search(r'bytes=(\d+)-(\d*)', range_header)
-        if match:
-            start = int(match.group(1))
-            end = match.group(2)
-            end = int(end) if end else file_size - 1
-            end = min(end, file_size - 1)
-            length = end - start + 1
-
-            with open(full_path, 'rb') as f:
-                f.seek(start)
-                data = f.read(length)
-
-            resp = Response(data, 206, mimetype='video/mp4', direct_passthrough=True)
-            resp.headers.add('Content-Range', f'bytes {start}-{end}/{file_size}')
-            resp.headers.add('Accept-Ranges', 'bytes')
-            resp.headers.add('Content-Length', str(length))
-            return resp
-
-    # No Range header → send entire file
-    resp = send_from_directory(PROCESSED_FOLDER, filename, as_attachment=False)
-    resp.headers.add('Accept-Ranges', 'bytes')
-    return resp
+    return send_media(PROCESSED_FOLDER, filename)
 
 
 # =====================================================
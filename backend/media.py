@@ -0,0 +1,149 @@
+import os
+import uuid
+import mimetypes
+from datetime import datetime, timezone
+
+from flask import Response, abort, request
+from werkzeug.http import is_resource_modified
+from werkzeug.security import safe_join
+from werkzeug.wsgi import wrap_file
+
+
+# ================================
+#  MEDIA FILE SERVING
+# ================================
+# Uploaded and processed videos are served straight off disk. Memory per
+# connection is bounded by MEDIA_CHUNK_SIZE whatever the file or range
+# size: responses that run to the end of the file (the whole file, or
+# "bytes=N-" which is what <video> sends while seeking) go through the
+# server's wsgi.file_wrapper, so gunicorn/uwsgi can sendfile() them;
+# bounded and multipart ranges are streamed a chunk at a time.
+#
+# Supports single, suffix ("bytes=-N") and multiple ranges
+# (multipart/byteranges), ETag / Last-Modified revalidation and If-Range,
+# so a player resuming after the file changed gets the new file whole
+# instead of a mismatched slice.
+
+MEDIA_CHUNK_SIZE = int(os.environ.get('MEDIA_CHUNK_SIZE', 256 * 1024))
+# More ranges than this in one request are ignored (full 200 instead)
+MEDIA_MAX_RANGES = int(os.environ.get('MEDIA_MAX_RANGES', 16))
+
+
+def _etag(stat):
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def _resolve_ranges(ranges, size):
+    """Werkzeug (begin, end) pairs -> merged [start, stop) byte spans within size.
+
+    Werkzeug only accepts ascending, non-overlapping ranges (anything else
+    is served whole), but a suffix range can still overlap an earlier one
+    and adjacent ranges are cheaper sent as one.
+    """
+    spans = []
+    for begin, end in ranges:
+        if begin < 0:
+            # Suffix range: the last -begin bytes
+            start, stop = max(0, size + begin), size
+        else:
+            start, stop = begin, size if end is None else min(end, size)
+        if start < stop:
+            spans.append([start, stop])
+    spans.sort()
+    merged = []
+    for span in spans:
+        if merged and span[0] <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], span[1])
+        else:
+            merged.append(span)
+    return merged
+
+
+def _if_range_matches(etag, last_modified):
+    if_range = request.if_range
+    if if_range.etag is not None:
+        return if_range.etag == etag
+    if if_range.date is not None:
+        return if_range.date == last_modified
+    return True  # no If-Range header
+
+
+def _read_span(path, start, stop, chunk_size):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break  # file shrank under us
+            remaining -= len(data)
+            yield data
+
+
+def _multipart(path, spans, size, mimetype, boundary, chunk_size):
+    for start, stop in spans:
+        yield _part_header(boundary, mimetype, start, stop, size)
+        yield from _read_span(path, start, stop, chunk_size)
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode('ascii')
+
+
+def _part_header(boundary, mimetype, start, stop, size):
+    return (f"--{boundary}\r\n"
+            f"Content-Type: {mimetype}\r\n"
+            f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode('ascii')
+
+
+def send_media(directory, filename, mimetype=None, chunk_size=MEDIA_CHUNK_SIZE):
+    """Serve directory/filename with range, conditional and bounded-memory streaming"""
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = _etag(stat)
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+    mimetype = mimetype or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    def respond(body, status, length, content_type=mimetype):
+        resp = Response(body, status, content_type=content_type, direct_passthrough=True)
+        resp.headers['Accept-Ranges'] = 'bytes'
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.set_etag(etag)
+        resp.last_modified = last_modified
+        if length is not None:
+            resp.content_length = length
+        return resp
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return respond(None, 304, None)
+
+    def from_offset(start):
+        # Runs to EOF, so the server's file wrapper (sendfile) can send it
+        f = open(path, 'rb')
+        f.seek(start)
+        return wrap_file(request.environ, f, chunk_size)
+
+    ranges = request.range
+    if (ranges is None or ranges.units != 'bytes' or len(ranges.ranges) > MEDIA_MAX_RANGES
+            or not _if_range_matches(etag, last_modified)):
+        return respond(from_offset(0), 200, size)
+
+    spans = _resolve_ranges(ranges.ranges, size)
+    if not spans:
+        resp = respond(None, 416, None)
+        resp.headers['Content-Range'] = f'bytes */{size}'
+        return resp
+
+    if len(spans) == 1:
+        start, stop = spans[0]
+        body = from_offset(start) if stop == size else _read_span(path, start, stop, chunk_size)
+        resp = respond(body, 206, stop - start)
+        resp.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+        return resp
+
+    boundary = uuid.uuid4().hex
+    length = sum(len(_part_header(boundary, mimetype, start, stop, size)) + (stop - start) + 2
+                 for start, stop in spans) + len(f"--{boundary}--\r\n")
+    return respond(_multipart(path, spans, size, mimetype, boundary, chunk_size), 206, length,
+                   f'multipart/byteranges; boundary={boundary}')
@@ -0,0 +1,202 @@
+import threading
+from bisect import bisect_left
+
+
+# ================================
+#  PROMETHEUS-STYLE METRICS
+# ================================
+# A small in-process registry rendered in the Prometheus text exposition
+# format at /metrics. Hot paths only pay for a perf_counter() pair, a
+# bisect and a short lock per observation; everything that already
+# exists as a counter somewhere (engine stats, writer queue depth, job
+# counts) is read by collectors at scrape time instead of being
+# duplicated on the hot path.
+#
+# Histograms use fixed buckets, so worker processes can ship a snapshot
+# of theirs to the web process and have it rendered alongside its own
+# (with a worker label).
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: (list(value) if isinstance(value, list) else value)
+                    for key, value in self._series.items()}
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def lines(self, series, extra=()):
+        for key, value in series.items():
+            yield f"{self.name}{_format_labels(list(zip(self.labelnames, key)) + list(extra))} {_format_value(value)}"
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._series[_label_key(self.labelnames, labels)] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, count=1, **labels):
+        """Record value; count > 1 records it that many times (per-frame time of a batch)"""
+        key = _label_key(self.labelnames, labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last one is +Inf), then sum, then count
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += count
+            series[-2] += value * count
+            series[-1] += count
+
+    def lines(self, series, extra=()):
+        for key, values in series.items():
+            labels = list(zip(self.labelnames, key)) + list(extra)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), values):
+                cumulative += bucket_count
+                le = _format_labels(labels + [('le', _format_value(float(bound)))])
+                yield f"{self.name}_bucket{le} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(values[-2])}"
+            yield f"{self.name}_count{_format_labels(labels)} {values[-1]}"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collect):
+        """collect() -> iterable of (metric, {labels: value}) read at scrape time.
+
+        metric is a Counter/Gauge used only for its name, help and labels.
+        """
+        with self._lock:
+            self._collectors.append(collect)
+
+    def snapshot(self):
+        """Picklable {name: series} of every registered metric"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self, external=()):
+        """Text exposition; external: [(extra_label_pairs, snapshot), ...] from other processes"""
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+
+        collected = {}
+        for collect in collectors:
+            try:
+                for metric, values in collect():
+                    collected.setdefault(metric.name, (metric, {}))[1].update(values)
+            except Exception as e:
+                print(f"❌ Metrics collector failed: {str(e)}")
+
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.lines(metric.snapshot()))
+            for extra, snapshot in external:
+                lines.extend(metric.lines(snapshot.get(metric.name, {}), extra))
+        for metric, values in collected.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.lines({_label_key(metric.labelnames, labels): value
+                                       for labels, value in _items(values)}))
+        return '\n'.join(lines) + '\n'
+
+
+def _items(values):
+    # Collectors key their values by a tuple of (name, value) label pairs
+    for pairs, value in values.items():
+        yield dict(pairs), value
+
+
+REGISTRY = Registry()
+
+# Per-stage time of one frame. kind: web | cctv | video; stage: decode,
+# inference, plot, postprocess (tracker, alerts, index), encode (JPEG or
+# video writer) and send (socket write)
+STAGE_SECONDS = REGISTRY.histogram(
+    'invigilation_stage_seconds', 'Per-frame time spent in each processing stage',
+    ('kind', 'camera', 'stage'))
+ALERT_WRITE_SECONDS = REGISTRY.histogram(
+    'invigilation_alert_write_seconds', 'Time to insert one batch of alerts into SQLite')
+ACTIVE_STREAMS = REGISTRY.gauge(
+    'invigilation_active_streams', 'Open streaming responses', ('kind', 'format'))
+VIDEO_FRAMES = REGISTRY.counter(
+    'invigilation_video_frames_total', 'Frames of uploaded videos processed', ('camera',))
+
+
+def observe_stage(kind, camera, stage, seconds, count=1):
+    STAGE_SECONDS.observe(seconds, count, kind=kind, camera=camera, stage=stage)
@@ -0,0 +1,87 @@
+import os
+import threading
+
+import cv2
+
+
+# ================================
+#  MOTION-GATED INFERENCE
+# ================================
+# Exam halls are mostly still. Before a frame goes to YOLO it is shrunk to
+# a small blurred grayscale thumbnail and compared with the thumbnail of
+# the last frame that *was* inferred; if the fraction of changed pixels is
+# below the threshold the previous detections are reused instead. Comparing
+# against the last inferred frame (not the previous frame) means slow drift
+# still adds up to a refresh, and a forced refresh every few seconds bounds
+# how stale reused detections can get.
+#
+# Off by default (MOTION_GATE_ENABLED=1 turns it on): reused detections can
+# miss a brief movement, which is a trade a deployment should opt into.
+
+MOTION_GATE_ENABLED = os.environ.get('MOTION_GATE_ENABLED', '0') in ('1', 'true')
+MOTION_THUMB_WIDTH = int(os.environ.get('MOTION_THUMB_WIDTH', 160))
+MOTION_PIXEL_THRESHOLD = int(os.environ.get('MOTION_PIXEL_THRESHOLD', 12))
+MOTION_AREA_THRESHOLD = float(os.environ.get('MOTION_AREA_THRESHOLD', 0.002))
+MOTION_REFRESH_SECONDS = float(os.environ.get('MOTION_REFRESH_SECONDS', 2.0))
+
+
+def thumbnail(frame, width=MOTION_THUMB_WIDTH):
+    height = max(1, int(round(frame.shape[0] * width / frame.shape[1])))
+    small = cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    return cv2.GaussianBlur(gray, (5, 5), 0)
+
+
+class MotionGate:
+    def __init__(self, pixel_threshold=MOTION_PIXEL_THRESHOLD, area_threshold=MOTION_AREA_THRESHOLD,
+                 refresh_seconds=MOTION_REFRESH_SECONDS, thumb_width=MOTION_THUMB_WIDTH):
+        """
+        pixel_threshold: grey-level change for a thumbnail pixel to count as moved
+        area_threshold:  fraction of moved pixels that triggers inference
+        refresh_seconds: inference is forced at least this often regardless
+        """
+        self.pixel_threshold = pixel_threshold
+        self.area_threshold = area_threshold
+        self.refresh_seconds = refresh_seconds
+        self.thumb_width = thumb_width
+        self._reference = None
+        self._reference_time = None
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.skipped = 0
+        self.last_energy = 0.0
+
+    def check(self, frame, now):
+        """True if this frame should go through the model.
+
+        A True answer makes the frame the new reference, so call this only
+        for frames that will actually be inferred when it says so.
+        """
+        thumb = thumbnail(frame, self.thumb_width)
+        with self._lock:
+            self.checked += 1
+            if (self._reference is None or self._reference.shape != thumb.shape
+                    or now - self._reference_time >= self.refresh_seconds):
+                self._reference, self._reference_time = thumb, now
+                return True
+
+            diff = cv2.absdiff(thumb, self._reference)
+            moved = cv2.countNonZero(cv2.threshold(diff, self.pixel_threshold, 255, cv2.THRESH_BINARY)[1])
+            self.last_energy = moved / float(thumb.size)
+            if self.last_energy >= self.area_threshold:
+                self._reference, self._reference_time = thumb, now
+                return True
+
+            self.skipped += 1
+            return False
+
+    def skip_ratio(self):
+        return self.skipped / self.checked if self.checked else 0.0
+
+    def stats(self):
+        return {
+            'framesChecked': self.checked,
+            'framesSkipped': self.skipped,
+            'skipRatio': round(self.skip_ratio(), 3),
+            'lastMotionEnergy': round(self.last_energy, 4),
+        }
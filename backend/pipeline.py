@@ -0,0 +1,150 @@
+import os
+import queue
+import threading
+import time
+
+from inference import INFERENCE_BATCH_SIZE, read_batches, predict_batch
+
+
+# ================================
+#  OFFLINE DECODE / INFER / ENCODE PIPELINE
+# ================================
+# Decoding, inference and annotation+encoding run as three stages joined
+# by bounded queues:
+#
+#   decoder thread --frames_q--> inference (caller thread) --results_q--> encoder thread
+#
+# While the model works on batch N the decoder is already reading batch
+# N+1 and the encoder is plotting/writing batch N-1, so wall-clock time
+# approaches pure inference time. The queues are small and blocking, so a
+# slow stage pushes back on the ones before it and memory stays capped at
+# roughly (2 * PIPELINE_QUEUE_SIZE + 3) batches regardless of video length.
+
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 4))
+
+_END = object()
+
+
+class _Stage(threading.Thread):
+    """Worker thread that records the first exception and stops the pipeline"""
+
+    def __init__(self, name, target, stop_event, errors):
+        super().__init__(name=name, daemon=True)
+        self._target_fn = target
+        self._stop_event = stop_event
+        self._errors = errors
+
+    def run(self):
+        try:
+            self._target_fn()
+        except BaseException as e:
+            self._errors.append(e)
+            self._stop_event.set()
+
+
+def _put(q, item, stop_event):
+    # Blocking put that gives up once the pipeline is being torn down
+    while not stop_event.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop_event):
+    while not stop_event.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _END
+
+
+def run_pipeline(cap, model, on_frame, batch_size=INFERENCE_BATCH_SIZE,
+                 queue_size=PIPELINE_QUEUE_SIZE, check_cancelled=None,
+                 infer=None, annotate=None, timings=None):
+    """Process every frame of cap through model using the three-stage pipeline.
+
+    on_frame(frame_index, frame, result, annotated) is called on the encoder
+    thread, in frame order, once per frame; it is where the caller writes
+    the annotated frame out and checks for alerts, and it may return the
+    seconds it spent writing the frame. check_cancelled is polled by the
+    inference stage and may raise to abort the run. infer(frames) and
+    annotate(frame, result) override the default batched predict and plot;
+    infer may return None for frames it chose not to run.
+    timings(stage, seconds, frames), if given, is told how long each
+    decode/inference batch took and, per frame, plot, encode (the seconds
+    on_frame returned) and postprocess (the rest of on_frame).
+
+    Returns the number of frames handed to on_frame.
+    """
+    infer = infer or (lambda frames: predict_batch(model, frames))
+    annotate = annotate or (lambda frame, result: result.plot())
+
+    frames_q = queue.Queue(maxsize=queue_size)
+    results_q = queue.Queue(maxsize=queue_size)
+    stop_event = threading.Event()
+    errors = []
+    frame_count = [0]
+    timings = timings or (lambda stage, seconds, frames: None)
+
+    def decode():
+        batches = read_batches(cap, batch_size)
+        while True:
+            start = time.perf_counter()
+            frames = next(batches, None)
+            if frames is None:
+                break
+            timings('decode', time.perf_counter() - start, len(frames))
+            if not _put(frames_q, frames, stop_event):
+                return
+        _put(frames_q, _END, stop_event)
+
+    def encode():
+        while True:
+            item = _get(results_q, stop_event)
+            if item is _END:
+                return
+            frames, results = item
+            for frame, result in zip(frames, results):
+                start = time.perf_counter()
+                annotated = annotate(frame, result)
+                plotted = time.perf_counter()
+                encode_seconds = on_frame(frame_count[0], frame, result, annotated) or 0.0
+                timings('plot', plotted - start, 1)
+                timings('postprocess', time.perf_counter() - plotted - encode_seconds, 1)
+                timings('encode', encode_seconds, 1)
+                frame_count[0] += 1
+
+    decoder = _Stage('pipeline-decode', decode, stop_event, errors)
+    encoder = _Stage('pipeline-encode', encode, stop_event, errors)
+    decoder.start()
+    encoder.start()
+
+    try:
+        while True:
+            if check_cancelled is not None:
+                check_cancelled()
+            frames = _get(frames_q, stop_event)
+            if frames is _END:
+                break
+            start = time.perf_counter()
+            results = infer(frames)
+            timings('inference', time.perf_counter() - start, len(frames))
+            if not _put(results_q, (frames, results), stop_event):
+                break
+        _put(results_q, _END, stop_event)
+        encoder.join()
+    except BaseException:
+        stop_event.set()
+        raise
+    finally:
+        stop_event.set()
+        decoder.join()
+        encoder.join()
+
+    if errors:
+        raise errors[0]
+    return frame_count[0]
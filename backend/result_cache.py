@@ -0,0 +1,261 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+from jobs import JOB_FAILED, JOB_CANCELLED
+
+
+# ================================
+#  PROCESSED VIDEO RESULT CACHE
+# ================================
+# Processing the same recording again with the same model and settings
+# gives the same output, so finished results are kept and reused. An entry
+# is keyed by
+#
+#   sha256(video content) + sha256(model weights) + inference settings
+#
+# and records the files the job wrote under PROCESSED_FOLDER (annotated
+# MP4, HLS directory) plus its result summary. Entries
+# are JSON manifests in PROCESSED_FOLDER/.cache/<key>.json, so the cache
+# survives restarts; a manifest's mtime is its last use.
+#
+# Once the cached files add up to more than RESULT_CACHE_MAX_BYTES the
+# least recently used entries are deleted, files and all. Alert snapshots
+# are not part of any entry (the alerts table points at them) and are
+# never evicted. RESULT_CACHE_MAX_BYTES=0 turns the cache off.
+#
+# Jobs still running are tracked too, so a second submission of the same
+# content while the first is processing follows that job instead of
+# starting another.
+
+RESULT_CACHE_MAX_BYTES = int(os.environ.get('RESULT_CACHE_MAX_BYTES', 10 * 1024 ** 3))
+HASH_CHUNK_BYTES = 1024 * 1024
+
+
+def file_digest(path):
+    """sha256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_weights_digests = {}
+_weights_lock = threading.Lock()
+
+
+def weights_digest(path):
+    """file_digest of the model weights, recomputed only when the file changes"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None  # e.g. a model that is not a local file
+    stamp = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _weights_lock:
+        digest = _weights_digests.get(stamp)
+    if digest is None:
+        digest = file_digest(path)
+        with _weights_lock:
+            _weights_digests[stamp] = digest
+    return digest
+
+
+def cache_key(video_digest, model_digest, settings):
+    """Key for one video processed by one model with settings (a JSON-able dict)"""
+    material = json.dumps([video_digest, model_digest, settings], sort_keys=True)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def _tree_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(path) for name in names)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+
+class CacheEntry:
+    def __init__(self, key, files, result, size, last_used):
+        self.key = key
+        self.files = files    # paths relative to the cache folder; files[0] is the video
+        self.result = result  # the job's result, without host-specific URLs
+        self.size = size
+        self.last_used = last_used
+
+    @property
+    def video(self):
+        return self.files[0]
+
+    def to_dict(self):
+        return {'key': self.key, 'files': self.files, 'result': self.result, 'size': self.size}
+
+
+class ResultCache:
+    def __init__(self, folder, max_bytes=RESULT_CACHE_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.manifest_dir = os.path.join(folder, '.cache')
+        self._entries = {}
+        self._running = {}  # key -> Job producing it
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        self._load()
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    # ---------- lookups ----------
+    def lookup_or_claim(self, key, job=None):
+        """A finished CacheEntry, the Job still producing key, or None.
+
+        On a miss, job (if given) claims key in the same step, so two
+        submissions of the same content can't both miss and both start
+        processing: the second one gets the first one's job.
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._intact(entry):
+                self._remove(entry)
+                entry = None
+            if entry is not None:
+                entry.last_used = time.time()
+                self.hits += 1
+            else:
+                running = self._running.get(key)
+                if running is not None and (running.status in (JOB_FAILED, JOB_CANCELLED) or running.is_cancelled()):
+                    del self._running[key]
+                    running = None
+                if running is not None and running is not job:
+                    self.hits += 1
+                    return running
+                self.misses += 1
+                if job is not None:
+                    self._claim(key, job)
+                return None
+        # Last use is the manifest's mtime, so the LRU order survives restarts
+        try:
+            os.utime(self._manifest_path(key))
+        except OSError:
+            pass
+        return entry
+
+    def release(self, key, job):
+        """Drop job's claim on key without storing anything (failed or cancelled)"""
+        with self._lock:
+            if self._running.get(key) is job:
+                del self._running[key]
+
+    # ---------- updates ----------
+    def store(self, key, files, result, job=None):
+        """Add an entry for files (relative to the folder, video first), then evict down to budget.
+
+        job's claim on key is dropped in the same step the entry appears, so
+        a lookup in between can't miss both and process the video again.
+        """
+        if not self.enabled:
+            return None
+        size = sum(_tree_size(os.path.join(self.folder, name)) for name in files)
+        entry = CacheEntry(key, list(files), result, size, time.time())
+        if not self._intact(entry):
+            # e.g. the video writer failed to create the file
+            if job is not None:
+                self.release(key, job)
+            return None
+        path = self._manifest_path(key)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(entry.to_dict(), f)
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            if job is not None and self._running.get(key) is job:
+                del self._running[key]
+            old = self._entries.get(key)
+            if old is not None and old.files != entry.files:
+                self._delete_files(old)
+            self._entries[key] = entry
+            self._evict(keep=key)
+        return entry
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'bytes': sum(entry.size for entry in self._entries.values()),
+                'maxBytes': self.max_bytes,
+                'running': len(self._running),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    # ---------- internals ----------
+    def _claim(self, key, job):
+        # Caller holds self._lock; job now produces key (see store / release)
+        job.meta['cacheKey'] = key
+        self._running[key] = job
+
+    def _manifest_path(self, key):
+        return os.path.join(self.manifest_dir, f'{key}.json')
+
+    def _intact(self, entry):
+        return all(os.path.exists(os.path.join(self.folder, name)) for name in entry.files)
+
+    def _load(self):
+        for name in os.listdir(self.manifest_dir):
+            if not name.endswith('.json'):
+                continue
+            path = os.path.join(self.manifest_dir, name)
+            try:
+                with open(path) as f:
+                    data = json.load(f)
+                entry = CacheEntry(data['key'], data['files'], data['result'], data['size'],
+                                   os.path.getmtime(path))
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Dropping unreadable cache manifest {name}: {str(e)}")
+                os.remove(path)
+                continue
+            if self._intact(entry):
+                self._entries[entry.key] = entry
+            else:
+                self._remove(entry)
+        with self._lock:
+            self._evict()
+
+    def _evict(self, keep=None):
+        # Caller holds self._lock
+        total = sum(entry.size for entry in self._entries.values())
+        for entry in sorted(self._entries.values(), key=lambda e: e.last_used):
+            if total <= self.max_bytes:
+                break
+            if entry.key == keep:
+                continue
+            total -= entry.size
+            self._remove(entry)
+            self.evictions += 1
+            print(f"⚠️ Evicted cached result {entry.video} ({entry.size / 1024 ** 2:.1f} MB)")
+
+    def _remove(self, entry):
+        # Caller holds self._lock (or is still loading)
+        self._entries.pop(entry.key, None)
+        self._delete_files(entry)
+        try:
+            os.remove(self._manifest_path(entry.key))
+        except OSError:
+            pass
+
+    def _delete_files(self, entry):
+        for name in entry.files:
+            path = os.path.join(self.folder, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,192 @@
+import os
+import time
+import threading
+
+
+# ================================
+#  CROSS-CAMERA BATCHED INFERENCE SCHEDULER
+# ================================
+# Instead of every camera engine calling the model on its own thread (and
+# all of them fighting over the cores), a single scheduler thread wakes up
+# at the target rate, takes the newest unprocessed frame from every
+# registered camera, and runs them through the model as one batch. Frames
+# that arrived in between are simply overwritten by the engines' readers,
+# so nothing queues up and latency never grows with load: when the box is
+# saturated the achieved rate drops instead.
+
+SCHEDULER_TARGET_FPS = float(os.environ.get('SCHEDULER_TARGET_FPS', 5))
+SCHEDULER_MAX_BATCH = int(os.environ.get('SCHEDULER_MAX_BATCH', 16))
+
+
+def _ema(current, sample, alpha=0.2):
+    # Exponential moving average smooths out jitter between passes
+    return sample if current == 0.0 else (1 - alpha) * current + alpha * sample
+
+
+class InferenceScheduler:
+    def __init__(self, infer_batch, target_fps=SCHEDULER_TARGET_FPS, max_batch=SCHEDULER_MAX_BATCH):
+        """
+        infer_batch: infer_batch(frames) -> [results, ...] in the same
+                     order as frames
+        target_fps:  inference passes per second for each camera
+        max_batch:   upper bound on images (frames or ROI tiles) per model
+                     call; a bigger pass is split into several calls
+        """
+        self._infer_batch = infer_batch
+        self.target_fps = target_fps
+        self.max_batch = max_batch
+
+        self._engines = {}
+        self._last_seq = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+        # Rolling stats for capacity planning
+        self.passes = 0
+        self.frames_inferred = 0
+        self.images_inferred = 0  # frames plus ROI tiles
+        self.last_batch_size = 0
+        self.last_pass_seconds = 0.0
+        self.avg_frame_seconds = 0.0
+        self.avg_pass_interval = 0.0
+        self._last_pass_at = None
+
+    # ---------- registration ----------
+    def register(self, engine):
+        with self._lock:
+            self._engines[id(engine)] = engine
+            self._last_seq[id(engine)] = 0
+            if self._thread is None or not self._thread.is_alive():
+                self._stop_event.clear()
+                self._last_pass_at = None
+                self._thread = threading.Thread(target=self._loop, name='inference-scheduler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def unregister(self, engine):
+        with self._lock:
+            self._engines.pop(id(engine), None)
+            self._last_seq.pop(id(engine), None)
+
+    def set_target_fps(self, target_fps):
+        self.target_fps = max(0.1, float(target_fps))
+        self._wake.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    # ---------- main loop ----------
+    def _collect(self):
+        # Newest frame from every camera that has produced one since last pass
+        batch = []
+        with self._lock:
+            engines = list(self._engines.items())
+        for key, engine in engines:
+            taken = engine.take_frame(self._last_seq.get(key, 0))
+            if taken is None:
+                continue
+            frame, seq, captured_at = taken
+            with self._lock:
+                if key in self._last_seq:
+                    self._last_seq[key] = seq
+            # Static cameras don't take a slot in the batch
+            if not engine.gate_frame(frame):
+                continue
+            batch.append((engine, frame, captured_at))
+        return batch
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            interval = 1.0 / self.target_fps
+            tick_start = time.monotonic()
+
+            batch = self._collect()
+            with self._lock:
+                idle = not self._engines
+            if idle:
+                # Park until a camera registers
+                self._wake.wait(timeout=1.0)
+                self._wake.clear()
+                continue
+
+            if batch:
+                self._run(batch)
+
+            # Sleep out the rest of the tick; if inference overran we go again
+            # immediately and the achieved rate falls below the target
+            remaining = interval - (time.monotonic() - tick_start)
+            if remaining > 0:
+                self._wake.wait(timeout=remaining)
+                self._wake.clear()
+
+    def _chunks(self, batch):
+        # A tiled camera contributes one model input per tile; split the pass
+        # so no model call exceeds max_batch inputs (but never splits a frame)
+        chunk, size = [], 0
+        for engine, frame, captured_at in batch:
+            inputs = engine.model_inputs(frame)
+            if chunk and size + len(inputs) > self.max_batch:
+                yield chunk
+                chunk, size = [], 0
+            chunk.append((engine, frame, captured_at, inputs))
+            size += len(inputs)
+        if chunk:
+            yield chunk
+
+    def _run(self, batch):
+        start = time.monotonic()
+        if self._last_pass_at is not None:
+            self.avg_pass_interval = _ema(self.avg_pass_interval, start - self._last_pass_at)
+        self._last_pass_at = start
+        images = 0
+        for chunk in self._chunks(batch):
+            chunk_start = time.monotonic()
+            flat = [image for _, _, _, inputs in chunk for image in inputs]
+            try:
+                outputs = self._infer_batch(flat)
+            except Exception as e:
+                print(f"Error in batched inference: {str(e)}")
+                continue
+            images += len(flat)
+            per_frame = (time.monotonic() - chunk_start) / len(chunk)
+            offset = 0
+            for engine, frame, captured_at, inputs in chunk:
+                results = engine.combine(frame, outputs[offset:offset + len(inputs)])
+                offset += len(inputs)
+                if engine.running:
+                    engine.handle_result(frame, results, captured_at, per_frame)
+        elapsed = time.monotonic() - start
+
+        self.passes += 1
+        self.frames_inferred += len(batch)
+        self.images_inferred += images
+        self.last_batch_size = images
+        self.last_pass_seconds = elapsed
+        self.avg_frame_seconds = _ema(self.avg_frame_seconds, elapsed / len(batch))
+
+    # ---------- reporting ----------
+    def stats(self):
+        with self._lock:
+            cameras = len(self._engines)
+        achieved = 1.0 / self.avg_pass_interval if self.avg_pass_interval > 0 else 0.0
+        capacity = None
+        if self.avg_frame_seconds > 0:
+            # Cameras one box could sustain at the target rate
+            capacity = int((1.0 / self.target_fps) / self.avg_frame_seconds)
+        return {
+            'cameras': cameras,
+            'targetFps': self.target_fps,
+            'achievedFps': round(achieved, 2),
+            'maxBatch': self.max_batch,
+            'lastBatchSize': self.last_batch_size,
+            'lastPassMs': round(self.last_pass_seconds * 1000, 1),
+            'avgFrameMs': round(self.avg_frame_seconds * 1000, 1),
+            'estimatedCapacity': capacity,
+            'framesInferred': self.frames_inferred,
+            'imagesInferred': self.images_inferred,
+        }
@@ -0,0 +1,552 @@
+import os
+import json
+import time
+import queue
+import uuid
+import threading
+import multiprocessing
+
+import cv2
+
+from camera_engine import CameraEngine, FramePacket, PacketSubscriptions
+from events import alert_hooks
+from frame_ring import RING_MAX_HEIGHT, RING_MAX_WIDTH, FrameRing
+from inference import predict_batch
+from inference_backend import LazyModel
+from metrics import REGISTRY
+from motion import MOTION_GATE_ENABLED
+from scheduler import InferenceScheduler
+from tracking import TRACKING_ENABLED
+
+
+# ================================
+#  MULTI-PROCESS CAMERA SERVING
+# ================================
+# In 'processes' serving mode, live cameras do not run in the web
+# process. A pool of worker processes each own a model, a batching
+# scheduler and the capture/inference engines of the cameras assigned to
+# them, so capture, inference and plot() spread over every core instead
+# of sharing one GIL.
+#
+#   web process                               worker process
+#   -----------                               --------------
+#   ProcessEngineRegistry --commands queue--> worker_main: CameraEngines
+#   RemoteEngine <------- FrameRing (shm) --- on_result: detections + images
+#   make_event_saver <---- events queue ----- aggregator: finished events
+#
+# Frames cross the process boundary only through the shared-memory ring;
+# the queues carry small control messages and finished alert events (one
+# snapshot each). The web process keeps the single alert writer and the
+# SSE feed, so persistence works exactly as in thread mode.
+#
+# The worker creates each camera's ring once the source is open, sized to
+# its resolution, and the web process attaches to it. A worker that dies
+# is replaced; its cameras stop and have to be started again.
+
+WORKER_PROCESSES = int(os.environ.get('WORKER_PROCESSES', max(1, (os.cpu_count() or 2) // 2)))
+WORKER_START_TIMEOUT = float(os.environ.get('WORKER_START_TIMEOUT', 30))
+WORKER_STATS_SECONDS = float(os.environ.get('WORKER_STATS_SECONDS', 2.0))
+RING_POLL_SECONDS = float(os.environ.get('RING_POLL_SECONDS', 0.005))
+
+
+# ---------- worker process ----------
+class _RingWriter:
+    """Writes a camera's results and raw frames into its ring.
+
+    Results come from the inference thread and raw frames from the reader,
+    so slots are numbered here, under a lock, instead of by packet seq.
+    Raw frames go in slots of their own (meta {"raw": true, ...}).
+    """
+
+    def __init__(self, ring):
+        self.ring = ring
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def raw_wanted(self):
+        return not self.ring.closed and self.ring.wants()[1]
+
+    def publish(self, packet):
+        if self.ring.closed:
+            return  # camera is being stopped
+        meta = json.dumps(packet.detections(), separators=(',', ':')).encode('utf-8')
+        annotated = self.ring.fit(packet.annotated) if self.ring.wants()[0] else None
+        self._write(meta, annotated, None)
+
+    def publish_raw(self, packet):
+        if self.ring.closed:
+            return
+        meta = json.dumps({'raw': True, 'cameraId': packet.camera_id, 'timestamp': round(packet.timestamp, 3)},
+                          separators=(',', ':')).encode('utf-8')
+        self._write(meta, None, self.ring.fit(packet.frame))
+
+    def _write(self, meta, annotated, raw):
+        with self._lock:
+            if self.ring.closed:
+                return
+            self._seq += 1
+            self.ring.write(self._seq, meta, annotated, raw)
+
+
+def worker_main(worker_id, commands, events, threads):
+    """Entry point of a worker process (spawned, so nothing is inherited)"""
+    # Split the cores between workers before torch/OpenCV size their pools
+    os.environ.setdefault('OMP_NUM_THREADS', str(threads))
+    cv2.setNumThreads(threads)
+
+    model_provider = LazyModel()
+
+    def infer_frame(frame):
+        return model_provider.get()(frame, verbose=False)
+
+    def infer_frames(frames):
+        return [[result] for result in predict_batch(model_provider.get(), frames)]
+
+    scheduler = InferenceScheduler(infer_frames)
+    cameras = {}  # token -> (engine, ring)
+
+    def warm_up():
+        try:
+            model_provider.warm_up()
+            events.put(('ready', worker_id, model_provider.stats()))
+        except Exception as e:
+            events.put(('error', worker_id, str(e)))
+
+    # Cameras can already be started while the model loads
+    threading.Thread(target=warm_up, name='model-warmup', daemon=True).start()
+
+    def start(token, spec):
+        alerts_on_result, alerts_on_stop = alert_hooks(
+            lambda event: events.put(('alert', token, event.detach())))
+
+        def on_result(engine, packet):
+            alerts_on_result(engine, packet)
+            writer.publish(packet)
+
+        def on_raw(engine, packet):
+            writer.publish_raw(packet)
+
+        def on_stop(engine):
+            alerts_on_stop(engine)
+            events.put(('stopped', token, None))
+
+        # Keyed by token, not camera: a restarted camera briefly has two engines
+        engine = CameraEngine(spec['camera_id'], spec['kind'], spec['source'], infer_frame,
+                              on_result, scheduler, on_stop, TRACKING_ENABLED, MOTION_GATE_ENABLED,
+                              spec.get('tiler'), on_raw, lambda: writer.raw_wanted())
+        if not engine.open(spec.get('configure')):
+            events.put(('started', token, None))
+            return
+        # Size the ring to what this camera delivers (fit() scales anything larger)
+        width = int(engine.cap.get(cv2.CAP_PROP_FRAME_WIDTH)) or RING_MAX_WIDTH
+        height = int(engine.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)) or RING_MAX_HEIGHT
+        try:
+            ring = FrameRing.create(max_width=min(width, RING_MAX_WIDTH), max_height=min(height, RING_MAX_HEIGHT))
+        except OSError:
+            engine.cap.release()
+            raise
+        writer = _RingWriter(ring)
+        engine.start()
+        cameras[token] = (engine, ring)
+        events.put(('started', token, ring.name))
+
+    def stop(token):
+        camera = cameras.pop(token, None)
+        if camera is None:
+            return
+        engine, ring = camera
+        engine.stop()
+        ring.close()
+
+    last_stats = time.monotonic()
+    try:
+        while True:
+            try:
+                op, token, payload = commands.get(timeout=WORKER_STATS_SECONDS)
+            except queue.Empty:
+                op = None
+            if op == 'start':
+                try:
+                    start(token, payload)
+                except Exception as e:
+                    print(f"❌ Worker {worker_id} could not start camera: {str(e)}")
+                    events.put(('started', token, None))
+            elif op == 'stop':
+                stop(token)
+            elif op == 'shutdown':
+                break
+
+            if time.monotonic() - last_stats >= WORKER_STATS_SECONDS:
+                last_stats = time.monotonic()
+                for token, (engine, _) in list(cameras.items()):
+                    events.put(('stats', token, engine.stats()))
+                # Decode/inference/plot histograms live here; the web process
+                # renders them with a worker label
+                events.put(('metrics', worker_id, REGISTRY.snapshot()))
+    finally:
+        for engine, ring in cameras.values():
+            engine.stop()
+            ring.close()
+        scheduler.stop()
+
+
+# ---------- web process ----------
+class RemotePacket(FramePacket):
+    """A packet read in place from a worker's ring.
+
+    The images are views onto shared memory; a JPEG encoded from them is
+    only kept if the slot was not overwritten meanwhile.
+    """
+
+    def __init__(self, view, camera_id, kind=None):
+        self._record = json.loads(view.meta)
+        # A raw frame from the worker's reader, or an inference result
+        self.raw_only = bool(self._record.get('raw'))
+        super().__init__(view.seq, camera_id, view.image('raw'), None, self._record.get('timestamp'),
+                         kind=kind)
+        self._annotated = view.image('annotated')
+        self._view = view
+
+    @property
+    def annotated(self):
+        return self._annotated
+
+    def detections(self):
+        return self._record
+
+    def jpeg(self, quality=None, width=None, raw=False):
+        if (self.frame if raw else self._annotated) is None:
+            return None  # nobody wanted this image when the worker published it
+        cached = (quality, width, raw) in self._jpegs
+        data = super().jpeg(quality, width, raw)
+        if not cached and not self._view.valid():
+            self._jpegs.pop((quality, width, raw), None)
+            return None
+        return data
+
+
+class RemoteEngine(PacketSubscriptions):
+    """Web-process handle on a camera running in a worker process"""
+
+    def __init__(self, token, kind, camera_id, source, worker, on_event):
+        self.token = token
+        self.id = token
+        self.kind = kind
+        self.camera_id = camera_id
+        self.source = source
+        self.worker = worker
+        self.ring = None  # attached once the worker reports the camera started
+        self.ring_name = None
+        self.on_event = on_event
+
+        self.refs = 0
+        self.subscribers = 0
+        self.running = False
+        self.worker_stats = {}
+        self.started = threading.Event()
+        self.forgotten = False
+
+        self._packet = None
+        self._raw_packet = None
+        self._packet_cond = threading.Condition()
+        self._lock = threading.Lock()
+        self._wants = {'annotated': 0, 'raw': 0}
+        self._pump_thread = None
+        self._stopped = False
+
+    def start(self):
+        self.running = True
+        self._pump_thread = threading.Thread(target=self._pump, name=f'{self.kind}-{self.camera_id}-ring',
+                                             daemon=True)
+        self._pump_thread.start()
+
+    def stop(self):
+        if self._stopped:
+            return
+        self._stopped = True
+        self.running = False
+        with self._packet_cond:
+            self._packet_cond.notify_all()
+        self.worker.send('stop', self.token)
+        if self._pump_thread is not None and self._pump_thread is not threading.current_thread():
+            self._pump_thread.join(timeout=1)
+        if self.ring is not None:
+            self.ring.close()
+
+    def _pump(self):
+        # Turn every new ring slot into a packet for local subscribers
+        last_seq = 0
+        while self.running:
+            latest = self.ring.latest_seq()
+            if latest <= last_seq:
+                time.sleep(RING_POLL_SECONDS)
+                continue
+            # Results and raw frames interleave, so read every slot written
+            # since the last poll rather than only the newest
+            first = max(last_seq + 1, latest - self.ring.slots + 1)
+            last_seq = latest
+            for seq in range(first, latest + 1):
+                view = self.ring.read(seq)
+                if view is None:
+                    continue
+                packet = RemotePacket(view, self.camera_id, self.kind)
+                with self._packet_cond:
+                    if packet.raw_only:
+                        self._raw_packet = packet
+                    else:
+                        self._packet = packet
+                    self._packet_cond.notify_all()
+
+    def _watch(self, want, delta):
+        if want not in self._wants:
+            return
+        with self._lock:
+            self._wants[want] += delta
+            if self.ring is not None and not self.ring.closed:
+                self.ring.set_wants(self._wants['annotated'], self._wants['raw'])
+
+    def stats(self):
+        return {
+            **self.worker_stats,
+            'cameraId': self.camera_id,
+            'kind': self.kind,
+            'running': self.running,
+            'viewers': self.refs,
+            'subscribers': self.subscribers,
+            'worker': self.worker.id,
+        }
+
+
+class _Worker:
+    def __init__(self, worker_id, context, events, threads):
+        self.id = worker_id
+        self.restarts = 0
+        self.commands = context.Queue()
+        self.process = context.Process(target=worker_main, args=(worker_id, self.commands, events, threads),
+                                       name=f'camera-worker-{worker_id}', daemon=True)
+        self.cameras = 0
+        self.ready = False
+        self.model = None
+        self.metrics = {}  # latest REGISTRY.snapshot() from the process
+
+    def send(self, op, token=None, payload=None):
+        self.commands.put((op, token, payload))
+
+
+class ProcessEngineRegistry:
+    """EngineRegistry counterpart whose engines live in worker processes.
+
+    Same reference counting as EngineRegistry; acquire() takes the alert
+    on_event callback instead of in-process hooks, since aggregation runs
+    next to the model in the worker.
+    """
+
+    def __init__(self, workers=WORKER_PROCESSES):
+        self.worker_count = max(1, workers)
+        self._context = multiprocessing.get_context('spawn')
+        self._events = None
+        self._workers = []
+        self._engines = {}   # (kind, camera_id) -> RemoteEngine
+        self._tokens = {}    # token -> RemoteEngine
+        self._lock = threading.Lock()
+        self._events_thread = None
+        self._threads = max(1, (os.cpu_count() or 1) // self.worker_count)
+
+    def start_workers(self):
+        """Spawn the worker pool if it isn't running yet"""
+        with self._lock:
+            self._ensure_workers()
+
+    def _ensure_workers(self):
+        # Started on first use so importing the app spawns nothing
+        if self._workers:
+            return
+        self._events = self._context.Queue()
+        self._workers = [_Worker(i, self._context, self._events, self._threads) for i in range(self.worker_count)]
+        for worker in self._workers:
+            worker.process.start()
+        self._events_thread = threading.Thread(target=self._read_events, name='camera-worker-events', daemon=True)
+        self._events_thread.start()
+        print(f"✅ Started {self.worker_count} camera worker process(es)")
+
+    def acquire(self, kind, camera_id, source, on_event, configure=None, tiler=None):
+        """Return a running remote engine for the camera, starting one if needed.
+
+        configure must be a module-level function (it is pickled to the
+        worker). Returns None if the worker could not open the source.
+        """
+        key = (kind, camera_id)
+        with self._lock:
+            self._ensure_workers()
+            engine = self._engines.get(key)
+            if engine is not None and engine.running and engine.source == source:
+                engine.refs += 1
+                return engine
+
+            worker = min((w for w in self._workers if w.process.is_alive()),
+                         key=lambda w: w.cameras, default=None)
+            if worker is None:
+                return None
+            token = uuid.uuid4().hex
+            engine = RemoteEngine(token, kind, camera_id, source, worker, on_event)
+            self._tokens[token] = engine
+            worker.cameras += 1
+            worker.send('start', token, {
+                'kind': kind, 'camera_id': camera_id, 'source': source,
+                'configure': configure, 'tiler': tiler,
+            })
+
+        # Opening an RTSP source can take a while; don't block other cameras
+        started = engine.started.wait(WORKER_START_TIMEOUT) and engine.ring_name is not None
+        if started:
+            try:
+                engine.ring = FrameRing.attach(engine.ring_name)
+            except OSError as e:
+                print(f"❌ Could not attach to the frame ring of camera {camera_id}: {str(e)}")
+                started = False
+        if not started:
+            with self._lock:
+                self._tokens.pop(token, None)
+                self._forget(engine)
+            worker.send('stop', token)
+            return None
+
+        with self._lock:
+            old = self._engines.pop(key, None)
+            if old is not None:
+                self._forget(old)
+            engine.refs = 1
+            engine.start()
+            self._engines[key] = engine
+
+        if old is not None:
+            old.stop()
+        return engine
+
+    def release(self, kind, camera_id, force=False, engine_id=None):
+        """Drop one reference; the engine stops when none remain. Returns refs left.
+
+        With engine_id, only that engine is released: if it has since been
+        replaced, its references went with it and this is a no-op.
+        """
+        key = (kind, camera_id)
+        with self._lock:
+            engine = self._engines.get(key)
+            if engine is None or (engine_id is not None and engine.id != engine_id):
+                return 0
+            engine.refs = 0 if force else max(0, engine.refs - 1)
+            if engine.refs > 0 and engine.running:
+                return engine.refs
+            del self._engines[key]
+            self._forget(engine)
+        engine.stop()
+        return 0
+
+    def get(self, kind, camera_id):
+        with self._lock:
+            engine = self._engines.get((kind, camera_id))
+        if engine is not None and not engine.running:
+            self.release(kind, camera_id, force=True, engine_id=engine.id)
+            return None
+        return engine
+
+    def all(self):
+        with self._lock:
+            return list(self._engines.values())
+
+    def ready(self):
+        """True once every worker is alive and has a warm model"""
+        return bool(self._workers) and all(w.ready and w.process.is_alive() for w in self._workers)
+
+    def stats(self):
+        return [{'worker': w.id, 'pid': w.process.pid, 'alive': w.process.is_alive(), 'ready': w.ready,
+                 'cameras': w.cameras, 'restarts': w.restarts, 'model': w.model} for w in self._workers]
+
+    def metric_snapshots(self):
+        """[(extra labels, snapshot)] of every worker, for metrics.REGISTRY.render()"""
+        return [((('worker', str(w.id)),), w.metrics) for w in self._workers if w.metrics]
+
+    def stop_all(self):
+        with self._lock:
+            engines = list(self._engines.values())
+            self._engines.clear()
+            for engine in engines:
+                self._forget(engine)
+        for engine in engines:
+            engine.stop()
+        for worker in self._workers:
+            worker.send('shutdown')
+        for worker in self._workers:
+            worker.process.join(timeout=5)
+
+    def _forget(self, engine):
+        # Caller holds self._lock. The token stays known until the worker
+        # reports the camera stopped, so events it flushes on the way out
+        # are still saved
+        if not engine.forgotten:
+            engine.forgotten = True
+            engine.worker.cameras -= 1
+
+    def _read_events(self):
+        while True:
+            try:
+                op, token, payload = self._events.get(timeout=1.0)
+            except queue.Empty:
+                self._reap_dead_workers()
+                continue
+            except (EOFError, OSError):
+                return
+
+            if op == 'metrics':
+                self._workers[token].metrics = payload
+                continue
+            if op in ('ready', 'error'):
+                worker = self._workers[token]
+                worker.ready = op == 'ready'
+                worker.model = payload
+                if op == 'error':
+                    print(f"❌ Camera worker {token} failed to load the model: {payload}")
+                continue
+
+            with self._lock:
+                engine = self._tokens.get(token)
+            if engine is None:
+                continue
+            if op == 'started':
+                engine.ring_name = payload  # None if the source didn't open
+                engine.started.set()
+            elif op == 'stats':
+                engine.worker_stats = payload
+            elif op == 'alert':
+                try:
+                    engine.on_event(payload)
+                except Exception as e:
+                    print(f"❌ Failed saving alert from camera {engine.camera_id}: {str(e)}")
+            elif op == 'stopped':
+                # Either we asked, or the source ended inside the worker (then
+                # get() cleans up the registry entry)
+                with self._lock:
+                    self._tokens.pop(token, None)
+                engine.running = False
+                with engine._packet_cond:
+                    engine._packet_cond.notify_all()
+
+    def _reap_dead_workers(self):
+        for worker in list(self._workers):
+            if worker.process.is_alive() or worker.process.exitcode is None:
+                continue
+            print(f"⚠️ Camera worker {worker.id} died (exit code {worker.process.exitcode}); restarting it")
+            with self._lock:
+                dead = [e for e in self._tokens.values() if e.worker is worker]
+                for engine in dead:
+                    del self._tokens[engine.token]
+                    self._forget(engine)
+                # Same slot, fresh process; its cameras have to be started again
+                replacement = _Worker(worker.id, self._context, self._events, self._threads)
+                replacement.restarts = worker.restarts + 1
+                self._workers[worker.id] = replacement
+                replacement.process.start()
+            for engine in dead:
+                engine.running = False
+                with engine._packet_cond:
+                    engine._packet_cond.notify_all()
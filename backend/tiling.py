@@ -0,0 +1,253 @@
+import os
+import json
+
+import cv2
+import numpy as np
+
+from inference import CLASS_NAMES
+
+
+# ================================
+#  REGION-OF-INTEREST TILING
+# ================================
+# A 1080p/4K CCTV frame handed to YOLO whole is letterboxed down to the
+# model's input size, and a student at the back of the hall ends up a few
+# pixels tall. With a tile layout the engine instead crops the seat
+# regions (optionally split into a grid of overlapping tiles), runs all
+# tiles through the model as one batch, shifts the boxes back into
+# full-frame coordinates and drops the duplicates found on tile seams.
+# Everything outside the ROIs is never inferred, and the annotated image
+# is drawn on a downscaled preview, so per-camera CPU stays bounded by
+# the tile count rather than the sensor resolution.
+#
+# Layouts come from the start-cctv request ("tiling": {...}) or from the
+# JSON file at TILING_CONFIG_PATH (default: tiling.json next to this
+# module, whatever the working directory), keyed by camera id:
+#
+#   {"cam1": {"rois": [[0, 0.4, 1, 1]], "grid": [3, 1], "overlap": 0.15}}
+#
+# ROI coordinates are fractions of the frame if all are <= 1, else pixels.
+
+TILING_CONFIG_PATH = os.environ.get('TILING_CONFIG_PATH', os.path.join(os.path.dirname(__file__), 'tiling.json'))
+TILE_OVERLAP = float(os.environ.get('TILE_OVERLAP', 0.15))
+TILE_MERGE_THRESHOLD = float(os.environ.get('TILE_MERGE_THRESHOLD', 0.6))
+TILE_PREVIEW_WIDTH = int(os.environ.get('TILE_PREVIEW_WIDTH', 960))
+
+
+def load_tiling_config(path=TILING_CONFIG_PATH):
+    """Per-camera layout dicts from the config file; {} if there is none"""
+    if not path or not os.path.exists(path):
+        return {}
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"❌ Could not read tiling config {path}: {str(e)}")
+        return {}
+
+
+class _Column:
+    # Lets a NumPy array stand in for a Results tensor (.cpu().numpy())
+    def __init__(self, values):
+        self._values = values
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self._values
+
+    def __len__(self):
+        return len(self._values)
+
+
+class TiledBoxes:
+    def __init__(self, xyxy, cls, conf):
+        self.xyxy = _Column(xyxy)
+        self.cls = _Column(cls)
+        self.conf = _Column(conf)
+
+    def __len__(self):
+        return len(self.conf)
+
+
+class TiledResult:
+    """Merged detections for a whole frame, shaped like an Ultralytics Results.
+
+    Exposes boxes.xyxy/cls/conf and plot(), which is everything the alert,
+    tracking and streaming code reads from a result.
+    """
+
+    def __init__(self, orig_img, xyxy, cls, conf, preview_width=None):
+        self.orig_img = orig_img
+        self.orig_shape = orig_img.shape[:2]
+        self.boxes = TiledBoxes(xyxy, cls, conf)
+        self.names = CLASS_NAMES
+        self.preview_width = preview_width
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def plot(self, img=None):
+        """Boxes drawn on a copy of img (default: the frame at preview width)"""
+        if img is None:
+            img = self.orig_img
+            width = img.shape[1]
+            if self.preview_width and self.preview_width < width:
+                height = int(round(img.shape[0] * self.preview_width / width))
+                img = cv2.resize(img, (self.preview_width, height), interpolation=cv2.INTER_AREA)
+            else:
+                img = img.copy()
+        else:
+            img = img.copy()
+        scale = img.shape[1] / float(self.orig_shape[1])
+
+        xyxy = self.boxes.xyxy.numpy()
+        classes = self.boxes.cls.numpy()
+        confidences = self.boxes.conf.numpy()
+        for box, cls, conf in zip(xyxy, classes, confidences):
+            x1, y1, x2, y2 = [int(round(v * scale)) for v in box]
+            color = _color(int(cls))
+            cv2.rectangle(img, (x1, y1), (x2, y2), color, 2)
+            label = f"{self.names.get(int(cls), 'unknown')} {conf:.2f}"
+            cv2.putText(img, label, (x1, max(12, y1 - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+        return img
+
+
+def _color(cls):
+    key = (cls + 1) * 47
+    return (key * 3 % 255, key * 7 % 255, key * 11 % 255)
+
+
+def _suppress(xyxy, conf, threshold):
+    """Greedy NMS on intersection over the *smaller* box.
+
+    A student cut in half by a tile edge yields a partial box inside the
+    full one; their IoU is low, but the partial box is almost entirely
+    covered, so comparing against the smaller area removes it.
+    """
+    order = np.argsort(-conf)
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(i)
+        rest = order[1:]
+        x1 = np.maximum(xyxy[i, 0], xyxy[rest, 0])
+        y1 = np.maximum(xyxy[i, 1], xyxy[rest, 1])
+        x2 = np.minimum(xyxy[i, 2], xyxy[rest, 2])
+        y2 = np.minimum(xyxy[i, 3], xyxy[rest, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        smaller = np.maximum(np.minimum(areas[i], areas[rest]), 1e-6)
+        order = rest[inter / smaller < threshold]
+    return np.array(keep, dtype=int)
+
+
+class TileLayout:
+    def __init__(self, rois=None, grid=(1, 1), overlap=TILE_OVERLAP,
+                 merge_threshold=TILE_MERGE_THRESHOLD, preview_width=TILE_PREVIEW_WIDTH):
+        """
+        rois:            [[x1, y1, x2, y2], ...] seat regions; None = whole frame
+        grid:            (cols, rows) each ROI is split into
+        overlap:         fraction of a tile shared with its neighbours, so a
+                         student on a seam is whole in at least one tile
+        merge_threshold: overlap (of the smaller box) above which boxes from
+                         different tiles count as the same detection
+        preview_width:   width of the annotated image sent to viewers
+        """
+        self.rois = [list(map(float, roi)) for roi in rois] if rois else None
+        if self.rois and any(len(roi) != 4 for roi in self.rois):
+            raise ValueError('every ROI needs four coordinates [x1, y1, x2, y2]')
+        self.grid = (max(1, int(grid[0])), max(1, int(grid[1])))
+        self.overlap = min(0.5, max(0.0, float(overlap)))
+        self.merge_threshold = merge_threshold
+        self.preview_width = preview_width
+        self._windows = {}
+        self.tile_count = 0
+
+    @classmethod
+    def from_config(cls, config):
+        """Build a layout from a config/request dict; None if it asks for nothing"""
+        if not config:
+            return None
+        layout = cls(
+            rois=config.get('rois'),
+            grid=config.get('grid', (1, 1)),
+            overlap=config.get('overlap', TILE_OVERLAP),
+            merge_threshold=config.get('mergeThreshold', TILE_MERGE_THRESHOLD),
+            preview_width=config.get('previewWidth', TILE_PREVIEW_WIDTH),
+        )
+        if layout.rois is None and layout.grid == (1, 1):
+            return None  # the whole frame as a single tile is just the normal path
+        return layout
+
+    def windows(self, shape):
+        """Pixel (x1, y1, x2, y2) of every tile for a frame of this shape"""
+        height, width = shape[:2]
+        windows = self._windows.get((height, width))
+        if windows is not None:
+            self.tile_count = len(windows)
+            return windows
+
+        rois = self.rois or [[0, 0, 1, 1]]
+        windows = []
+        for roi in rois:
+            if all(v <= 1 for v in roi):
+                roi = [roi[0] * width, roi[1] * height, roi[2] * width, roi[3] * height]
+            rx1, ry1 = max(0, int(roi[0])), max(0, int(roi[1]))
+            rx2, ry2 = min(width, int(roi[2])), min(height, int(roi[3]))
+            if rx2 <= rx1 or ry2 <= ry1:
+                continue
+            cols, rows = self.grid
+            # Tiles of equal size, stepped so neighbours share `overlap` of a tile
+            tile_w = (rx2 - rx1) / (cols - (cols - 1) * self.overlap)
+            tile_h = (ry2 - ry1) / (rows - (rows - 1) * self.overlap)
+            for r in range(rows):
+                for c in range(cols):
+                    x1 = rx1 + c * tile_w * (1 - self.overlap)
+                    y1 = ry1 + r * tile_h * (1 - self.overlap)
+                    windows.append((int(x1), int(y1),
+                                    min(rx2, int(round(x1 + tile_w))), min(ry2, int(round(y1 + tile_h)))))
+        self._windows[(height, width)] = windows
+        self.tile_count = len(windows)
+        return windows
+
+    def crop(self, frame):
+        """The tile images for a frame, in windows() order"""
+        return [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in self.windows(frame.shape)]
+
+    def merge(self, frame, tile_results):
+        """One result per tile -> [TiledResult] in full-frame coordinates"""
+        boxes, classes, confidences = [], [], []
+        for (x1, y1, _, _), result in zip(self.windows(frame.shape), tile_results):
+            if result is None or result.boxes is None or len(result.boxes) == 0:
+                continue
+            xyxy = result.boxes.xyxy.cpu().numpy().astype(np.float32)
+            xyxy[:, [0, 2]] += x1
+            xyxy[:, [1, 3]] += y1
+            boxes.append(xyxy)
+            classes.append(result.boxes.cls.cpu().numpy())
+            confidences.append(result.boxes.conf.cpu().numpy())
+
+        if boxes:
+            xyxy = np.concatenate(boxes)
+            cls = np.concatenate(classes)
+            conf = np.concatenate(confidences)
+            if len(boxes) > 1:
+                # Class-agnostic: the same student may be labelled with two
+                # different postures by two tiles
+                keep = _suppress(xyxy, conf, self.merge_threshold)
+                xyxy, cls, conf = xyxy[keep], cls[keep], conf[keep]
+        else:
+            xyxy = np.zeros((0, 4), dtype=np.float32)
+            cls = np.zeros(0, dtype=np.float32)
+            conf = np.zeros(0, dtype=np.float32)
+        return [TiledResult(frame, xyxy, cls, conf, self.preview_width)]
+
+    def stats(self):
+        return {
+            'rois': len(self.rois) if self.rois else 0,
+            'grid': list(self.grid),
+            'tiles': self.tile_count,
+            'previewWidth': self.preview_width,
+        }
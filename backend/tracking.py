@@ -0,0 +1,145 @@
+import os
+
+import cv2
+
+
+# ================================
+#  LIGHTWEIGHT IoU TRACKING
+# ================================
+# Gives YOLO boxes an identity across frames so alerts can be keyed to a
+# student rather than to a frame. Matching is greedy on IoU (falling back
+# to centroid distance for fast movers), which costs microseconds for the
+# handful of boxes in an exam hall. Class is deliberately ignored when
+# matching: the classes here are postures/behaviours, and the same
+# student switches between them.
+#
+# Each track keeps a per-second velocity, so between two inference frames
+# its box can be extrapolated; that lets offline processing run the model
+# on a sparse stride and still draw a box on every frame.
+
+TRACKING_ENABLED = os.environ.get('TRACKING_ENABLED', '0') in ('1', 'true')
+TRACK_IOU_THRESHOLD = float(os.environ.get('TRACK_IOU_THRESHOLD', 0.3))
+TRACK_MAX_AGE_SECONDS = float(os.environ.get('TRACK_MAX_AGE_SECONDS', 2.0))
+
+
+def iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    if inter <= 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+def _centroid_close(a, b):
+    # Centres within half the mean box size of each other
+    acx, acy = (a[0] + a[2]) / 2.0, (a[1] + a[3]) / 2.0
+    bcx, bcy = (b[0] + b[2]) / 2.0, (b[1] + b[3]) / 2.0
+    size = ((a[2] - a[0]) + (a[3] - a[1]) + (b[2] - b[0]) + (b[3] - b[1])) / 4.0
+    return ((acx - bcx) ** 2 + (acy - bcy) ** 2) ** 0.5 < 0.5 * size
+
+
+class Track:
+    def __init__(self, track_id, detection, timestamp):
+        self.id = track_id
+        self.box = [float(v) for v in detection['box']]
+        self.cls = detection['cls']
+        self.label = detection.get('label')
+        self.conf = detection['conf']
+        self.velocity = [0.0, 0.0, 0.0, 0.0]
+        self.last_seen = timestamp
+        self.hits = 1
+
+    def update(self, detection, timestamp):
+        box = [float(v) for v in detection['box']]
+        dt = timestamp - self.last_seen
+        if dt > 0:
+            self.velocity = [(new - old) / dt for new, old in zip(box, self.box)]
+        self.box = box
+        self.cls = detection['cls']
+        self.label = detection.get('label')
+        self.conf = detection['conf']
+        self.last_seen = timestamp
+        self.hits += 1
+
+    def predict(self, timestamp):
+        dt = timestamp - self.last_seen
+        return [v + dv * dt for v, dv in zip(self.box, self.velocity)]
+
+    def as_detection(self, box=None):
+        return {
+            'box': [int(round(v)) for v in (box or self.box)],
+            'cls': self.cls,
+            'label': self.label,
+            'conf': self.conf,
+            'track': self.id,
+        }
+
+
+class IoUTracker:
+    def __init__(self, iou_threshold=TRACK_IOU_THRESHOLD, max_age=TRACK_MAX_AGE_SECONDS):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks = []
+        self._next_id = 1
+
+    def update(self, timestamp, detections):
+        """Match detections (dicts with box/cls/conf) to tracks.
+
+        Returns the detections with a 'track' id added, in input order.
+        """
+        pairs = []
+        for ti, track in enumerate(self.tracks):
+            predicted = track.predict(timestamp)
+            for di, detection in enumerate(detections):
+                score = iou(predicted, detection['box'])
+                if score < self.iou_threshold and _centroid_close(predicted, detection['box']):
+                    score = self.iou_threshold  # weakest acceptable match
+                if score >= self.iou_threshold:
+                    pairs.append((score, ti, di))
+        pairs.sort(reverse=True)
+
+        matched_tracks, assigned = set(), {}
+        for score, ti, di in pairs:
+            if ti in matched_tracks or di in assigned:
+                continue
+            matched_tracks.add(ti)
+            assigned[di] = self.tracks[ti]
+
+        tracked = []
+        for di, detection in enumerate(detections):
+            track = assigned.get(di)
+            if track is None:
+                track = Track(self._next_id, detection, timestamp)
+                self._next_id += 1
+                self.tracks.append(track)
+            else:
+                track.update(detection, timestamp)
+            tracked.append(dict(detection, track=track.id))
+
+        self.tracks = [t for t in self.tracks if timestamp - t.last_seen <= self.max_age]
+        return tracked
+
+    def predict(self, timestamp):
+        """Extrapolated boxes for frames between inference passes"""
+        return [track.as_detection(track.predict(timestamp)) for track in self.tracks
+                if timestamp - track.last_seen <= self.max_age]
+
+
+def draw_tracks(frame, detections):
+    """Cheap stand-in for results.plot() that also shows the track id"""
+    annotated = frame.copy()
+    for detection in detections:
+        x1, y1, x2, y2 = detection['box']
+        color = _color(detection.get('track') or detection['cls'])
+        cv2.rectangle(annotated, (x1, y1), (x2, y2), color, 2)
+        label = f"#{detection.get('track', '?')} {detection.get('label') or detection['cls']} {detection['conf']:.2f}"
+        cv2.putText(annotated, label, (x1, max(12, y1 - 4)), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1, cv2.LINE_AA)
+    return annotated
+
+
+def _color(key):
+    key = int(key) * 47
+    return (key * 3 % 255, key * 7 % 255, key * 11 % 255)
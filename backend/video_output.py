@@ -0,0 +1,154 @@
+import os
+import shutil
+import threading
+import subprocess
+from collections import deque
+
+import cv2
+
+
+# ================================
+#  PROCESSED VIDEO OUTPUT
+# ================================
+# 'mp4' writes the annotated video with cv2.VideoWriter; it is only
+# playable once the job finishes and the writer finalises the file.
+#
+# 'hls' pipes the annotated frames to ffmpeg, which encodes them once
+# and muxes them twice (tee): into an HLS event playlist of fragmented
+# MP4 segments that grows while the job runs, and into the usual
+# faststart MP4 for download once it is done. The dashboard can start
+# playing the playlist as soon as the first segment is written.
+#
+#   processed/<name>.mp4               finished file (as in 'mp4' mode)
+#   processed/<name>_hls/index.m3u8    playlist, EXT-X-ENDLIST once done
+#   processed/<name>_hls/init.mp4      fMP4 init segment
+#   processed/<name>_hls/seg_00000.m4s ...
+#
+# HLS needs an ffmpeg binary (FFMPEG_BINARY); without one jobs fall back
+# to 'mp4'.
+
+VIDEO_OUTPUT_FORMAT = os.environ.get('VIDEO_OUTPUT_FORMAT', 'mp4')
+FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+HLS_SEGMENT_SECONDS = float(os.environ.get('HLS_SEGMENT_SECONDS', 2))
+HLS_X264_PRESET = os.environ.get('HLS_X264_PRESET', 'veryfast')
+
+OUTPUT_FORMATS = ('mp4', 'hls')
+HLS_PLAYLIST = 'index.m3u8'
+
+
+def hls_available():
+    return shutil.which(FFMPEG_BINARY) is not None
+
+
+def hls_dir_for(output_path):
+    """Directory holding the HLS playlist and segments for output_path"""
+    return os.path.splitext(output_path)[0] + '_hls'
+
+
+def resolve_format(requested=None):
+    """The output format a job will actually use ('hls' only if ffmpeg exists)"""
+    fmt = requested or VIDEO_OUTPUT_FORMAT
+    if fmt not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{fmt}' (expected one of {', '.join(OUTPUT_FORMATS)})")
+    if fmt == 'hls' and not hls_available():
+        print(f"⚠️ {FFMPEG_BINARY} not found; writing plain MP4 instead of HLS")
+        return 'mp4'
+    return fmt
+
+
+class Mp4Writer:
+    def __init__(self, output_path, fps, width, height):
+        self.output_path = output_path
+        self.playlist_path = None
+        self._out = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'avc1'), fps, (width, height))
+
+    def playlist_ready(self):
+        return False
+
+    def write(self, frame):
+        self._out.write(frame)
+
+    def release(self):
+        self._out.release()
+
+    def discard(self):
+        """Stop writing and delete the partial output"""
+        self.release()
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+class HlsWriter:
+    def __init__(self, output_path, fps, width, height, segment_seconds=HLS_SEGMENT_SECONDS):
+        self.output_path = output_path
+        self.hls_dir = hls_dir_for(output_path)
+        self.playlist_path = os.path.join(self.hls_dir, HLS_PLAYLIST)
+        self.size = (width, height)
+        self._released = False
+        self._stderr = deque(maxlen=20)
+        os.makedirs(self.hls_dir, exist_ok=True)
+
+        # A keyframe at every segment boundary so segments cut exactly there
+        gop = max(1, int(round(fps * segment_seconds)))
+        hls = (f"[f=hls:hls_time={segment_seconds:g}:hls_playlist_type=event:hls_segment_type=fmp4"
+               f":hls_flags=independent_segments+temp_file:hls_fmp4_init_filename=init.mp4"
+               f":hls_segment_filename=seg_%05d.m4s]{HLS_PLAYLIST}")
+        mp4 = f"[f=mp4:movflags=+faststart]../{os.path.basename(output_path)}"
+        command = [
+            FFMPEG_BINARY, '-hide_banner', '-loglevel', 'error', '-y',
+            '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps), '-i', '-',
+            '-map', '0:v', '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2',
+            '-c:v', 'libx264', '-preset', HLS_X264_PRESET, '-pix_fmt', 'yuv420p',
+            '-g', str(gop), '-keyint_min', str(gop), '-sc_threshold', '0',
+            '-f', 'tee', f"{hls}|{mp4}",
+        ]
+        # Relative names keep drive letters and colons out of the tee spec
+        self._process = subprocess.Popen(command, cwd=self.hls_dir, stdin=subprocess.PIPE,
+                                         stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        self._stderr_thread = threading.Thread(target=self._drain_stderr, name='ffmpeg-stderr', daemon=True)
+        self._stderr_thread.start()
+
+    def _drain_stderr(self):
+        for line in self._process.stderr:
+            self._stderr.append(line.decode('utf-8', 'replace').rstrip())
+
+    def playlist_ready(self):
+        return os.path.exists(self.playlist_path)
+
+    def write(self, frame):
+        if (frame.shape[1], frame.shape[0]) != self.size:
+            frame = cv2.resize(frame, self.size)
+        try:
+            self._process.stdin.write(frame.tobytes())
+        except (BrokenPipeError, OSError):
+            raise RuntimeError(f"ffmpeg stopped: {' | '.join(self._stderr) or 'no output'}")
+
+    def release(self):
+        """Finish the encode: ends the playlist and finalises the MP4"""
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._process.stdin.close()
+        except OSError:
+            pass
+        code = self._process.wait()
+        self._stderr_thread.join(timeout=1)
+        if code != 0:
+            raise RuntimeError(f"ffmpeg exited with {code}: {' | '.join(self._stderr) or 'no output'}")
+
+    def discard(self):
+        """Kill the encode and delete the playlist, segments and partial MP4"""
+        self._released = True
+        self._process.kill()
+        self._process.wait()
+        shutil.rmtree(self.hls_dir, ignore_errors=True)
+        if os.path.exists(self.output_path):
+            os.remove(self.output_path)
+
+
+def open_video_output(output_path, fps, width, height, fmt='mp4'):
+    """Writer with write(frame), release(), discard() and playlist_ready() for fmt"""
+    if fmt == 'hls':
+        return HlsWriter(output_path, fps, width, height)
+    return Mp4Writer(output_path, fps, width, height)
@@ -8,12 +8,14 @@ const Dashboard = () => {
   const [processedUrls, setProcessedUrls] = useState({}); // keyed by camera id
   const [uploadedFiles, setUploadedFiles] = useState({}); // keyed by camera id
   const [streaming, setStreaming] = useState({}); // keyed by camera id
+  const [overlays, setOverlays] = useState({}); // latest detection record, keyed by camera id
   const [webcamStream, setWebcamStream] = useState(null);
   const webcamRef = useRef(null); // hidden element for capturing webcam
   const captureCanvasRef = useRef(document.createElement('canvas'));
   const webcamIntervalRef = useRef(null);
   const webcamBusyRef = useRef(false);
   const latestFrameRef = useRef(null);
+  const engineIdsRef = useRef({}); // engineId per camera, so a stop releases only the engine it started
   const [camerasState, setCamerasState] = useState({
     // keep RTSP editable per-camera in local state
     3: { rtspUrl: 'rtsp://your-camera-ip:554/stream' }
@@ -22,6 +24,7 @@ const Dashboard = () => {
   const [evidenceImage, setEvidenceImage] = useState(null);
   const [alerts, setAlerts] = useState([]); // Real alerts from API
   const [loadingAlerts, setLoadingAlerts] = useState(false);
+  const [alertsCursor, setAlertsCursor] = useState(null); // nextCursor of the last page loaded
 
   const navigate = useNavigate();
 
@@ -84,23 +87,33 @@ const Dashboard = () => {
     }
   };
 
-  // Fetch alerts from API
-  const fetchAlerts = async () => {
+  // Fetch alerts from API: the first (newest) page, or the page after `cursor`
+  const fetchAlerts = async (cursor = null) => {
     setLoadingAlerts(true);
     try {
-      const response = await fetch('http://localhost:5000/api/alerts');
-      if (response.ok) {
-        const data = await response.json();
-        if (data && Array.isArray(data.alerts)) {
-          console.log('Fetched alerts:', data.alerts);
-          setAlerts(data.alerts);
-        } else {
-          console.warn('Unexpected alerts payload:', data);
-          setAlerts([]);
-        }
-      } else {
+      const url = `http://localhost:5000/api/alerts${cursor !== null ? `?cursor=${cursor}` : ''}`;
+      const response = await fetch(url);
+      if (!response.ok) {
         console.error('Failed to fetch alerts');
+        return;
+      }
+      const data = await response.json();
+      if (!data || !Array.isArray(data.alerts)) {
+        console.warn('Unexpected alerts payload:', data);
+        if (cursor === null) setAlerts([]);
+        return;
+      }
+      console.log('Fetched alerts:', data.alerts);
+      if (cursor === null) {
+        setAlerts(data.alerts);
+      } else {
+        // Skip rows the live feed already prepended
+        setAlerts(prevAlerts => [
+          ...prevAlerts,
+          ...data.alerts.filter(a => !prevAlerts.some(p => p.id === a.id))
+        ]);
       }
+      setAlertsCursor(data.nextCursor ?? null);
     } catch (error) {
       console.error('Error fetching alerts:', error);
     } finally {
@@ -133,19 +146,30 @@ const Dashboard = () => {
     }
   };
 
-  // Auto-refresh alerts when on alerts tab
+  // Live alerts: load once, then let the server push new ones
   useEffect(() => {
     fetchAlerts(); // Fetch on mount
 
-    // Auto-refresh every 3 seconds when on alerts tab
-    let interval;
+    // Subscribe to the alert feed while on the alerts tab; the browser
+    // reconnects on its own and resumes from the last alert id it saw
+    let alertSource;
     if (activeTab === 'alerts') {
-      interval = setInterval(fetchAlerts, 3000);
+      alertSource = new EventSource('http://localhost:5000/api/alerts/stream');
+      alertSource.addEventListener('alert', (event) => {
+        const newAlert = JSON.parse(event.data);
+        setAlerts(prevAlerts => (
+          prevAlerts.some(a => a.id === newAlert.id) ? prevAlerts : [newAlert, ...prevAlerts]
+        ));
+      });
+      alertSource.addEventListener('deleted', (event) => {
+        const { id } = JSON.parse(event.data);
+        setAlerts(prevAlerts => prevAlerts.filter(a => a.id !== id));
+      });
     }
 
     return () => {
-      if (interval) {
-        clearInterval(interval);
+      if (alertSource) {
+        alertSource.close();
       }
     };
   }, [activeTab]);
@@ -202,10 +226,25 @@ const Dashboard = () => {
       }
 
       const data = await res.json();
-      console.log('Processed video URL:', data);
+      console.log('Processing job queued:', data);
+
+      // Processing runs as a background job; poll until it finishes
+      let job = data;
+      while (job && job.jobId && !['completed', 'failed', 'cancelled'].includes(job.status)) {
+        await new Promise(resolve => setTimeout(resolve, 1000));
+        const statusRes = await fetch(`http://localhost:5000/api/jobs/${job.jobId}`);
+        if (!statusRes.ok) {
+          throw new Error('Lost track of processing job');
+        }
+        job = await statusRes.json();
+      }
+      if (job && job.status && job.status !== 'completed') {
+        throw new Error(job.error || `Processing ${job.status}`);
+      }
 
-      if (data && data.processedVideoUrl) {
-        const processedUrl = data.processedVideoUrl;
+      // A cache hit finishes with an earlier run's video, so prefer the job's final URL
+      const processedUrl = (job && job.processedVideoUrl) || (data && data.processedVideoUrl);
+      if (processedUrl) {
         const buster = `${processedUrl}${processedUrl.includes('?') ? '&' : '?'}t=${Date.now()}`;
         setProcessedUrls(prev => ({ ...prev, [cameraId]: buster }));
       } else {
@@ -217,7 +256,8 @@ const Dashboard = () => {
     }
   };
 
-  // Webcam: capture frames and send to backend for annotation; display MJPEG frames
+  // Webcam: every camera frame arrives as raw MJPEG; boxes come from the
+  // detections stream at inference rate and are drawn over it client-side
   const startWebcamRecording = async (cameraId) => {
     try {
       const response = await fetch('http://localhost:5000/api/start-webcam', {
@@ -231,18 +271,20 @@ const Dashboard = () => {
       if (!response.ok) {
         throw new Error('Failed to start webcam stream');
       }
+      const { engineId } = await response.json();
+      engineIdsRef.current[cameraId] = engineId;
 
       setStreaming(prev => ({ ...prev, [cameraId]: true }));
 
-      const eventSource = new EventSource(`http://localhost:5000/api/webcam-stream/${cameraId}`);
-      
+      const frameUrl = `http://localhost:5000/api/webcam-mjpeg/${cameraId}?raw=1&t=${Date.now()}`;
+      setProcessedUrls(prev => ({ ...prev, [cameraId]: frameUrl }));
+      latestFrameRef.current = frameUrl;
+
+      const eventSource = new EventSource(`http://localhost:5000/api/webcam-detections/${cameraId}`);
+
       eventSource.onmessage = (event) => {
-        const frame = JSON.parse(event.data);
-        if (frame.image) {
-          const frameUrl = `data:image/jpeg;base64,${frame.image}`;
-          setProcessedUrls(prev => ({ ...prev, [cameraId]: frameUrl }));
-          latestFrameRef.current = frameUrl;
-        }
+        const record = JSON.parse(event.data);
+        setOverlays(prev => ({ ...prev, [cameraId]: record }));
       };
 
       eventSource.onerror = (error) => {
@@ -272,10 +314,12 @@ const Dashboard = () => {
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ camera_id: cameraId })
+        body: JSON.stringify({ camera_id: cameraId, engine_id: engineIdsRef.current[cameraId] })
       });
+      delete engineIdsRef.current[cameraId];
 
       setProcessedUrls(prev => ({ ...prev, [cameraId]: null }));
+      setOverlays(prev => ({ ...prev, [cameraId]: null }));
       latestFrameRef.current = null;
 
     } catch (err) {
@@ -285,7 +329,7 @@ const Dashboard = () => {
     }
   };
 
-  // ---------- CCTV: send RTSP to backend, receive processed stream URL for this camera ----------
+  // ---------- CCTV: send RTSP to backend, then show its raw frames with a detection overlay ----------
   const startCCTVProcessing = async (cameraId) => {
     const rtspUrl = camerasState[cameraId]?.rtspUrl;
     if (!rtspUrl) {
@@ -309,18 +353,20 @@ const Dashboard = () => {
       if (!response.ok) {
         throw new Error('Failed to start CCTV stream');
       }
+      const { engineId } = await response.json();
+      engineIdsRef.current[cameraId] = engineId;
 
       setStreaming(prev => ({ ...prev, [cameraId]: true }));
 
-      // Start receiving processed frames
-      const eventSource = new EventSource(`http://localhost:5000/api/cctv-stream/${cameraId}`);
-      
+      // Same as the webcam: raw frames as MJPEG, boxes from the detections stream
+      const frameUrl = `http://localhost:5000/api/cctv-mjpeg/${cameraId}?raw=1&t=${Date.now()}`;
+      setProcessedUrls(prev => ({ ...prev, [cameraId]: frameUrl }));
+
+      const eventSource = new EventSource(`http://localhost:5000/api/cctv-detections/${cameraId}`);
+
       eventSource.onmessage = (event) => {
-        const frame = JSON.parse(event.data);
-        if (frame.image) {
-          const frameUrl = `data:image/jpeg;base64,${frame.image}`;
-          setProcessedUrls(prev => ({ ...prev, [cameraId]: frameUrl }));
-        }
+        const record = JSON.parse(event.data);
+        setOverlays(prev => ({ ...prev, [cameraId]: record }));
       };
 
       eventSource.onerror = (error) => {
@@ -351,11 +397,13 @@ const Dashboard = () => {
         headers: {
           'Content-Type': 'application/json'
         },
-        body: JSON.stringify({ camera_id: cameraId })
+        body: JSON.stringify({ camera_id: cameraId, engine_id: engineIdsRef.current[cameraId] })
       });
+      delete engineIdsRef.current[cameraId];
 
-      // Clear the last frame
+      // Clear the last frame and its boxes
       setProcessedUrls(prev => ({ ...prev, [cameraId]: null }));
+      setOverlays(prev => ({ ...prev, [cameraId]: null }));
 
     } catch (err) {
       console.error('Error stopping CCTV:', err);
@@ -504,19 +552,40 @@ const Dashboard = () => {
                             onError={(e) => { console.error('Video playback error', e); alert('Video playback failed - check console'); }}
                           />
                         ) : (
-                          // Webcam and CCTV show image stream
-                          <img
-                            key={processedUrls[camera.id]}
-                            src={processedUrls[camera.id]}
-                            alt="Processed stream"
-                            style={{ 
-                              width: '100%', 
-                              maxHeight: 360, 
-                              objectFit: 'contain',
-                              backgroundColor: '#000'
-                            }}
-                            onError={(e) => { console.error('Stream display error', e); }}
-                          />
+                          // Webcam and CCTV: raw MJPEG with the latest detections drawn on top
+                          <div style={{ position: 'relative', width: '100%', height: 360, backgroundColor: '#000' }}>
+                            <img
+                              key={processedUrls[camera.id]}
+                              src={processedUrls[camera.id]}
+                              alt="Live stream"
+                              style={{ width: '100%', height: '100%', objectFit: 'contain' }}
+                              onError={(e) => { console.error('Stream display error', e); }}
+                            />
+                            {overlays[camera.id] && (
+                              <svg
+                                viewBox={`0 0 ${overlays[camera.id].width} ${overlays[camera.id].height}`}
+                                preserveAspectRatio="xMidYMid meet"
+                                style={{ position: 'absolute', inset: 0, width: '100%', height: '100%', pointerEvents: 'none' }}
+                              >
+                                {overlays[camera.id].detections.map((d, i) => (
+                                  <g key={d.track ?? i}>
+                                    <rect
+                                      x={d.box[0]}
+                                      y={d.box[1]}
+                                      width={d.box[2] - d.box[0]}
+                                      height={d.box[3] - d.box[1]}
+                                      fill="none"
+                                      stroke="#ef4444"
+                                      strokeWidth={3}
+                                    />
+                                    <text x={d.box[0]} y={Math.max(14, d.box[1] - 4)} fill="#ef4444" fontSize={14}>
+                                      {`${d.label} ${d.conf.toFixed(2)}`}
+                                    </text>
+                                  </g>
+                                ))}
+                              </svg>
+                            )}
+                          </div>
                         )
                       ) : (
                         // Placeholder when no output
@@ -618,7 +687,7 @@ const Dashboard = () => {
               <div className="tab-header">
                 <h2>Security Alerts</h2>
                 <div className="filter-options">
-                  <button className="primary-btn" onClick={fetchAlerts} disabled={loadingAlerts}>
+                  <button className="primary-btn" onClick={() => fetchAlerts()} disabled={loadingAlerts}>
                     {loadingAlerts ? '🔄 Refreshing...' : '🔄 Refresh'}
                   </button>
                 </div>
@@ -670,6 +739,13 @@ const Dashboard = () => {
                     </tbody>
                   </table>
                 )}
+                {alerts.length > 0 && alertsCursor !== null && (
+                  <div style={{ textAlign: 'center', padding: '16px' }}>
+                    <button className="primary-btn" onClick={() => fetchAlerts(alertsCursor)} disabled={loadingAlerts}>
+                      {loadingAlerts ? 'Loading...' : 'Load more'}
+                    </button>
+                  </div>
+                )}
               </div>
             </div>
           )}